@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+import configuracao_oxidized
+import falhas_oxidized
+import inventario_oxidized
+import shards_oxidized
+
+# Agendamento da coleta orientado a falhas.
+#
+# O Oxidized visita todos os nodos a cada "interval", e um equipamento morto
+# ocupa uma thread por timeout × retries em todo ciclo. A cada passe o agendador
+# lê o agregado de falhas (falhas/falhas.db) e a idade do último backup de cada
+# nodo (/nodes.json) e:
+#   - põe em espera (backoff exponencial) os nodos com falhas seguidas, tirando-os
+#     do inventário lido pelo Oxidized (router.ativo.db ou a view
+#     equipamentos_ativos da fonte sql) e chamando /reload;
+#   - devolve os nodos cuja espera venceu por uma fila lenta, com vagas limitadas
+#     por passe, e os coloca na frente da fila (/node/next);
+#   - antecipa (/node/next) os nodos saudáveis mais atrasados, com peso maior para
+#     grupos críticos e equipamentos cujo config mudou recentemente.
+# Um sucesso (node_success no sincronizador) zera as falhas seguidas, e o nodo volta ao ciclo normal;
+# um nodo liberado que passa duas vezes o interval sem nova falha também conta como recuperado.
+# Nodos novos em grande quantidade (recarga_oxidized.py) também ficam fora do
+# inventário até o horário de admissão, um lote por vez.
+
+CAMINHO_CONFIG = os.getenv("OXIDIZED_HOME", "/opt/oxidized")
+ARQUIVO_ATIVO = configuracao_oxidized.ARQUIVO_ATIVO
+ARQUIVO_ADMISSAO = "admissao.json"
+ARQUIVO_FILA_LENTA = "fila_lenta.json"
+ARQUIVO_ANTECIPADOS = "antecipados.json"
+
+
+def ler_config(caminho_config):
+    try:
+        with open(os.path.join(caminho_config, "config")) as f:
+            return f.read()
+    except FileNotFoundError:
+        return ""
+
+
+def intervalo_oxidized(texto_config):
+    encontrado = re.search(r"^interval: (\d+)\s*$", texto_config, re.M)
+    return int(encontrado.group(1)) if encontrado else 3600
+
+
+def url_rest(texto_config):
+    encontrado = re.search(r"^rest: .*:(\d+)\s*$", texto_config, re.M)
+    return f"http://127.0.0.1:{encontrado.group(1) if encontrado else 8888}"
+
+
+# (diretório, URL REST) de cada instância do Oxidized: a principal ou os shards
+def instancias(caminho_config):
+    definicao = shards_oxidized.ler_definicao(caminho_config)
+    if definicao:
+        return [(shards_oxidized.diretorio_shard(caminho_config, i), url)
+                for i, url in enumerate(shards_oxidized.urls_rest(definicao))]
+    return [(caminho_config, url_rest(ler_config(caminho_config)))]
+
+
+# Horário do Oxidized ("2026-03-01 08:00:00 UTC") em epoch
+def instante(texto):
+    try:
+        return datetime.strptime(texto.replace(" UTC", " +0000"), "%Y-%m-%d %H:%M:%S %z").timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+# Nodos em espera: {nodo: fim da espera}. Com "limiar" falhas seguidas o nodo espera "base"
+# segundos desde a última falha, e a espera dobra a cada falha seguinte até "maximo".
+def calcular_espera(falhando, limiar, base, maximo):
+    return {nodo: ultima + min(base * 2 ** (consecutivas - limiar), maximo)
+            for nodo, (consecutivas, ultima) in falhando.items() if consecutivas >= limiar}
+
+
+def ler_liberacoes(caminho_config):
+    try:
+        with open(os.path.join(caminho_config, ARQUIVO_FILA_LENTA)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+# Fila lenta: das esperas vencidas, só "vagas" nodos voltam por passe, em rodízio (primeiro os nunca
+# liberados, depois os liberados há mais tempo). "liberacoes" ({nodo: instante da liberação}) persiste entre
+# passes: um nodo liberado fica fora da espera até falhar de novo, sem ocupar as vagas dos demais. Se passar
+# "validade" segundos liberado sem nova falha ele conta como recuperado, mesmo que o sucesso não tenha chegado.
+# Devolve (nodos retidos, liberações atualizadas, recuperados).
+def separar_fila_lenta(espera, falhando, liberacoes, agora, vagas, validade):
+    retidos, atualizadas, recuperados, vencidos = {}, {}, [], []
+    for nodo, ate in espera.items():
+        liberado = liberacoes.get(nodo)
+        if liberado is not None and falhando[nodo][1] <= liberado:
+            if agora - liberado >= validade:
+                recuperados.append(nodo)
+            else:
+                atualizadas[nodo] = liberado
+            continue
+        if liberado is not None:
+            atualizadas[nodo] = liberado
+        if ate <= agora:
+            vencidos.append((liberado or 0, ate, nodo))
+        retidos[nodo] = ate
+    for _, _, nodo in sorted(vencidos)[:vagas]:
+        del retidos[nodo]
+        atualizadas[nodo] = agora
+    return retidos, atualizadas, recuperados
+
+
+MARCA_ESPERA = "# espera: "
+
+
+def usa_sql(diretorio):
+    return re.search(r"^\s*default: sql\s*$", ler_config(diretorio), re.M) is not None
+
+
+def marcados(ativo):
+    if not os.path.exists(ativo):
+        return set()
+    with open(ativo) as f:
+        return {linha[len(MARCA_ESPERA):].split(":", 1)[0].strip() for linha in f if linha.startswith(MARCA_ESPERA)}
+
+
+# Nodos hoje fora do inventário da instância: {nodo: fim da espera} (no router.ativo.db o fim não é gravado)
+def espera_aplicada(diretorio):
+    if usa_sql(diretorio):
+        conexao = inventario_oxidized.abrir_banco(os.path.join(diretorio, "inventario.db"))
+        espera = dict(conexao.execute("SELECT nome, ate FROM espera"))
+        conexao.close()
+        return espera
+    return dict.fromkeys(marcados(os.path.join(diretorio, ARQUIVO_ATIVO)), 0)
+
+
+# Aplica a espera ao inventário de uma instância; devolve os nodos que voltaram, os que ficam
+# fora e se o inventário lido pelo Oxidized mudou
+def aplicar_espera(diretorio, espera):
+    if usa_sql(diretorio):
+        conexao = inventario_oxidized.abrir_banco(os.path.join(diretorio, "inventario.db"))
+        with conexao:
+            antes = {nome for (nome,) in conexao.execute("SELECT nome FROM espera")}
+            presentes = {nome for (nome,) in conexao.execute("SELECT nome FROM equipamentos")}
+            depois = set(espera) & presentes
+            if depois != antes:
+                conexao.execute("DELETE FROM espera")
+                conexao.executemany("INSERT INTO espera (nome, ate) VALUES (?, ?)", ((n, espera[n]) for n in depois))
+        conexao.close()
+        return (antes - depois) & presentes, depois, depois != antes
+
+    # router.ativo.db: cópia do router.db com as linhas dos nodos em espera comentadas
+    ativo = os.path.join(diretorio, ARQUIVO_ATIVO)
+    antes = marcados(ativo)
+    presentes, depois, partes = set(), set(), []
+    with open(os.path.join(diretorio, "router.db")) as f:
+        for linha in f:
+            nome = linha.split(":", 1)[0].strip()
+            if linha.strip() and not linha.lstrip().startswith("#"):
+                presentes.add(nome)
+                if nome in espera:
+                    depois.add(nome)
+                    linha = MARCA_ESPERA + linha
+            partes.append(linha if linha.endswith("\n") else linha + "\n")
+    return (antes - depois) & presentes, depois, configuracao_oxidized.gravar_se_mudou(ativo, "".join(partes))
+
+
+def ler_admissao(caminho_config):
+    try:
+        with open(os.path.join(caminho_config, ARQUIVO_ADMISSAO)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+# Admissão escalonada dos nodos novos: {nodo: instante em que entra no inventário}. Os "lote" primeiros
+# entram já e os demais um lote a cada "passo" segundos, depois dos que ainda aguardam; vencidos saem do arquivo.
+def admitir(caminho_config, novos, lote, passo, agora):
+    admissao = {nodo: ate for nodo, ate in ler_admissao(caminho_config).items() if ate > agora}
+    if lote > 0:
+        fila = [nodo for nodo in novos if nodo not in admissao]
+        for posicao, nodo in enumerate(fila, len(admissao)):
+            if posicao >= lote:
+                admissao[nodo] = agora + passo * (posicao // lote)
+    configuracao_oxidized.gravar_se_mudou(os.path.join(caminho_config, ARQUIVO_ADMISSAO),
+                                          json.dumps(admissao, indent=1, sort_keys=True) + "\n")
+    return admissao
+
+
+# Nodos já empurrados para a frente da fila: {nodo: instante do /node/next}
+def ler_antecipados(caminho_config):
+    try:
+        with open(os.path.join(caminho_config, ARQUIVO_ANTECIPADOS)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def requisitar(url, caminho, timeout=10):
+    with urllib.request.urlopen(url + caminho, timeout=timeout) as resposta:
+        return resposta.read()
+
+
+def antecipar(url, nodo):
+    requisitar(url, f"/node/next/{urllib.parse.quote(nodo, safe='')}.json")
+
+
+# Nodos saudáveis por prioridade: atraso do backup em relação ao intervalo, com os pesos aplicados.
+# Só entram os que já passaram do próprio prazo (intervalo / peso); nunca coletados vêm primeiro.
+# Um nodo antecipado que ainda não terminou uma coleta depois disso (ex.: nunca coletado) não é
+# empurrado de novo antes de um intervalo, para não tomar o orçamento dos realmente atrasados.
+def priorizar(nodos, fora, agora, intervalo, criticos, peso_critico, janela_recente, peso_recente, antecipados=None):
+    antecipados = antecipados or {}
+    candidatos = []
+    for item in nodos:
+        nome = item.get("name")
+        if not nome or nome in fora:
+            continue
+        fim = instante((item.get("last") or {}).get("end"))
+        antecipado = antecipados.get(nome)
+        if antecipado is not None and (fim is None or fim < antecipado) and agora - antecipado < intervalo:
+            continue
+        peso = peso_critico if (item.get("group") or "") in criticos else 1.0
+        alteracao = instante(item.get("mtime"))
+        if alteracao and agora - alteracao <= janela_recente:
+            peso *= peso_recente
+        atraso = float("inf") if fim is None else (agora - fim) * peso / intervalo
+        if atraso >= 1:
+            candidatos.append((atraso, nome))
+    candidatos.sort(key=lambda c: (-c[0], c[1]))
+    return [nome for _, nome in candidatos]
+
+
+def gravar_metricas(caminho_config, espera, contadores):
+    linhas = [
+        "# HELP oxidized_scheduler_backoff_nodes Nodos fora do inventário do Oxidized por falhas seguidas.",
+        "# TYPE oxidized_scheduler_backoff_nodes gauge",
+        f"oxidized_scheduler_backoff_nodes {len(espera)}",
+        "# HELP oxidized_scheduler_backoff_until_timestamp_seconds Fim da espera de cada nodo em backoff.",
+        "# TYPE oxidized_scheduler_backoff_until_timestamp_seconds gauge",
+    ]
+    linhas += [f'oxidized_scheduler_backoff_until_timestamp_seconds{{name="{escapar(n)}"}} {ate:.0f}'
+               for n, ate in sorted(espera.items())]
+    for chave, metrica, ajuda in (("admissao", "oxidized_scheduler_admission_nodes", "Nodos novos aguardando a admissão escalonada."),
+                                  ("prioridade", "oxidized_scheduler_priority_pushes", "Nodos antecipados por atraso no último passe."),
+                                  ("lenta", "oxidized_scheduler_slow_lane_pushes", "Nodos devolvidos pela fila lenta no último passe."),
+                                  ("recargas", "oxidized_scheduler_reloads", "Recargas do inventário pedidas no último passe."),
+                                  ("erros", "oxidized_scheduler_errors", "Chamadas à API REST que falharam no último passe.")):
+        linhas += [f"# HELP {metrica} {ajuda}", f"# TYPE {metrica} gauge", f"{metrica} {contadores[chave]}"]
+    linhas += [
+        "# HELP oxidized_scheduler_last_run_timestamp_seconds Fim do último passe do agendador.",
+        "# TYPE oxidized_scheduler_last_run_timestamp_seconds gauge",
+        f"oxidized_scheduler_last_run_timestamp_seconds {time.time():.3f}",
+    ]
+    diretorio = os.path.join(caminho_config, "metricas")
+    os.makedirs(diretorio, exist_ok=True)
+    descritor, temporario = tempfile.mkstemp(prefix=".agendador.", dir=diretorio)
+    with os.fdopen(descritor, "w") as f:
+        f.write("\n".join(linhas) + "\n")
+    os.chmod(temporario, 0o644)
+    os.replace(temporario, os.path.join(diretorio, "agendador.prom"))
+
+
+def executar_passe(args, usar_rest=True):
+    agora = time.time()
+    texto_config = ler_config(args.base)
+    intervalo = intervalo_oxidized(texto_config)
+    base_espera = args.espera_base or intervalo
+    falhando = falhas_oxidized.nodos_falhando(args.base, args.limiar)
+    espera = calcular_espera(falhando, args.limiar, base_espera, args.espera_maxima)
+    espera, liberacoes, recuperados = separar_fila_lenta(espera, falhando, ler_liberacoes(args.base), agora,
+                                                         args.vagas_lentas, args.validade_liberacao or 2 * intervalo)
+    if recuperados:
+        falhas_oxidized.registrar_sucessos(args.base, recuperados)
+    configuracao_oxidized.gravar_se_mudou(os.path.join(args.base, ARQUIVO_FILA_LENTA),
+                                          json.dumps(liberacoes, indent=1, sort_keys=True) + "\n")
+    admissao = {nodo: ate for nodo, ate in ler_admissao(args.base).items() if ate > agora}
+    retidos = dict(espera)
+    for nodo, ate in admissao.items():
+        retidos[nodo] = max(ate, retidos.get(nodo, 0))
+    contadores = {"admissao": len(admissao), "prioridade": 0, "lenta": 0, "recargas": 0, "erros": 0}
+    antecipados = {nodo: empurrado for nodo, empurrado in ler_antecipados(args.base).items()
+                   if agora - empurrado < intervalo}
+
+    for diretorio, url in instancias(args.base):
+        if not os.path.exists(os.path.join(diretorio, "router.db")):
+            continue
+        liberados, depois, mudou = aplicar_espera(diretorio, retidos)
+        if not usar_rest:
+            continue
+        try:
+            if mudou:
+                requisitar(url, "/reload.json")
+                contadores["recargas"] += 1
+            # Liberados pela fila lenta vão direto para a frente da fila: a espera já foi cumprida
+            for nodo in sorted(liberados):
+                antecipar(url, nodo)
+                contadores["lenta"] += 1
+            nodos = json.loads(requisitar(url, "/nodes.json"))
+            fila = priorizar(nodos, depois, agora, intervalo, set(args.grupo_critico), args.peso_critico,
+                             args.recente_horas * 3600, args.peso_recente, antecipados)
+            for nodo in fila[:args.orcamento]:
+                antecipar(url, nodo)
+                antecipados[nodo] = agora
+                contadores["prioridade"] += 1
+        except (OSError, ValueError) as e:
+            print(f"Erro ao falar com o Oxidized em {url}: {e}", flush=True)
+            contadores["erros"] += 1
+
+    if usar_rest:
+        configuracao_oxidized.gravar_se_mudou(os.path.join(args.base, ARQUIVO_ANTECIPADOS),
+                                              json.dumps(antecipados, indent=1, sort_keys=True) + "\n")
+    gravar_metricas(args.base, espera, contadores)
+    return espera, contadores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Agendamento da coleta do Oxidized com backoff de nodos com falha")
+    parser.add_argument("--base", default=CAMINHO_CONFIG, help="Diretório base do Oxidized (padrão: %(default)s)")
+    parser.add_argument("--limiar", type=int, default=3, help="Falhas seguidas para o nodo entrar em espera")
+    parser.add_argument("--espera-base", type=float, default=0,
+                        help="Primeira espera em segundos, dobrada a cada nova falha (padrão: o interval do Oxidized)")
+    parser.add_argument("--espera-maxima", type=float, default=86400, help="Espera máxima em segundos")
+    parser.add_argument("--vagas-lentas", type=int, default=5, help="Nodos devolvidos pela fila lenta por passe")
+    parser.add_argument("--validade-liberacao", type=float, default=0,
+                        help="Segundos sem nova falha após a liberação para o nodo contar como recuperado "
+                             "(padrão: 2 × o interval do Oxidized)")
+    parser.add_argument("--orcamento", type=int, default=10, help="Nodos saudáveis antecipados por passe (por instância)")
+    parser.add_argument("--grupo-critico", action="append", default=[], help="Grupo coletado com prioridade; pode repetir")
+    parser.add_argument("--peso-critico", type=float, default=4, help="Grupos críticos são coletados a cada interval / peso")
+    parser.add_argument("--recente-horas", type=float, default=24, help="Janela em que um config alterado conta como recente")
+    parser.add_argument("--peso-recente", type=float, default=2, help="Peso dos nodos com config alterado recentemente")
+    sub = parser.add_subparsers(dest="acao", required=True)
+
+    p_executar = sub.add_parser("executar", help="Executa um passe")
+    p_executar.add_argument("--sem-rest", action="store_true",
+                            help="Só atualiza o inventário ativo, sem chamar a API (ex.: antes de iniciar o Oxidized)")
+    p_servir = sub.add_parser("servir", help="Executa um passe a cada --intervalo segundos")
+    p_servir.add_argument("--intervalo", type=float, default=60)
+    sub.add_parser("listar", help="Mostra os nodos em espera")
+
+    args = parser.parse_args()
+
+    if args.acao == "executar":
+        espera, contadores = executar_passe(args, usar_rest=not args.sem_rest)
+        print(f"{len(espera)} nodo(s) em espera; {contadores['lenta']} devolvido(s) pela fila lenta, "
+              f"{contadores['prioridade']} antecipado(s), {contadores['erros']} erro(s) de API")
+    elif args.acao == "servir":
+        print(f"Agendador ativo, passe a cada {args.intervalo}s", flush=True)
+        while True:
+            try:
+                executar_passe(args)
+            except (OSError, sqlite3.Error) as e:
+                print(f"Erro no passe do agendador: {e}", flush=True)
+            time.sleep(args.intervalo)
+    elif args.acao == "listar":
+        intervalo = intervalo_oxidized(ler_config(args.base))
+        falhando = falhas_oxidized.nodos_falhando(args.base, args.limiar)
+        espera = calcular_espera(falhando, args.limiar, args.espera_base or intervalo, args.espera_maxima)
+        for nodo, ate in sorted(espera.items(), key=lambda e: e[1]):
+            situacao = "vencida" if ate <= time.time() else time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ate))
+            print(f"{nodo:<30} falhas={falhando[nodo][0]:<5} espera até {situacao}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+import argparse
+import difflib
+import json
+import math
+import os
+import re
+import sys
+import urllib.request
+from collections import Counter
+
+import configuracao_oxidized
+import falhas_oxidized
+
+# Ajuste de concorrência do Oxidized.
+#
+# Lê a duração e o status da última coleta de cada nodo pela API REST
+# (/nodes.json) e as falhas registradas (falhas_oxidized.py), e calcula
+# "threads" e "timeout" para que um ciclo completo termine dentro do
+# "interval". Por padrão só mostra o diff; com --aplicar reescreve o config.
+
+CAMINHO_CONFIG = os.getenv("OXIDIZED_HOME", "/opt/oxidized")
+
+
+def ler_nodes(url_rest, arquivo=None):
+    if arquivo:
+        with open(arquivo) as f:
+            return json.load(f)
+    with urllib.request.urlopen(f"{url_rest.rstrip('/')}/nodes.json", timeout=30) as resposta:
+        return json.load(resposta)
+
+
+# Conta falhas por nodo: agregado do falhas_oxidized.py ou, em instalações antigas,
+# o log do hook error_report ("... | Nodo: X | Status: ... | Erro: ... | Motivo: ...")
+def ler_falhas(arquivo_log, caminho_config=CAMINHO_CONFIG):
+    falhas, timeouts = Counter(), Counter()
+    banco = falhas_oxidized.caminhos(caminho_config)["banco"]
+    if os.path.exists(banco):
+        for nodo in falhas_oxidized.top_nodos(caminho_config, limite=-1):
+            if nodo["falhas_consecutivas"]:
+                falhas[nodo["nodo"]] = nodo["falhas_consecutivas"]
+                if "timeout" in (nodo["ultimo_erro"] or "").lower():
+                    timeouts[nodo["nodo"]] = nodo["falhas_consecutivas"]
+        return falhas, timeouts
+    if not os.path.exists(arquivo_log):
+        return falhas, timeouts
+    with open(arquivo_log, errors="replace") as f:
+        for linha in f:
+            encontrado = re.search(r"Nodo: ([^|]+?) \|.*Erro: ([^|]*)", linha)
+            if not encontrado:
+                continue
+            nodo, erro = encontrado.group(1).strip(), encontrado.group(2)
+            falhas[nodo] += 1
+            if "timeout" in erro.lower():
+                timeouts[nodo] += 1
+    return falhas, timeouts
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(math.ceil(p / 100 * len(ordenados))) - 1)]
+
+
+# Calcula threads/timeout a partir das durações observadas
+def calcular(nodes, falhas, timeouts, atual, args):
+    duracoes_ok = []
+    falhando = 0
+    for node in nodes:
+        ultimo = node.get("last") or {}
+        if ultimo.get("status") == "success" and ultimo.get("time") is not None:
+            duracoes_ok.append(float(ultimo["time"]))
+        elif ultimo.get("status") in ("fail", "no_connection") or falhas.get(node.get("name"), 0):
+            falhando += 1
+    nunca_coletados = len(nodes) - len(duracoes_ok) - falhando
+
+    # Timeout: folga sobre o p99 das coletas bem-sucedidas, para não esperar à toa por nodos mortos
+    p99 = percentil(duracoes_ok, 99)
+    timeout = atual.get("timeout", 20)
+    if duracoes_ok:
+        timeout = int(min(args.timeout_maximo, max(args.timeout_minimo, math.ceil(p99 * args.fator_timeout))))
+
+    # Custo de um ciclo: nodos ok pela média observada; falhando tentam (retries + 1) vezes até o timeout
+    retries = atual.get("retries", 3)
+    media_ok = sum(duracoes_ok) / len(duracoes_ok) if duracoes_ok else timeout / 2
+    trabalho = (len(duracoes_ok) + nunca_coletados) * media_ok + falhando * timeout * (retries + 1)
+
+    intervalo = atual.get("interval", 3600)
+    threads = math.ceil(trabalho / (intervalo * args.ocupacao)) if trabalho else 1
+    threads = max(args.threads_minimo, min(args.threads_maximo, threads))
+
+    return {
+        "nodos": len(nodes),
+        "ok": len(duracoes_ok),
+        "falhando": falhando,
+        "nunca_coletados": nunca_coletados,
+        "media_ok": media_ok,
+        "p99_ok": p99,
+        "nodos_com_timeout": sum(1 for n in timeouts if timeouts[n]),
+        "trabalho": trabalho,
+        "ciclo_estimado": trabalho / threads if threads else 0,
+        "threads": threads,
+        "timeout": timeout,
+    }
+
+
+def aplicar_parametros(texto, novos):
+    for chave, valor in novos.items():
+        texto = re.sub(rf"^{chave}:\s*\d+\s*$", f"{chave}: {valor}", texto, flags=re.M)
+    return texto
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calcula threads/timeout do Oxidized a partir das coletas observadas")
+    parser.add_argument("--config", default=os.path.join(CAMINHO_CONFIG, "config"))
+    parser.add_argument("--rest", default="http://127.0.0.1:8888", help="URL da API REST do Oxidized")
+    parser.add_argument("--arquivo-nodes", help="Usa um /nodes.json salvo em vez de consultar a API")
+    parser.add_argument("--base", default=CAMINHO_CONFIG, help="Diretório base do Oxidized (padrão: %(default)s)")
+    parser.add_argument("--falhas", default=os.path.join(CAMINHO_CONFIG, "last_failures.log"),
+                        help="Log antigo usado quando ainda não há registro estruturado de falhas")
+    parser.add_argument("--ocupacao", type=float, default=0.8, help="Fração do interval que um ciclo pode ocupar")
+    parser.add_argument("--fator-timeout", type=float, default=3.0, help="Multiplicador sobre o p99 das coletas ok")
+    parser.add_argument("--timeout-minimo", type=int, default=10)
+    parser.add_argument("--timeout-maximo", type=int, default=120)
+    parser.add_argument("--threads-minimo", type=int, default=4)
+    parser.add_argument("--threads-maximo", type=int, default=200)
+    parser.add_argument("--aplicar", action="store_true", help="Grava o config (padrão: apenas mostra o diff)")
+    args = parser.parse_args()
+
+    try:
+        nodes = ler_nodes(args.rest, args.arquivo_nodes)
+    except (OSError, ValueError) as e:
+        print(f"Erro ao consultar os nodos do Oxidized: {e}")
+        sys.exit(1)
+
+    with open(args.config) as f:
+        texto = f.read()
+    atual = configuracao_oxidized.ler_parametros(texto)
+    falhas, timeouts = ler_falhas(args.falhas, args.base)
+    resultado = calcular(nodes, falhas, timeouts, atual, args)
+
+    print(f"Nodos: {resultado['nodos']} (ok: {resultado['ok']}, falhando: {resultado['falhando']}, "
+          f"nunca coletados: {resultado['nunca_coletados']}, com timeout no log: {resultado['nodos_com_timeout']})")
+    print(f"Coleta ok: média {resultado['media_ok']:.1f}s, p99 {resultado['p99_ok']:.1f}s")
+    print(f"Trabalho por ciclo: {resultado['trabalho']:.0f}s de thread | interval: {atual.get('interval', 3600)}s")
+    print(f"Ciclo estimado com {resultado['threads']} threads: {resultado['ciclo_estimado']:.0f}s")
+
+    novo_texto = aplicar_parametros(texto, {"threads": resultado["threads"], "timeout": resultado["timeout"]})
+    if novo_texto == texto:
+        print("Config já está ajustado.")
+        return
+    sys.stdout.writelines(difflib.unified_diff(texto.splitlines(True), novo_texto.splitlines(True), args.config, args.config))
+    if args.aplicar:
+        configuracao_oxidized.gravar_se_mudou(args.config, novo_texto, os.stat(args.config).st_mode & 0o777)
+        print("Config atualizado. Reinicie o Oxidized para aplicar: sudo systemctl restart oxidized")
+    else:
+        print("Modo simulação: use --aplicar para gravar.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import configuracao_oxidized
+import sync_oxidized
+
+# Benchmark do pipeline de coleta + sincronização.
+#
+# Sobe uma fazenda de dispositivos falsos (SSH com asyncssh, se instalado, ou
+# telnet com asyncio) que respondem ao "prompt" configurado no Oxidized, gera um
+# router.db com N nodos e um remoto bare local no lugar do GitHub. Cada ciclo
+# coleta todos os nodos, grava os configs alterados no repositório configs (um
+# commit por nodo, como a saída git do Oxidized), executa o hook post_store real
+# e roda uma sincronização em lote do sync_oxidized.py. A mesma carga é repetida
+# para cada estratégia de espelhamento.
+
+PROMPT = re.compile(rb"(?m)^[\w.@-]+[#>]\s?$")
+SENHA = "benchmark"
+
+try:
+    import asyncssh
+except ImportError:
+    asyncssh = None
+
+
+def nodos_benchmark(quantidade, grupos):
+    return [(f"bench{i:05d}", f"grupo{i % grupos:02d}") for i in range(quantidade)]
+
+
+# Linhas no formato do router.db (nome:ip:modelo:usuario:senha:porta:grupo); o usuário identifica o nodo na fazenda
+def gerar_router_db(nodos, porta):
+    return "".join(f"{nome}:127.0.0.1:ios:{nome}:{SENHA}:{porta}:{grupo}\n" for nome, grupo in nodos)
+
+
+class Fazenda:
+    def __init__(self, linhas=300):
+        self.linhas = linhas
+        self.versoes = {}
+        self.cache = {}
+
+    def config(self, nome):
+        versao = self.versoes.get(nome, 0)
+        chave = (nome, versao)
+        if chave not in self.cache:
+            partes = [f"hostname {nome}", f"! revisao {versao}"]
+            for i in range((self.linhas - 2) // 3):
+                partes += [f"interface GigabitEthernet0/{i}", f" description {nome}-porta-{i}", "!"]
+            self.cache = {k: v for k, v in self.cache.items() if k[0] != nome}
+            self.cache[chave] = ("\r\n".join(partes) + "\r\n").encode()
+        return self.cache[chave]
+
+    # Muda o config de uma fração dos nodos (mesma seleção para a mesma semente)
+    def alterar(self, nodos, fracao, rng):
+        escolhidos = rng.sample(nodos, int(len(nodos) * fracao))
+        for nome, _ in escolhidos:
+            self.versoes[nome] = self.versoes.get(nome, 0) + 1
+        return len(escolhidos)
+
+    async def atender(self, leitor, escritor, nome):
+        prompt = f"{nome}#".encode()
+        escritor.write(b"\r\n" + prompt)
+        while True:
+            linha = await leitor.readline()
+            if not linha:
+                break
+            comando = linha.decode(errors="replace").strip()
+            if comando in ("exit", "quit", "logout"):
+                break
+            if comando.startswith(("show run", "display current")):
+                saida = self.config(nome)
+            elif comando.startswith(("show", "display")):
+                saida = f"{nome} dispositivo de benchmark\r\n".encode()
+            else:
+                saida = b""
+            escritor.write(saida + prompt)
+            await escritor.drain()
+        escritor.close()
+
+    async def atender_telnet(self, leitor, escritor):
+        try:
+            escritor.write(b"Username: ")
+            nome = (await leitor.readline()).decode(errors="replace").strip()
+            escritor.write(b"Password: ")
+            await leitor.readline()
+            await self.atender(leitor, escritor, nome)
+        except ConnectionError:
+            pass
+
+    async def iniciar(self, porta, protocolo):
+        if protocolo == "telnet":
+            return await asyncio.start_server(self.atender_telnet, "127.0.0.1", porta, limit=1024 * 1024)
+
+        fazenda = self
+
+        class ServidorSSH(asyncssh.SSHServer):
+            def begin_auth(self, username):
+                return True
+
+            def password_auth_supported(self):
+                return True
+
+            def validate_password(self, username, password):
+                return True
+
+        async def processo(processo_ssh):
+            await fazenda.atender(processo_ssh.stdin, processo_ssh.stdout, processo_ssh.get_extra_info("username"))
+            processo_ssh.exit(0)
+
+        return await asyncssh.create_server(ServidorSSH, "127.0.0.1", porta, encoding=None,
+                                            server_host_keys=[asyncssh.generate_private_key("ssh-ed25519")],
+                                            process_factory=processo)
+
+
+async def ler_ate(leitor, padrao, limite):
+    partes, cauda = [], b""
+    while True:
+        bloco = await asyncio.wait_for(leitor.read(65536), limite)
+        if not bloco:
+            raise ConnectionError("conexão encerrada pelo dispositivo")
+        partes.append(bloco)
+        cauda = (cauda + bloco)[-256:]
+        if padrao.search(cauda):
+            return b"".join(partes)
+
+
+# Coleta no lugar do Oxidized: login, "show running-config" até o prompt, sem o prompt final
+async def coletar(nome, porta, protocolo, limite):
+    if protocolo == "telnet":
+        leitor, escritor = await asyncio.open_connection("127.0.0.1", porta, limit=1024 * 1024)
+        await ler_ate(leitor, re.compile(rb"Username: $"), limite)
+        escritor.write(nome.encode() + b"\n")
+        await ler_ate(leitor, re.compile(rb"Password: $"), limite)
+        escritor.write(SENHA.encode() + b"\n")
+        conexao = None
+    else:
+        conexao = await asyncssh.connect("127.0.0.1", porta, username=nome, password=SENHA, known_hosts=None)
+        processo = await conexao.create_process(encoding=None)
+        leitor, escritor = processo.stdout, processo.stdin
+    try:
+        await ler_ate(leitor, PROMPT, limite)
+        escritor.write(b"terminal length 0\n")
+        await ler_ate(leitor, PROMPT, limite)
+        escritor.write(b"show running-config\n")
+        saida = await ler_ate(leitor, PROMPT, limite)
+        escritor.write(b"exit\n")
+    finally:
+        escritor.close()
+        if conexao is not None:
+            conexao.close()
+    return saida[:saida.rfind(b"\n") + 1]
+
+
+def io_disco():
+    proprio = resource.getrusage(resource.RUSAGE_SELF)
+    filhos = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (proprio.ru_inblock + filhos.ru_inblock) * 512, (proprio.ru_oublock + filhos.ru_oublock) * 512
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p / 100))]
+
+
+def git(*argumentos, **opcoes):
+    return subprocess.run(["git"] + list(argumentos), check=True, capture_output=True, **opcoes)
+
+
+# Diretório base descartável com a mesma estrutura de /opt/oxidized e um remoto bare local
+def preparar_base(diretorio, nodos, porta):
+    base = os.path.join(diretorio, "base")
+    remoto = os.path.join(diretorio, "remoto.git")
+    os.makedirs(os.path.join(base, "spool"))
+    git("init", "-q", "--bare", "-b", "master", remoto)
+    for repositorio in ("configs", "repo_sync"):
+        caminho = os.path.join(base, repositorio)
+        git("init", "-q", "-b", "master", caminho)
+        git("-C", caminho, "config", "user.name", "Oxidized")
+        git("-C", caminho, "config", "user.email", "oxidized@backup.local")
+    git("-C", os.path.join(base, "repo_sync"), "remote", "add", "origin", remoto)
+    with open(os.path.join(base, "router.db"), "w") as f:
+        f.write(gerar_router_db(nodos, porta))
+    with open(os.path.join(base, "config"), "w") as f:
+        f.write("---\ninterval: 3600\nthreads: 30\ntimeout: 20\n")
+    return base
+
+
+class Coletor:
+    def __init__(self, base, porta, protocolo, concorrencia, limite):
+        self.base = base
+        self.configs = os.path.join(base, "configs")
+        self.porta = porta
+        self.protocolo = protocolo
+        self.concorrencia = concorrencia
+        self.limite = limite
+        self.anteriores = {}
+        # Mesmo hook post_store que o configuracao_oxidized.py grava no config do Oxidized, apontado para a base descartável
+        self.hook = configuracao_oxidized.comando_hook(configuracao_oxidized.Configuracao(usuario="oxidized", caminho_config=base))
+
+    async def ciclo(self, nodos):
+        semaforo = asyncio.Semaphore(self.concorrencia)
+        existe = subprocess.run(["git", "-C", self.configs, "rev-parse", "-q", "--verify", "HEAD"],
+                                capture_output=True).returncode == 0
+        importador = subprocess.Popen(["git", "-C", self.configs, "fast-import", "--quiet", "--date-format=now"],
+                                      stdin=subprocess.PIPE)
+        resultado = {"armazenados": 0, "falhas": 0, "hooks": []}
+
+        def armazenar(nome, grupo, conteudo):
+            nonlocal existe
+            caminho = f"{grupo}/{nome}"
+            mensagem = f"update {caminho}".encode()
+            bloco = b"commit refs/heads/master\ncommitter Oxidized <oxidized@backup.local> now\n"
+            bloco += b"data %d\n%s\n" % (len(mensagem), mensagem)
+            if existe:
+                bloco += b"from refs/heads/master^0\n"
+                existe = False
+            bloco += b"M 100644 inline %s\ndata %d\n%s\n" % (caminho.encode(), len(conteudo), conteudo)
+            importador.stdin.write(bloco)
+            os.makedirs(os.path.join(self.configs, grupo), exist_ok=True)
+            with open(os.path.join(self.configs, caminho), "wb") as f:
+                f.write(conteudo)
+
+        async def um(nome, grupo):
+            try:
+                async with semaforo:
+                    inicio_coleta = time.monotonic()
+                    conteudo = await coletar(nome, self.porta, self.protocolo, self.limite)
+                    duracao_coleta = time.monotonic() - inicio_coleta
+            except (OSError, asyncio.TimeoutError) as e:
+                resultado["falhas"] += 1
+                print(f"Falha ao coletar {nome}: {e!r}", file=sys.stderr)
+                return
+            if self.anteriores.get(nome) == conteudo:
+                return
+            self.anteriores[nome] = conteudo
+            armazenar(nome, grupo, conteudo)
+            resultado["armazenados"] += 1
+            inicio = time.monotonic()
+            processo = await asyncio.create_subprocess_shell(
+                self.hook, env=dict(os.environ, OX_NODE_NAME=nome, OX_NODE_GROUP=grupo, OX_JOB_TIME=f"{duracao_coleta:.3f}"))
+            await processo.wait()
+            resultado["hooks"].append(time.monotonic() - inicio)
+
+        await asyncio.gather(*(um(nome, grupo) for nome, grupo in nodos))
+        importador.stdin.close()
+        importador.wait()
+        return resultado
+
+
+# Um lote do daemon: consome o spool e sincroniza com a estratégia escolhida
+def sincronizar_lote(base, estrategia):
+    metricas = sync_oxidized.Metricas()
+    dirs = sync_oxidized.caminhos(base)
+    os.makedirs(dirs["processando"], exist_ok=True)
+    eventos = sync_oxidized.coletar_eventos(dirs)
+    with contextlib.redirect_stdout(io.StringIO()):
+        sucesso = sync_oxidized.sincronizar(base, estrategia, metricas)
+    if sucesso:
+        sync_oxidized.descartar_eventos(dirs, eventos)
+    return sucesso, metricas
+
+
+async def executar_estrategia(args, estrategia, nodos):
+    if args.diretorio:
+        os.makedirs(args.diretorio, exist_ok=True)
+    diretorio = tempfile.mkdtemp(prefix=f"bench-{estrategia}-", dir=args.diretorio)
+    fazenda = Fazenda(args.linhas)
+    servidor = await fazenda.iniciar(args.porta, args.protocolo)
+    try:
+        base = preparar_base(diretorio, nodos, args.porta)
+        coletor = Coletor(base, args.porta, args.protocolo, args.concorrencia, args.timeout)
+        ciclos = []
+        for ciclo in range(1, args.ciclos + 1):
+            if ciclo > 1:
+                fazenda.alterar(nodos, args.mudancas, random.Random(args.semente + ciclo))
+            leitura, escrita = io_disco()
+            inicio = time.monotonic()
+            resultado = await coletor.ciclo(nodos)
+            coleta = time.monotonic() - inicio
+            sucesso, metricas = sincronizar_lote(base, estrategia)
+            total = time.monotonic() - inicio
+            leitura_fim, escrita_fim = io_disco()
+            ciclos.append({
+                "ciclo": ciclo,
+                "coleta": coleta,
+                "armazenados": resultado["armazenados"],
+                "falhas_coleta": resultado["falhas"],
+                "hook_p50": percentil(resultado["hooks"], 50),
+                "hook_p99": percentil(resultado["hooks"], 99),
+                "sincronizacao": total - coleta,
+                "sincronizacao_ok": sucesso,
+                "push": metricas.push_duracao,
+                "push_bytes": metricas.bytes_enviados,
+                "leitura_bytes": leitura_fim - leitura,
+                "escrita_bytes": escrita_fim - escrita,
+                "total": total,
+                "etapas": {span["etapa"]: span["duracao"] for span in metricas.rastros.listar()},
+            })
+            imprimir_ciclo(estrategia, ciclos[-1])
+    finally:
+        servidor.close()
+        await servidor.wait_closed()
+        if not args.manter:
+            shutil.rmtree(diretorio, ignore_errors=True)
+    return ciclos
+
+
+def imprimir_ciclo(estrategia, c):
+    print(f"{estrategia:<12} {c['ciclo']:>5} {c['coleta']:>9.2f} {c['armazenados']:>7} "
+          f"{c['hook_p50'] * 1000:>8.1f} {c['hook_p99'] * 1000:>8.1f} {c['sincronizacao']:>8.2f} "
+          f"{c['push']:>7.2f} {c['push_bytes'] / 1024:>9.0f} {c['leitura_bytes'] / 1048576:>8.1f} "
+          f"{c['escrita_bytes'] / 1048576:>8.1f} {c['total']:>8.2f}{'' if c['sincronizacao_ok'] else '  ERRO'}", flush=True)
+
+
+# Compara a média de duração por ciclo com um resultado salvo; devolve as estratégias que pioraram
+def regressoes(resultados, referencia, tolerancia):
+    piores = []
+    for estrategia, ciclos in resultados.items():
+        anteriores = referencia.get("estrategias", {}).get(estrategia)
+        if not anteriores or not ciclos:
+            continue
+        atual = sum(c["total"] for c in ciclos) / len(ciclos)
+        base = sum(c["total"] for c in anteriores) / len(anteriores)
+        if base and atual > base * (1 + tolerancia):
+            piores.append((estrategia, base, atual))
+    return piores
+
+
+async def executar(args):
+    nodos = nodos_benchmark(args.nodos, args.grupos)
+    print(f"{args.nodos} nodos, {args.ciclos} ciclo(s), {args.mudancas:.0%} alterados por ciclo, "
+          f"protocolo {args.protocolo}, concorrência {args.concorrencia}")
+    print(f"{'estratégia':<12} {'ciclo':>5} {'coleta(s)':>9} {'gravados':>7} {'hook p50':>8} {'hook p99':>8} "
+          f"{'sync(s)':>8} {'push(s)':>7} {'push(KiB)':>9} {'lido(MiB)':>8} {'escr(MiB)':>8} {'total(s)':>8}")
+    resultados = {}
+    for estrategia in args.estrategias:
+        # O incremental também usa rsync: sem base de espelho (primeiro lote) ele cai no espelhamento completo
+        if estrategia != "replicacao" and not shutil.which("rsync"):
+            print(f"{estrategia}: rsync não encontrado, estratégia ignorada.")
+            continue
+        resultados[estrategia] = await executar_estrategia(args, estrategia, nodos)
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da coleta + sincronização com dispositivos falsos e remoto local")
+    sub = parser.add_subparsers(dest="acao", required=True)
+
+    p_gerar = sub.add_parser("gerar", help="Gera um router.db com N nodos apontando para a fazenda")
+    p_gerar.add_argument("--nodos", type=int, default=1000)
+    p_gerar.add_argument("--grupos", type=int, default=10)
+    p_gerar.add_argument("--porta", type=int, default=2222)
+    p_gerar.add_argument("--saida", default="router.db")
+
+    p_fazenda = sub.add_parser("fazenda", help="Mantém a fazenda de dispositivos no ar (para um Oxidized real)")
+    p_fazenda.add_argument("--porta", type=int, default=2222)
+    p_fazenda.add_argument("--linhas", type=int, default=300, help="Linhas do config de cada dispositivo")
+
+    p_executar = sub.add_parser("executar", help="Executa os ciclos para cada estratégia de sincronização")
+    p_executar.add_argument("--nodos", type=int, default=500)
+    p_executar.add_argument("--grupos", type=int, default=10)
+    p_executar.add_argument("--ciclos", type=int, default=3)
+    p_executar.add_argument("--mudancas", type=float, default=0.1, help="Fração dos nodos alterada a cada ciclo")
+    p_executar.add_argument("--linhas", type=int, default=300, help="Linhas do config de cada dispositivo")
+    p_executar.add_argument("--concorrencia", type=int, default=30, help="Coletas simultâneas (threads do Oxidized)")
+    p_executar.add_argument("--timeout", type=float, default=20)
+    p_executar.add_argument("--estrategias", nargs="+", choices=["incremental", "completo", "replicacao"],
+                            default=["incremental", "completo", "replicacao"])
+    p_executar.add_argument("--porta", type=int, default=2222)
+    p_executar.add_argument("--semente", type=int, default=1)
+    p_executar.add_argument("--diretorio", default=None, help="Onde criar os repositórios temporários")
+    p_executar.add_argument("--manter", action="store_true", help="Não apaga os repositórios ao terminar")
+    p_executar.add_argument("--json", help="Grava os resultados neste arquivo")
+    p_executar.add_argument("--referencia", help="Resultado anterior (--json) para detectar regressões")
+    p_executar.add_argument("--tolerancia", type=float, default=0.25, help="Piora relativa aceita antes de falhar")
+
+    for subparser in (p_fazenda, p_executar):
+        subparser.add_argument("--protocolo", choices=["ssh", "telnet"], default="ssh" if asyncssh else "telnet",
+                               help="ssh exige asyncssh (padrão: %(default)s)")
+    args = parser.parse_args()
+
+    if getattr(args, "protocolo", None) == "ssh" and asyncssh is None:
+        print("asyncssh não está instalado; use --protocolo telnet ou pip install asyncssh.")
+        sys.exit(1)
+
+    if args.acao == "gerar":
+        with open(args.saida, "w") as f:
+            f.write("# nome:ip:modelo:usuario:senha:porta_ssh:grupo\n")
+            f.write(gerar_router_db(nodos_benchmark(args.nodos, args.grupos), args.porta))
+        print(f"{args.nodos} nodos gravados em {args.saida}")
+    elif args.acao == "fazenda":
+        async def manter():
+            servidor = await Fazenda(args.linhas).iniciar(args.porta, args.protocolo)
+            print(f"Fazenda {args.protocolo} ativa em 127.0.0.1:{args.porta}", flush=True)
+            await servidor.wait_closed() if args.protocolo == "ssh" else await servidor.serve_forever()
+        asyncio.run(manter())
+    elif args.acao == "executar":
+        resultados = asyncio.run(executar(args))
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"parametros": {k: v for k, v in vars(args).items() if k not in ("json", "referencia")},
+                           "estrategias": resultados}, f, indent=1)
+        if args.referencia:
+            with open(args.referencia) as f:
+                piores = regressoes(resultados, json.load(f), args.tolerancia)
+            for estrategia, antes, depois in piores:
+                print(f"REGRESSÃO {estrategia}: ciclo médio {antes:.2f}s -> {depois:.2f}s")
+            if piores:
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+import functools
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from dataclasses import dataclass
+
+# Camada comum dos instaladores e da restauração.
+#
+# Configuracao é o modelo tipado das opções de uma instalação. O config do
+# Oxidized, as unidades systemd e os comandos dos hooks saem de funções
+# renderizadas uma única vez por Configuracao (cache). A gravação é atômica e
+# só acontece quando o conteúdo muda, e quem instala reinicia apenas os
+# serviços cujos arquivos mudaram: reinstalar sem alterações não reinicia o
+# Oxidized nem força a recoleta da frota inteira.
+
+CAMINHO_CONFIG = "/opt/oxidized"
+DIRETORIO_SYSTEMD = "/etc/systemd/system"
+BRANCH_REPLICACAO = "equipamentos"
+PORTA_REST = 8888
+PORTA_SYNC = 8890
+PORTA_BASE_SHARDS = 8900
+ARQUIVO_ATIVO = "router.ativo.db"
+# Scripts do exportador embutido (oxidized-exporter): o install_oxidized.py os copia junto com os demais e,
+# se algum mudou, reinicia o exportador em execução
+SCRIPTS_EXPORTADOR = ("exportador_oxidized.py", "tamanhos_oxidized.py", "mudancas_oxidized.py")
+SCRIPTS_PROJETO = ("install_oxidized.py", "restore_oxidized.py", "sync_oxidized.py", "inventario_oxidized.py",
+                   "ajuste_oxidized.py", "falhas_oxidized.py") + SCRIPTS_EXPORTADOR + (
+                   "shards_oxidized.py", "manutencao_oxidized.py", "snapshots_oxidized.py",
+                   "agendador_oxidized.py", "configuracao_oxidized.py", "recarga_oxidized.py",
+                   "importacao_oxidized.py")
+# Parâmetros que o ajuste_oxidized.py calcula e grava no config; a reinstalação preserva os valores atuais
+PARAMETROS_AJUSTAVEIS = ("interval", "threads", "timeout", "retries")
+
+
+@dataclass(frozen=True)
+class Configuracao:
+    usuario: str
+    caminho_config: str = CAMINHO_CONFIG
+    espelho: str = "incremental"
+    fonte: str = "csv"
+    shards: int = 1
+    particao: str = "hash"
+    snapshots: bool = False
+    agendador: bool = False
+    grupos_criticos: tuple = ()
+    interval: int = 3600
+    threads: int = 30
+    timeout: int = 20
+    retries: int = 3
+
+    @property
+    def diretorio_spool(self) -> str:
+        return os.path.join(self.caminho_config, "spool")
+
+    @property
+    def arquivo_chave(self) -> str:
+        return os.path.join(self.caminho_config, ".ssh", "id_ed25519_github")
+
+    # Com o agendador o Oxidized lê o inventário ativo (sem os nodos em espera) mantido por ele
+    @property
+    def arquivo_inventario(self) -> str:
+        return os.path.join(self.caminho_config, ARQUIVO_ATIVO if self.agendador else "router.db")
+
+    @property
+    def tabela_inventario(self) -> str:
+        return "equipamentos_ativos" if self.agendador else "equipamentos"
+
+    @property
+    def servicos_oxidized(self) -> tuple:
+        return tuple(f"oxidized@{i}" for i in range(self.shards)) if self.shards > 1 else ("oxidized",)
+
+
+def ler_parametros(texto):
+    parametros = {}
+    for chave in PARAMETROS_AJUSTAVEIS:
+        encontrado = re.search(rf"^{chave}:\s*(\d+)\s*$", texto, re.M)
+        if encontrado:
+            parametros[chave] = int(encontrado.group(1))
+    return parametros
+
+
+# Valores já ajustados no config instalado (threads/timeout do ajuste_oxidized.py)
+def parametros_instalados(caminho_config=CAMINHO_CONFIG):
+    try:
+        with open(os.path.join(caminho_config, "config")) as f:
+            return ler_parametros(f.read())
+    except FileNotFoundError:
+        return {}
+
+
+# Usuário dono dos arquivos: quem chamou o sudo ou, rodando como root, o primeiro usuário em /home
+def detectar_usuario():
+    candidato = os.getenv("SUDO_USER")
+    if candidato and candidato != "root":
+        return candidato
+    if os.path.isdir("/home"):
+        casas = sorted(d for d in os.listdir("/home") if os.path.isdir(os.path.join("/home", d)) and d != "lost+found")
+        if casas:
+            return casas[0]
+    return "root"
+
+
+# Grava de forma atômica (temporário + rename) só se o conteúdo mudou; devolve se gravou
+def gravar_se_mudou(caminho, conteudo, modo=0o644):
+    dados = conteudo.encode() if isinstance(conteudo, str) else conteudo
+    try:
+        with open(caminho, "rb") as f:
+            if f.read() == dados:
+                return False
+    except FileNotFoundError:
+        pass
+    diretorio = os.path.dirname(os.path.abspath(caminho))
+    os.makedirs(diretorio, exist_ok=True)
+    descritor, temporario = tempfile.mkstemp(prefix=f".{os.path.basename(caminho)}.", dir=diretorio)
+    try:
+        with os.fdopen(descritor, "wb") as f:
+            f.write(dados)
+        os.chmod(temporario, modo)
+        os.replace(temporario, caminho)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+    return True
+
+
+def copiar_se_mudou(origem, destino):
+    if os.path.abspath(origem) == os.path.abspath(destino):
+        return False
+    with open(origem, "rb") as f:
+        dados = f.read()
+    return gravar_se_mudou(destino, dados, os.stat(origem).st_mode & 0o777)
+
+
+# Entrada do ~/.ssh/config do usuário apontando o github.com para a chave em /opt/oxidized/.ssh
+def configurar_ssh_github(usuario, arquivo_chave):
+    diretorio_ssh = os.path.join(os.path.expanduser(f"~{usuario}"), ".ssh")
+    os.makedirs(diretorio_ssh, exist_ok=True)
+    shutil.chown(diretorio_ssh, usuario, usuario)
+    config_ssh = os.path.join(diretorio_ssh, "config")
+    atual = ""
+    if os.path.exists(config_ssh):
+        with open(config_ssh) as f:
+            atual = f.read()
+    if arquivo_chave in atual:
+        return False
+    entrada = f"\nHost github.com\n  HostName github.com\n  User git\n  IdentityFile {arquivo_chave}\n  StrictHostKeyChecking no\n"
+    gravar_se_mudou(config_ssh, atual + entrada, 0o600)
+    shutil.chown(config_ssh, usuario, usuario)
+    return True
+
+
+# Caminhos de instalações antigas (~/.config/oxidized e scripts soltos no home) no padrão /opt/oxidized
+def normalizar_caminhos(texto, caminho_config=CAMINHO_CONFIG):
+    casa = r"(?:/home/[^/\s\"']+|/root)"
+    texto = re.sub(casa + r"/\.config/oxidized", caminho_config, texto)
+    return re.sub(casa + r"/(\w+_oxidized\.py)", lambda m: os.path.join(caminho_config, m.group(1)), texto)
+
+
+@functools.lru_cache(maxsize=None)
+def comando_hook(cfg):
+    # O hook post_store só cria um arquivo no spool (com a duração da coleta, para os spans do sincronizador);
+    # o serviço oxidized-sync faz o trabalho pesado em lote
+    return f'echo "${{OX_JOB_TIME}}" > "{cfg.diretorio_spool}/${{OX_NODE_GROUP}}@${{OX_NODE_NAME}}"'
+
+
+@functools.lru_cache(maxsize=None)
+def comando_falha(cfg):
+    # node_fail vai por HTTP para o receptor do oxidized-sync (processado sem fork do Python);
+    # se o serviço estiver fora do ar ou com a fila cheia (503), grava direto pelo falhas_oxidized.py
+    return (
+        'curl -sf -m 2 -o /dev/null '
+        '--data-urlencode "nodo=${OX_NODE_NAME}" --data-urlencode "grupo=${OX_NODE_GROUP}" '
+        '--data-urlencode "status=${OX_JOB_STATUS}" --data-urlencode "erro=${OX_ERR_TYPE}" '
+        f'--data-urlencode "motivo=${{OX_ERR_REASON}}" http://127.0.0.1:{PORTA_SYNC}/evento/node_fail '
+        f'|| /usr/bin/python3 {cfg.caminho_config}/falhas_oxidized.py --base {cfg.caminho_config} registrar'
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def comando_sucesso(cfg):
+    # node_success dispara a cada coleta bem-sucedida, mesmo sem mudança no config (o post_store só vem com mudança);
+    # o receptor zera as falhas consecutivas do nodo. Sem o serviço no ar o evento é descartado: a próxima coleta repete
+    return (
+        'curl -sf -m 2 -o /dev/null '
+        '--data-urlencode "nodo=${OX_NODE_NAME}" --data-urlencode "grupo=${OX_NODE_GROUP}" '
+        f'http://127.0.0.1:{PORTA_SYNC}/evento/node_success || true'
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def renderizar_fonte(cfg):
+    # Fonte do inventário: router.db direto (csv) ou o banco indexado gerado pelo inventario_oxidized.py (sql)
+    if cfg.fonte == "sql":
+        return f"""source:
+  default: sql
+  sql:
+    adapter: sqlite
+    database: "{cfg.caminho_config}/inventario.db"
+    table: {cfg.tabela_inventario}
+    map:
+      name: nome
+      ip: ip
+      model: modelo
+      username: usuario
+      password: senha
+      group: grupo
+    vars_map:
+      ssh_port: porta
+"""
+    return f"""source:
+  default: csv
+  csv:
+    file: "{cfg.arquivo_inventario}"
+    delimiter: !ruby/regexp /:/
+    map:
+      name: 0
+      ip: 1
+      model: 2
+      username: 3
+      password: 4
+      group: 6
+    vars_map:
+      ssh_port: 5
+"""
+
+
+@functools.lru_cache(maxsize=None)
+def renderizar_config(cfg):
+    return f"""---
+resolve_dns: true
+interval: {cfg.interval}
+use_max_threads: false
+threads: {cfg.threads}
+timeout: {cfg.timeout}
+retries: {cfg.retries}
+prompt: !ruby/regexp /^([\\w.@-]+[#>][\\s]?)$/
+pid: "{cfg.caminho_config}/pid"
+rest: 0.0.0.0:{PORTA_REST}
+extensions:
+  oxidized-web:
+    load: true
+hooks:
+  error_report:
+    type: exec
+    events: [node_fail]
+    cmd: '{comando_falha(cfg)}'
+    async: true
+  success_report:
+    type: exec
+    events: [node_success]
+    cmd: '{comando_sucesso(cfg)}'
+    async: true
+  full_project_sync:
+    type: exec
+    events: [post_store]
+    cmd: '{comando_hook(cfg)}'
+    async: true
+input:
+  default: ssh, telnet
+  debug: false
+  ssh:
+    secure: false
+output:
+  default: git
+  git:
+    user: Oxidized
+    email: oxidized@backup.local
+    repo: "{cfg.caminho_config}/configs"
+{renderizar_fonte(cfg)}"""
+
+
+def unidade_servico(descricao, usuario, home, comando, depois="network.target", requer=None, espera_reinicio="30s"):
+    dependencia = f"Wants={requer}\n" if requer else ""
+    return f"""[Unit]
+Description={descricao}
+After={depois}
+{dependencia}
+[Service]
+User={usuario}
+Environment="OXIDIZED_HOME={home}"
+ExecStart={comando}
+Restart=on-failure
+RestartSec={espera_reinicio}
+
+[Install]
+WantedBy=multi-user.target
+"""
+
+
+# Unidades systemd da instalação: {nome do arquivo: conteúdo}
+@functools.lru_cache(maxsize=None)
+def renderizar_unidades(cfg):
+    base = cfg.caminho_config
+    unidades = {
+        "oxidized.service": unidade_servico("Oxidized - Backup de Configurações de Rede", cfg.usuario, base,
+                                            "/usr/local/bin/oxidized"),
+        "oxidized-sync.service": unidade_servico(
+            "Oxidized - Sincronizador em lote do repositório de backup", cfg.usuario, base,
+            f"/usr/bin/python3 {base}/sync_oxidized.py --espelho {cfg.espelho} servir --janela 30 --atraso-maximo 300"
+            f"{' --snapshots' if cfg.snapshots else ''}",
+            depois="network-online.target", requer="network-online.target", espera_reinicio="10s"),
+        # Manutenção dos repositórios git (repack, commit-graph, prune) de madrugada, com prioridade baixa
+        "oxidized-manutencao.service": f"""[Unit]
+Description=Oxidized - Manutenção dos repositórios git
+After=oxidized-sync.service
+
+[Service]
+Type=oneshot
+User={cfg.usuario}
+Environment="OXIDIZED_HOME={base}"
+ExecStart=/usr/bin/python3 {base}/manutencao_oxidized.py --base {base}
+Nice=10
+IOSchedulingClass=idle
+""",
+        "oxidized-manutencao.timer": """[Unit]
+Description=Oxidized - Agenda da manutenção dos repositórios git
+
+[Timer]
+OnCalendar=*-*-* 03:30:00
+RandomizedDelaySec=30min
+Persistent=true
+
+[Install]
+WantedBy=timers.target
+""",
+        # Agendador: backoff dos nodos que falham e prioridade aos atrasados, via API REST
+        "oxidized-agendador.service": unidade_servico(
+            "Oxidized - Agendamento da coleta orientado a falhas", cfg.usuario, base,
+            f"/usr/bin/python3 {base}/agendador_oxidized.py --base {base}"
+            + "".join(f" --grupo-critico {grupo}" for grupo in cfg.grupos_criticos) + " servir --intervalo 60",
+            depois=" ".join(f"{s}.service" for s in cfg.servicos_oxidized)),
+        # Recarga a quente: router.db via /reload e reinício só quando o config muda de fato (root por causa do systemctl)
+        "oxidized-recarga.service": unidade_servico(
+            "Oxidized - Recarga a quente do inventário e do config", "root", base,
+            f"/usr/bin/python3 {base}/recarga_oxidized.py --base {base} observar",
+            depois=" ".join(f"{s}.service" for s in cfg.servicos_oxidized), espera_reinicio="10s"),
+    }
+    if cfg.shards > 1:
+        # Uma instância oxidized@N por parte do router.db, cada uma com OXIDIZED_HOME, porta REST e repositório próprios
+        unidades["oxidized@.service"] = unidade_servico(
+            "Oxidized - Backup de Configurações de Rede (shard %i)", cfg.usuario, f"{base}/shards/%i", "/usr/local/bin/oxidized")
+    return unidades
+
+
+# Grava as unidades que mudaram (e recarrega o systemd se alguma mudou); devolve os nomes alterados
+def aplicar_unidades(unidades, diretorio=DIRETORIO_SYSTEMD):
+    alteradas = {nome for nome, conteudo in unidades.items() if gravar_se_mudou(os.path.join(diretorio, nome), conteudo)}
+    if alteradas:
+        subprocess.run(["systemctl", "daemon-reload"], check=True)
+    return alteradas
+
+
+# Reinicia os serviços cujos arquivos mudaram; os demais só são iniciados se estiverem parados
+def reiniciar_se_mudou(servicos, mudou):
+    if not servicos:
+        return
+    print(f"{'Reiniciando' if mudou else 'Garantindo em execução'}: {', '.join(servicos)}")
+    subprocess.run(["systemctl", "restart" if mudou else "start"] + list(servicos), check=True)
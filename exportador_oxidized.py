@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import mudancas_oxidized
+import tamanhos_oxidized
+
+# Exportador Prometheus do Oxidized com cache em memória.
+#
+# Uma thread consulta /nodes.json periodicamente e só busca o config dos nodos
+# cujo backup mudou desde a última consulta. Com o repositório configs
+# disponível localmente, linhas e tamanho vêm dos objetos do git
+# (tamanhos_oxidized.py), junto com o churn do histórico (mudancas_oxidized.py),
+# e a API só é usada para o status. O texto de /metrics
+# é montado uma vez por atualização e servido pronto, então o custo de cada
+# scrape não depende do tamanho da frota. Gera as mesmas séries do
+# oxidized-exporter. No modo com shards, recebe uma --url por instância e
+# publica os nodos de todas como uma frota só.
+
+CAMINHO_CONFIG = os.getenv("OXIDIZED_HOME", "/opt/oxidized")
+STATUS = {"success": 2, "never": 1}
+
+
+def escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Coletor:
+    def __init__(self, urls_rest, trabalhadores=8, medidor=None, indice=None):
+        self.urls_rest = [url.rstrip("/") for url in urls_rest]
+        self.brutos = {}
+        self.trabalhadores = trabalhadores
+        self.medidor = medidor
+        self.medidas = {}
+        self.indice = indice
+        self.series_mudancas = []
+        self.revisao_git = None
+        self.nodos = {}
+        self.hash_resposta = None
+        self.disponivel = 0
+        self.duracao = 0.0
+        self.buffer = b""
+        self.trava = threading.Lock()
+        self.renderizar()
+
+    def buscar(self, url, caminho, timeout=30):
+        with urllib.request.urlopen(url + caminho, timeout=timeout) as resposta:
+            return resposta.read()
+
+    # Tamanho e linhas do config armazenado de um nodo
+    def medir_config(self, nodo):
+        caminho = "/node/fetch/" + "/".join(urllib.parse.quote(p, safe="") for p in (nodo["group"], nodo["name"]) if p)
+        conteudo = self.buscar(nodo["url"], caminho)
+        linhas = conteudo.count(b"\n") + (1 if conteudo and not conteudo.endswith(b"\n") else 0)
+        return linhas, len(conteudo)
+
+    # Processa os commits novos do repositório configs e devolve a revisão medida
+    def atualizar_git(self):
+        if self.medidor is None:
+            return None
+        try:
+            self.medidor.atualizar()
+            self.medidas = self.medidor.medidas()
+            if self.indice is not None:
+                self.indice.atualizar()
+                self.series_mudancas = self.indice.metricas()
+        except (OSError, subprocess.CalledProcessError, sqlite3.Error) as e:
+            print(f"Erro ao ler o repositório configs: {e}", flush=True)
+        return self.medidor.estado("ultimo_commit")
+
+    def atualizar(self):
+        inicio = time.monotonic()
+        # Instância fora do ar mantém os nodos da última resposta válida
+        self.disponivel = 1
+        for url in self.urls_rest:
+            try:
+                self.brutos[url] = self.buscar(url, "/nodes.json")
+            except OSError as e:
+                print(f"Erro ao consultar o Oxidized em {url}: {e}", flush=True)
+                self.disponivel = 0
+        if not self.brutos:
+            self.duracao = time.monotonic() - inicio
+            self.renderizar()
+            return
+
+        resumo = hashlib.sha256(b"\0".join(self.brutos.get(url, b"") for url in self.urls_rest)).hexdigest()
+        revisao = self.atualizar_git()
+        if resumo == self.hash_resposta and revisao == self.revisao_git:
+            # Nada mudou desde a última consulta: reaproveita o estado e o buffer
+            self.duracao = time.monotonic() - inicio
+            self.renderizar()
+            return
+
+        novos, a_medir = {}, []
+        itens = [(url, item) for url, bruto in self.brutos.items() for item in json.loads(bruto)]
+        for url, item in itens:
+            ultimo = item.get("last") or {}
+            nome, grupo = item.get("name", ""), item.get("group") or ""
+            marca = (ultimo.get("end"), item.get("mtime"))
+            anterior = self.nodos.get(nome)
+            nodo = {
+                "name": nome,
+                "group": grupo,
+                "url": url,
+                "model": item.get("model", ""),
+                "full_name": item.get("full_name") or (f"{grupo}/{nome}" if grupo else nome),
+                "status": STATUS.get(ultimo.get("status", "never"), 0) if ultimo else 1,
+                "time": float(ultimo.get("time") or 0),
+                "marca": marca,
+                "linhas": anterior["linhas"] if anterior else None,
+                "tamanho": anterior["tamanho"] if anterior else None,
+            }
+            if self.medidor is not None:
+                medida = self.medidas.get(f"{grupo}/{nome}" if grupo else nome)
+                nodo["tamanho"], nodo["linhas"] = medida if medida else (None, None)
+            # Sem o repositório local, só nodos com backup novo (ou ainda não medidos) têm o config buscado
+            elif nodo["status"] == 2 and (anterior is None or anterior["marca"] != marca or anterior["linhas"] is None):
+                a_medir.append(nodo)
+            novos[nome] = nodo
+
+        def medir(nodo):
+            try:
+                nodo["linhas"], nodo["tamanho"] = self.medir_config(nodo)
+            except OSError as e:
+                print(f"Erro ao buscar o config de {nodo['full_name']}: {e}", flush=True)
+
+        if a_medir:
+            with ThreadPoolExecutor(max_workers=self.trabalhadores) as executor:
+                list(executor.map(medir, a_medir))
+
+        self.nodos = novos
+        self.hash_resposta = resumo
+        self.revisao_git = revisao
+        self.duracao = time.monotonic() - inicio
+        self.renderizar()
+        print(f"Cache atualizado: {len(novos)} nodos, {len(a_medir)} config(s) medidos em {self.duracao:.2f}s", flush=True)
+
+    def renderizar(self):
+        series = {
+            "oxidized_device_status": ("gauge", "Status do último backup (0=falha, 1=nunca tentado, 2=sucesso).", "status"),
+            "oxidized_device_config_lines": ("gauge", "Linhas do config armazenado.", "linhas"),
+            "oxidized_device_config_size": ("gauge", "Tamanho do config armazenado em bytes.", "tamanho"),
+            "oxidized_device_last_backup_time": ("gauge", "Duração do último backup em segundos.", "time"),
+        }
+        partes = [
+            "# HELP oxidized_status Oxidized acessível pela API REST (1) ou não (0).",
+            "# TYPE oxidized_status gauge",
+            f"oxidized_status {self.disponivel}",
+        ]
+        for metrica, (tipo, ajuda, campo) in series.items():
+            partes.append(f"# HELP {metrica} {ajuda}")
+            partes.append(f"# TYPE {metrica} {tipo}")
+            for nodo in self.nodos.values():
+                if nodo[campo] is None:
+                    continue
+                rotulos = ",".join(f'{r}="{escapar(nodo[r])}"' for r in ("name", "full_name", "group", "model"))
+                partes.append(f"{metrica}{{{rotulos}}} {nodo[campo]}")
+        partes += self.series_mudancas
+        partes += [
+            "# HELP oxidized_exporter_collect_duration Duração da última atualização do cache em segundos.",
+            "# TYPE oxidized_exporter_collect_duration gauge",
+            f"oxidized_exporter_collect_duration {self.duracao:.6f}",
+        ]
+        buffer = ("\n".join(partes) + "\n").encode()
+        with self.trava:
+            self.buffer = buffer
+
+    def executar(self, intervalo):
+        while True:
+            self.atualizar()
+            time.sleep(intervalo)
+
+
+def servir(coletor, endereco, porta):
+    class Manipulador(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            with coletor.trava:
+                corpo = coletor.buffer
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def log_message(self, formato, *args):
+            pass
+
+    ThreadingHTTPServer((endereco, porta), Manipulador).serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exportador Prometheus do Oxidized com cache incremental")
+    parser.add_argument("--url", action="append", help="URL da API REST do Oxidized; repita uma vez por shard "
+                                                       "(padrão: http://127.0.0.1:8888)")
+    parser.add_argument("--endereco", default="0.0.0.0")
+    parser.add_argument("--porta", type=int, default=8080)
+    parser.add_argument("--intervalo", type=float, default=60, help="Segundos entre consultas ao Oxidized")
+    parser.add_argument("--trabalhadores", type=int, default=8, help="Buscas de config simultâneas")
+    parser.add_argument("--repo", default=os.path.join(CAMINHO_CONFIG, "configs"),
+                        help="Repositório configs local para medir os configs pelo git (vazio: busca pela API)")
+    parser.add_argument("--cache", default=os.path.join(CAMINHO_CONFIG, "tamanhos.db"), help="Cache das medidas por blob")
+    parser.add_argument("--indice-mudancas", default=os.path.join(CAMINHO_CONFIG, "mudancas.db"),
+                        help="Índice de churn do histórico (vazio: não exporta as séries de mudança)")
+    args = parser.parse_args()
+
+    medidor = indice = None
+    if args.repo and os.path.isdir(args.repo):
+        medidor = tamanhos_oxidized.Medidor(args.repo, args.cache)
+        if args.indice_mudancas:
+            indice = mudancas_oxidized.Indice(args.repo, args.indice_mudancas)
+    urls = args.url or ["http://127.0.0.1:8888"]
+    coletor = Coletor(urls, args.trabalhadores, medidor, indice)
+    threading.Thread(target=coletor.executar, args=(args.intervalo,), daemon=True).start()
+    print(f"Exportador ativo em {args.endereco}:{args.porta}, consultando {', '.join(urls)} a cada {args.intervalo}s", flush=True)
+    servir(coletor, args.endereco, args.porta)
+
+
+if __name__ == "__main__":
+    main()
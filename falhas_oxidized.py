@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+import argparse
+import fcntl
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+
+# Registro estruturado de falhas do Oxidized.
+#
+# Cada node_fail vira uma linha JSON em falhas/falhas.jsonl (rotacionado por
+# tamanho e idade) e atualiza o agregado por nodo em falhas/falhas.db: último
+# erro, falhas consecutivas, total e primeira ocorrência. Só o resumo limitado
+# (falhas_resumo.json) vai para o repositório de backup.
+
+CAMINHO_CONFIG = os.getenv("OXIDIZED_HOME", "/opt/oxidized")
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS resumo (
+    nodo                TEXT PRIMARY KEY,
+    grupo               TEXT,
+    primeira_falha      REAL NOT NULL,
+    ultima_falha        REAL NOT NULL,
+    falhas_consecutivas INTEGER NOT NULL DEFAULT 0,
+    falhas_total        INTEGER NOT NULL DEFAULT 0,
+    ultimo_status       TEXT,
+    ultimo_erro         TEXT,
+    ultimo_motivo       TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_resumo_consecutivas ON resumo(falhas_consecutivas);
+"""
+
+
+def caminhos(caminho_config):
+    diretorio = os.path.join(caminho_config, "falhas")
+    return {
+        "diretorio": diretorio,
+        "log": os.path.join(diretorio, "falhas.jsonl"),
+        "banco": os.path.join(diretorio, "falhas.db"),
+        "trava": os.path.join(diretorio, ".rotacao.lock"),
+        "resumo": os.path.join(caminho_config, "falhas_resumo.json"),
+    }
+
+
+def abrir_banco(caminho_banco):
+    conexao = sqlite3.connect(caminho_banco, timeout=30)
+    conexao.execute("PRAGMA journal_mode=WAL")
+    conexao.executescript(ESQUEMA)
+    return conexao
+
+
+# Rotaciona o log quando passa do tamanho máximo e apaga rotações antigas demais
+def rotacionar(dirs, tamanho_maximo, arquivos, idade_maxima):
+    with open(dirs["trava"], "w") as trava:
+        fcntl.flock(trava, fcntl.LOCK_EX)
+        if os.path.exists(dirs["log"]) and os.path.getsize(dirs["log"]) >= tamanho_maximo:
+            for indice in range(arquivos - 1, 0, -1):
+                origem = f"{dirs['log']}.{indice}"
+                if os.path.exists(origem):
+                    os.replace(origem, f"{dirs['log']}.{indice + 1}")
+            os.replace(dirs["log"], f"{dirs['log']}.1")
+            excedente = f"{dirs['log']}.{arquivos + 1}"
+            if os.path.exists(excedente):
+                os.remove(excedente)
+
+        limite = time.time() - idade_maxima
+        for indice in range(1, arquivos + 1):
+            antigo = f"{dirs['log']}.{indice}"
+            if os.path.exists(antigo) and os.path.getmtime(antigo) < limite:
+                os.remove(antigo)
+
+
+# "consecutiva=False" registra a falha no log e nos totais sem somar às falhas consecutivas (histórico migrado)
+def registrar_falha(caminho_config, evento, tamanho_maximo=10 * 1024 * 1024, arquivos=5, idade_maxima=30 * 86400,
+                    consecutiva=True):
+    registrar_falhas(caminho_config, [evento], tamanho_maximo, arquivos, idade_maxima, consecutiva)
+
+
+# Vários eventos de uma vez: uma escrita no log e um único upsert em lote numa transação
+def registrar_falhas(caminho_config, eventos, tamanho_maximo=10 * 1024 * 1024, arquivos=5, idade_maxima=30 * 86400,
+                     consecutiva=True):
+    if not eventos:
+        return
+    dirs = caminhos(caminho_config)
+    os.makedirs(dirs["diretorio"], exist_ok=True)
+    for evento in eventos:
+        evento.setdefault("ts", time.time())
+
+    # Uma única escrita em modo append: linhas de hooks simultâneos não se misturam
+    linhas = "".join(json.dumps(evento, ensure_ascii=False, separators=(",", ":")) + "\n" for evento in eventos)
+    descritor = os.open(dirs["log"], os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(descritor, linhas.encode())
+    finally:
+        os.close(descritor)
+
+    conexao = abrir_banco(dirs["banco"])
+    with conexao:
+        conexao.executemany(
+            """INSERT INTO resumo (nodo, grupo, primeira_falha, ultima_falha, falhas_consecutivas, falhas_total,
+                                   ultimo_status, ultimo_erro, ultimo_motivo)
+               VALUES (:nodo, :grupo, :ts, :ts, :incremento, 1, :status, :erro, :motivo)
+               ON CONFLICT(nodo) DO UPDATE SET
+                   grupo=excluded.grupo,
+                   primeira_falha=MIN(primeira_falha, excluded.primeira_falha),
+                   falhas_consecutivas=falhas_consecutivas + :incremento, falhas_total=falhas_total + 1,
+                   ultimo_status=CASE WHEN excluded.ultima_falha >= ultima_falha
+                                      THEN excluded.ultimo_status ELSE ultimo_status END,
+                   ultimo_erro=CASE WHEN excluded.ultima_falha >= ultima_falha
+                                    THEN excluded.ultimo_erro ELSE ultimo_erro END,
+                   ultimo_motivo=CASE WHEN excluded.ultima_falha >= ultima_falha
+                                      THEN excluded.ultimo_motivo ELSE ultimo_motivo END,
+                   ultima_falha=MAX(ultima_falha, excluded.ultima_falha)""",
+            (dict({k: evento.get(k) for k in ("nodo", "grupo", "ts", "status", "erro", "motivo")},
+                  incremento=1 if consecutiva else 0) for evento in eventos),
+        )
+    conexao.close()
+
+    if os.path.getsize(dirs["log"]) >= tamanho_maximo:
+        rotacionar(dirs, tamanho_maximo, arquivos, idade_maxima)
+
+
+# Zera as falhas consecutivas dos nodos que voltaram a coletar (hook node_success, com ou sem mudança no config)
+def registrar_sucessos(caminho_config, nodos):
+    dirs = caminhos(caminho_config)
+    if not nodos or not os.path.exists(dirs["banco"]):
+        return 0
+    conexao = abrir_banco(dirs["banco"])
+    with conexao:
+        alterados = conexao.executemany(
+            "UPDATE resumo SET falhas_consecutivas = 0 WHERE nodo = ? AND falhas_consecutivas > 0",
+            ((n,) for n in nodos)).rowcount
+    conexao.close()
+    return alterados
+
+
+# Remove do agregado os nodos recuperados cuja última falha é mais antiga que a idade máxima e apaga os logs
+# rotacionados vencidos (numa frota sem falhas o log não cresce e a rotação por tamanho nunca chega a rodar)
+def compactar(caminho_config, idade_maxima, tamanho_maximo=10 * 1024 * 1024, arquivos=5):
+    dirs = caminhos(caminho_config)
+    if os.path.isdir(dirs["diretorio"]):
+        rotacionar(dirs, tamanho_maximo, arquivos, idade_maxima)
+    if not os.path.exists(dirs["banco"]):
+        return 0
+    conexao = abrir_banco(dirs["banco"])
+    with conexao:
+        removidos = conexao.execute("DELETE FROM resumo WHERE falhas_consecutivas = 0 AND ultima_falha < ?",
+                                    (time.time() - idade_maxima,)).rowcount
+    conexao.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conexao.close()
+    return removidos
+
+
+def top_nodos(caminho_config, limite=20, ordem="consecutivas"):
+    dirs = caminhos(caminho_config)
+    if not os.path.exists(dirs["banco"]):
+        return []
+    coluna = {"consecutivas": "falhas_consecutivas", "total": "falhas_total", "recentes": "ultima_falha"}[ordem]
+    conexao = abrir_banco(dirs["banco"])
+    conexao.row_factory = sqlite3.Row
+    linhas = conexao.execute(f"SELECT * FROM resumo ORDER BY {coluna} DESC, nodo LIMIT ?", (limite,)).fetchall()
+    conexao.close()
+    return [dict(linha) for linha in linhas]
+
+
+# Nodos com pelo menos "minimo" falhas seguidas: {nodo: (falhas_consecutivas, ultima_falha)}
+def nodos_falhando(caminho_config, minimo=1):
+    dirs = caminhos(caminho_config)
+    if not os.path.exists(dirs["banco"]):
+        return {}
+    conexao = abrir_banco(dirs["banco"])
+    linhas = conexao.execute("SELECT nodo, falhas_consecutivas, ultima_falha FROM resumo WHERE falhas_consecutivas >= ?",
+                             (max(minimo, 1),)).fetchall()
+    conexao.close()
+    return {nodo: (consecutivas, ultima) for nodo, consecutivas, ultima in linhas}
+
+
+# Grava o resumo limitado (só nodos ainda falhando) que é versionado no backup
+def exportar_resumo(caminho_config, limite=1000):
+    dirs = caminhos(caminho_config)
+    nodos = [n for n in top_nodos(caminho_config, limite) if n["falhas_consecutivas"] > 0]
+    for nodo in nodos:
+        for campo in ("primeira_falha", "ultima_falha"):
+            nodo[campo] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(nodo[campo]))
+    conteudo = json.dumps(nodos, ensure_ascii=False, indent=1) + "\n"
+    if os.path.exists(dirs["resumo"]):
+        with open(dirs["resumo"]) as f:
+            if f.read() == conteudo:
+                return dirs["resumo"]
+    descritor, temporario = tempfile.mkstemp(prefix=".falhas_resumo.", dir=caminho_config)
+    with os.fdopen(descritor, "w") as f:
+        f.write(conteudo)
+    os.chmod(temporario, 0o644)
+    os.replace(temporario, dirs["resumo"])
+    return dirs["resumo"]
+
+
+# Migra o antigo last_failures.log (texto livre) para o formato estruturado. O log antigo não registra os
+# sucessos, então as falhas históricas entram no log e nos totais sem contar como consecutivas: um nodo
+# recuperado há muito tempo não pode ser tratado pelo agendador como se ainda estivesse falhando
+def importar_log_antigo(caminho_config, arquivo_log):
+    padrao = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) \| Nodo: (.*?) \| Status: (.*?) \| Erro: (.*?) \| Motivo: (.*)$")
+    eventos = []
+    with open(arquivo_log, errors="replace") as f:
+        for linha in f:
+            encontrado = padrao.match(linha.rstrip("\n"))
+            if not encontrado:
+                continue
+            data, nodo, status, erro, motivo = encontrado.groups()
+            ts = time.mktime(time.strptime(data, "%Y-%m-%d %H:%M:%S"))
+            eventos.append({"ts": ts, "nodo": nodo, "grupo": "", "status": status, "erro": erro, "motivo": motivo})
+    registrar_falhas(caminho_config, eventos, consecutiva=False)
+    return len(eventos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Registro estruturado e consulta das falhas de coleta do Oxidized")
+    parser.add_argument("--base", default=CAMINHO_CONFIG, help="Diretório base do Oxidized (padrão: %(default)s)")
+    sub = parser.add_subparsers(dest="acao", required=True)
+
+    p_registrar = sub.add_parser("registrar", help="Registra uma falha (lê as variáveis OX_* do hook node_fail)")
+    p_registrar.add_argument("--tamanho-maximo", type=int, default=10 * 1024 * 1024, help="Bytes do log antes de rotacionar")
+    p_registrar.add_argument("--arquivos", type=int, default=5, help="Quantidade de logs rotacionados mantidos")
+
+    p_top = sub.add_parser("top", help="Lista os nodos que mais falham")
+    p_top.add_argument("--limite", type=int, default=20)
+    p_top.add_argument("--ordem", choices=["consecutivas", "total", "recentes"], default="consecutivas")
+
+    p_compactar = sub.add_parser("compactar", help="Remove nodos recuperados antigos e logs rotacionados vencidos")
+    p_compactar.add_argument("--idade-maxima-dias", type=float, default=30)
+
+    sub.add_parser("exportar-resumo", help="Gera o falhas_resumo.json versionado no backup")
+
+    p_importar = sub.add_parser("importar-log", help="Migra um last_failures.log antigo")
+    p_importar.add_argument("arquivo", nargs="?", default=os.path.join(CAMINHO_CONFIG, "last_failures.log"))
+
+    args = parser.parse_args()
+
+    if args.acao == "registrar":
+        evento = {
+            "nodo": os.getenv("OX_NODE_NAME", ""),
+            "grupo": os.getenv("OX_NODE_GROUP", ""),
+            "status": os.getenv("OX_JOB_STATUS", ""),
+            "erro": os.getenv("OX_ERR_TYPE", ""),
+            "motivo": os.getenv("OX_ERR_REASON", ""),
+        }
+        if not evento["nodo"]:
+            print("OX_NODE_NAME não definido; nada a registrar.")
+            sys.exit(1)
+        registrar_falha(args.base, evento, args.tamanho_maximo, args.arquivos)
+    elif args.acao == "top":
+        for nodo in top_nodos(args.base, args.limite, args.ordem):
+            ultima = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(nodo["ultima_falha"]))
+            print(f"{nodo['nodo']:<30} consecutivas={nodo['falhas_consecutivas']:<5} total={nodo['falhas_total']:<6} "
+                  f"última={ultima} erro={nodo['ultimo_erro']} motivo={nodo['ultimo_motivo']}")
+    elif args.acao == "compactar":
+        idade = args.idade_maxima_dias * 86400
+        removidos = compactar(args.base, idade)
+        print(f"{removidos} nodo(s) recuperado(s) removido(s) do agregado.")
+    elif args.acao == "exportar-resumo":
+        print(exportar_resumo(args.base))
+    elif args.acao == "importar-log":
+        print(f"{importar_log_antigo(args.base, args.arquivo)} falha(s) importada(s).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import resource
+import sys
+import time
+
+import configuracao_oxidized
+import inventario_oxidized
+
+# Importação e exportação em massa do inventário.
+#
+# Planilhas CSV, listas JSON e exportações do NetBox (API ou CSV) são convertidas
+# para o formato do router.db e mescladas a ele. Antes da mescla a porta de acesso
+# (SSH ou telnet) de cada equipamento novo ou alterado é sondada em paralelo com
+# asyncio; os que não respondem vão para o router.quarentena.db e só entram no
+# router.db quando uma nova sondagem os encontrar. Assim o Oxidized não gasta
+# timeout x retries por ciclo com entradas mortas. A propagação do router.db
+# (banco sql, shards, /reload) fica com o oxidized-recarga.
+
+CAMINHO_CONFIG = os.getenv("OXIDIZED_HOME", "/opt/oxidized")
+ARQUIVO_QUARENTENA = "router.quarentena.db"
+MARCA_QUARENTENA = "# quarentena: "
+NODO_EXEMPLO = "DUMMY_NODE"
+ler_linhas = inventario_oxidized.ler_linhas
+mesclar_linhas = inventario_oxidized.mesclar_linhas
+
+# Nomes de coluna aceitos para cada campo do router.db (cabeçalho normalizado: minúsculas, "_" no lugar de espaço/hífen)
+SINONIMOS = {
+    "nome": ("nome", "name", "hostname", "device", "dispositivo", "equipamento"),
+    "ip": ("ip", "primary_ip4", "primary_ipv4", "primary_ip", "ip_address", "address", "endereco", "mgmt_ip"),
+    "modelo": ("modelo", "model", "platform", "plataforma", "os"),
+    "usuario": ("usuario", "username", "user", "login"),
+    "senha": ("senha", "password"),
+    "porta": ("porta", "porta_ssh", "port", "ssh_port"),
+    "grupo": ("grupo", "group", "site", "tenant", "role"),
+}
+# Situações do NetBox cujos equipamentos não devem ser coletados
+SITUACOES_IGNORADAS = {"offline", "planned", "staged", "failed", "inventory", "decommissioning"}
+
+
+def normalizar_coluna(nome):
+    return nome.strip().lower().replace(" ", "_").replace("-", "_")
+
+
+# Campos aninhados da API do NetBox: {"address": "10.0.0.1/24"}, {"slug": "ios", "name": "Cisco IOS"}, ...
+def valor_simples(valor):
+    if isinstance(valor, dict):
+        for chave in ("address", "slug", "value", "name", "display"):
+            if valor.get(chave) not in (None, ""):
+                return valor_simples(valor[chave])
+        return ""
+    return "" if valor is None else str(valor).strip()
+
+
+def detectar_formato(texto, caminho):
+    if caminho.endswith(".json") or texto.lstrip()[:1] in ("[", "{"):
+        return "json"
+    for linha in texto.splitlines():
+        if linha.strip() and not linha.lstrip().startswith("#"):
+            return "router-db" if linha.count(":") >= 5 and "," not in linha and ";" not in linha else "csv"
+    return "csv"
+
+
+def linhas_entrada(texto, formato):
+    if formato == "json":
+        dados = json.loads(texto)
+        # API do NetBox (/api/dcim/devices/) pagina em {"count": ..., "results": [...]}
+        if isinstance(dados, dict):
+            dados = dados.get("results", dados.get("devices", [dados]))
+        return [{normalizar_coluna(k): v for k, v in item.items()} for item in dados if isinstance(item, dict)]
+    if formato == "router-db":
+        linhas = []
+        for linha in texto.splitlines():
+            if linha.strip() and not linha.lstrip().startswith("#"):
+                campos = linha.split(":")
+                linhas.append(dict(zip(inventario_oxidized.CAMPOS, campos)) if len(campos) in (6, 7) else {"_linha": linha})
+        return linhas
+    try:
+        dialeto = csv.Sniffer().sniff(texto[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialeto = csv.excel
+    leitor = csv.DictReader(io.StringIO(texto), dialect=dialeto)
+    return [{normalizar_coluna(k): v for k, v in linha.items() if k is not None} for linha in leitor]
+
+
+# Converte um item da entrada em registro do router.db; devolve (registro, erro), ou (None, None) se ignorado
+def converter(item, padroes, mapa_modelos, grupo_por=None):
+    if "_linha" in item:
+        return None, f"esperados 7 campos separados por ':' em '{item['_linha']}'"
+    if valor_simples(item.get("status")).lower() in SITUACOES_IGNORADAS:
+        return None, None
+    campos = {}
+    for campo, nomes in SINONIMOS.items():
+        if campo == "grupo" and grupo_por:
+            nomes = (normalizar_coluna(grupo_por),) + nomes
+        campos[campo] = next((valor_simples(item[n]) for n in nomes if valor_simples(item.get(n))), "")
+        if not campos[campo]:
+            campos[campo] = padroes.get(campo, "")
+    campos["ip"] = campos["ip"].split("/")[0]
+    campos["modelo"] = mapa_modelos.get(campos["modelo"], campos["modelo"])
+    nome = campos["nome"] or "?"
+    for campo, valor in campos.items():
+        if ":" in valor:
+            return None, f"{nome}: campo '{campo}' contém ':' (não suportado no router.db)"
+    registro, erro = inventario_oxidized.analisar_linha(":".join(campos[c] for c in inventario_oxidized.CAMPOS))
+    return registro, f"{nome}: {erro}" if erro else None
+
+
+def ler_entrada(caminho, formato, padroes, mapa_modelos, grupo_por=None):
+    if caminho == "-":
+        texto = sys.stdin.read()
+    else:
+        with open(caminho, encoding="utf-8-sig") as f:
+            texto = f.read()
+    if formato == "auto":
+        formato = detectar_formato(texto, caminho)
+    registros, erros, avisos, ignorados = {}, [], [], 0
+    for item in linhas_entrada(texto, formato):
+        registro, erro = converter(item, padroes, mapa_modelos, grupo_por)
+        if erro:
+            erros.append(erro)
+        elif registro is None:
+            ignorados += 1
+        else:
+            if registro["nome"] in registros:
+                avisos.append(f"{registro['nome']}: repetido na entrada (vale a última ocorrência)")
+            registros[registro["nome"]] = registro
+    return formato, list(registros.values()), erros, avisos, ignorados
+
+
+# Quarentena: o registro no formato do router.db, precedido de "# quarentena: <motivo> <data>"
+def ler_quarentena(caminho_config):
+    entradas, motivo = {}, ""
+    try:
+        with open(os.path.join(caminho_config, ARQUIVO_QUARENTENA)) as f:
+            for linha in f:
+                if linha.startswith(MARCA_QUARENTENA):
+                    motivo = linha[len(MARCA_QUARENTENA):].strip()
+                elif linha.strip() and not linha.lstrip().startswith("#"):
+                    registro, erro = inventario_oxidized.analisar_linha(linha)
+                    if not erro:
+                        entradas[registro["nome"]] = (registro, motivo)
+                    motivo = ""
+    except FileNotFoundError:
+        pass
+    return entradas
+
+
+def gravar(caminho_config, nome_arquivo, texto):
+    caminho = os.path.join(caminho_config, nome_arquivo)
+    referencia = caminho if os.path.exists(caminho) else os.path.join(caminho_config, "router.db")
+    modo = os.stat(referencia).st_mode & 0o777 if os.path.exists(referencia) else 0o644
+    mudou = configuracao_oxidized.gravar_se_mudou(caminho, texto, modo)
+    # Rodando via sudo, o arquivo continua do usuário do Oxidized
+    if mudou and os.geteuid() == 0:
+        dono = os.stat(caminho_config)
+        os.chown(caminho, dono.st_uid, dono.st_gid)
+    return mudou
+
+
+def gravar_quarentena(caminho_config, entradas):
+    texto = "# Equipamentos fora do router.db por não responderem à sondagem (importacao_oxidized.py sondar --aplicar)\n"
+    for registro, motivo in sorted(entradas.values(), key=lambda e: e[0]["nome"]):
+        texto += f"{MARCA_QUARENTENA}{motivo}\n{inventario_oxidized.formatar_linha(registro)}"
+    return gravar(caminho_config, ARQUIVO_QUARENTENA, texto)
+
+
+# Cada conexão aberta é um descritor: o limite do processo é elevado até o teto (hard) permitido
+def ajustar_concorrencia(concorrencia):
+    flexivel, rigido = resource.getrlimit(resource.RLIMIT_NOFILE)
+    necessario = concorrencia + 64
+    if flexivel != resource.RLIM_INFINITY and flexivel < necessario:
+        novo = necessario if rigido == resource.RLIM_INFINITY else min(necessario, rigido)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (novo, rigido))
+        flexivel = novo
+    return max(1, min(concorrencia, flexivel - 64)) if flexivel != resource.RLIM_INFINITY else concorrencia
+
+
+async def conectar(ip, porta, tempo_limite):
+    try:
+        _, escritor = await asyncio.wait_for(asyncio.open_connection(ip, porta), tempo_limite)
+    except asyncio.TimeoutError:
+        return "timeout"
+    except ConnectionRefusedError:
+        return "conexão recusada"
+    except OSError as erro:
+        return erro.strerror or type(erro).__name__
+    escritor.close()
+    try:
+        await escritor.wait_closed()
+    except OSError:
+        pass
+    return None
+
+
+def chave(registro):
+    return registro["nome"], registro["ip"], registro["porta"]
+
+
+# Sonda a porta de cada registro; devolve {(nome, ip, porta): motivo} só dos que não responderam.
+# Só o timeout é repetido: conexão recusada ou rota inexistente não mudam na segunda tentativa.
+async def sondar_registros(registros, concorrencia, tempo_limite, tentativas):
+    limite = asyncio.Semaphore(concorrencia)
+
+    async def sondar(registro):
+        async with limite:
+            for _ in range(tentativas):
+                motivo = await conectar(registro["ip"], registro["porta"], tempo_limite)
+                if motivo != "timeout":
+                    break
+            return chave(registro), motivo
+
+    resultados = await asyncio.gather(*(sondar(r) for r in registros))
+    return {identificacao: motivo for identificacao, motivo in resultados if motivo}
+
+
+def sondar(registros, args):
+    if not registros:
+        return {}, 0.0
+    concorrencia = ajustar_concorrencia(args.concorrencia)
+    inicio = time.monotonic()
+    mortos = asyncio.run(sondar_registros(registros, concorrencia, args.tempo_limite, args.tentativas))
+    duracao = time.monotonic() - inicio
+    print(f"Sondagem: {len(registros)} equipamento(s) em {duracao:.1f}s "
+          f"(concorrência {concorrencia}), {len(mortos)} sem resposta")
+    return mortos, duracao
+
+
+def gravar_metricas(caminho_config, contagens, quarentena, duracao):
+    linhas = ["# HELP oxidized_import_nodes Equipamentos da última importação, por resultado.",
+              "# TYPE oxidized_import_nodes gauge"]
+    linhas += [f'oxidized_import_nodes{{result="{resultado}"}} {quantidade}' for resultado, quantidade in contagens.items()]
+    linhas += [
+        "# HELP oxidized_import_quarantined_nodes Equipamentos no router.quarentena.db.",
+        "# TYPE oxidized_import_quarantined_nodes gauge",
+        f"oxidized_import_quarantined_nodes {quarentena}",
+        "# HELP oxidized_import_probe_duration_seconds Duração da última sondagem de alcance.",
+        "# TYPE oxidized_import_probe_duration_seconds gauge",
+        f"oxidized_import_probe_duration_seconds {duracao:.3f}",
+        "# HELP oxidized_import_last_run_timestamp_seconds Fim da última importação ou sondagem.",
+        "# TYPE oxidized_import_last_run_timestamp_seconds gauge",
+        f"oxidized_import_last_run_timestamp_seconds {time.time():.3f}",
+    ]
+    diretorio = os.path.join(caminho_config, "metricas")
+    if not os.path.isdir(diretorio):
+        os.makedirs(diretorio)
+        if os.geteuid() == 0:
+            dono = os.stat(caminho_config)
+            os.chown(diretorio, dono.st_uid, dono.st_gid)
+    gravar(diretorio, "importacao.prom", "\n".join(linhas) + "\n")
+
+
+def importar(args):
+    padroes = {"usuario": args.usuario, "senha": args.senha, "porta": str(args.porta), "grupo": args.grupo,
+               "modelo": args.modelo_padrao or ""}
+    if any("=" not in m for m in args.modelo):
+        print("--modelo deve ser ORIGEM=MODELO.")
+        return 1
+    mapa_modelos = dict(m.split("=", 1) for m in args.modelo)
+    try:
+        formato, registros, erros, avisos, ignorados = ler_entrada(args.arquivo, args.formato, padroes, mapa_modelos,
+                                                                   args.grupo_por)
+    except (OSError, ValueError, csv.Error) as erro:
+        print(f"Erro ao ler {args.arquivo}: {erro}")
+        return 1
+    for mensagem in erros:
+        print(f"ERRO  {mensagem}")
+    for mensagem in avisos:
+        print(f"AVISO {mensagem}")
+
+    caminho_router_db = os.path.join(args.base, "router.db")
+    linhas = ler_linhas(caminho_router_db)
+    existentes = {r["nome"]: r for _, r in linhas if r}
+    nomes_importados = {r["nome"] for r in registros}
+    novos = [r for r in registros if r["nome"] not in existentes]
+    alterados = [r for r in registros if r["nome"] in existentes and existentes[r["nome"]] != r]
+    removidos = set(existentes) - nomes_importados if args.substituir else set()
+    # O nodo de exemplo do instalador sai assim que entra o primeiro equipamento real
+    if NODO_EXEMPLO in existentes and NODO_EXEMPLO not in nomes_importados and registros:
+        removidos.add(NODO_EXEMPLO)
+
+    mortos, duracao = ({}, 0.0) if args.sem_sonda else sondar(novos + alterados, args)
+    quarentena = ler_quarentena(args.base)
+    data = time.strftime("%Y-%m-%dT%H:%M:%S")
+    aceitos = []
+    for registro in novos + alterados:
+        motivo = mortos.get(chave(registro))
+        if motivo:
+            print(f"{'SEM RESPOSTA' if args.manter_mortos else 'QUARENTENA'} "
+                  f"{registro['nome']} ({registro['ip']}:{registro['porta']}): {motivo}")
+        if motivo and not args.manter_mortos:
+            # Um equipamento alterado que não responde mantém a linha atual; os dados novos esperam na quarentena
+            quarentena[registro["nome"]] = (registro, f"{motivo} {data}")
+        else:
+            aceitos.append(registro)
+            quarentena.pop(registro["nome"], None)
+    for nome in removidos:
+        quarentena.pop(nome, None)
+
+    contagens = {"new": sum(r["nome"] not in existentes for r in aceitos),
+                 "changed": sum(r["nome"] in existentes for r in aceitos),
+                 "unchanged": len(registros) - len(novos) - len(alterados),
+                 "removed": len(removidos), "quarantined": len(novos) + len(alterados) - len(aceitos),
+                 "invalid": len(erros), "skipped": ignorados}
+    print(f"Entrada {args.arquivo} ({formato}): {len(registros)} equipamento(s); "
+          f"{contagens['new']} novo(s), {contagens['changed']} alterado(s), {contagens['unchanged']} sem mudança, "
+          f"{contagens['removed']} removido(s), {contagens['quarantined']} em quarentena, "
+          f"{len(erros)} inválido(s), {ignorados} ignorado(s) pela situação")
+    if args.simular:
+        return 1 if erros else 0
+
+    alterou = gravar(args.base, "router.db", mesclar_linhas(linhas, aceitos, removidos))
+    gravar_quarentena(args.base, quarentena)
+    gravar_metricas(args.base, contagens, len(quarentena), duracao)
+    if alterou:
+        print("router.db atualizado; o oxidized-recarga aplica a mudança "
+              "(sem o serviço: recarga_oxidized.py recarregar).")
+    return 1 if erros else 0
+
+
+# Sonda o inventário atual e a quarentena; com --aplicar troca os equipamentos de lugar
+def sondar_inventario(args):
+    caminho_router_db = os.path.join(args.base, "router.db")
+    linhas = ler_linhas(caminho_router_db)
+    ativos = [r for _, r in linhas if r and r["nome"] != NODO_EXEMPLO]
+    quarentena = ler_quarentena(args.base)
+    em_quarentena = [registro for registro, _ in quarentena.values()]
+    mortos, duracao = sondar(ativos + em_quarentena, args)
+
+    mortos_ativos = [r for r in ativos if chave(r) in mortos]
+    readmitidos = [r for r in em_quarentena if chave(r) not in mortos]
+    for registro in mortos_ativos:
+        print(f"SEM RESPOSTA {registro['nome']} ({registro['ip']}:{registro['porta']}): {mortos[chave(registro)]}")
+    for registro in readmitidos:
+        print(f"RESPONDE     {registro['nome']} ({registro['ip']}:{registro['porta']}) está na quarentena")
+    print(f"{len(mortos_ativos)} de {len(ativos)} equipamento(s) do router.db sem resposta; "
+          f"{len(readmitidos)} de {len(em_quarentena)} da quarentena respondendo")
+    if not args.aplicar:
+        return 1 if mortos_ativos else 0
+
+    # Muitos mortos de uma vez costuma ser problema do lado de quem sonda (rota, firewall), não dos equipamentos
+    if ativos and len(mortos_ativos) > args.limite_quarentena * len(ativos):
+        print(f"Mais de {args.limite_quarentena:.0%} do router.db sem resposta: nada foi movido para a quarentena.")
+        mortos_ativos = []
+    data = time.strftime("%Y-%m-%dT%H:%M:%S")
+    for registro in mortos_ativos:
+        # Dados pendentes de uma importação (mesmo nome, já na quarentena) têm precedência sobre a linha atual
+        quarentena.setdefault(registro["nome"], (registro, f"{mortos[chave(registro)]} {data}"))
+    for registro in readmitidos:
+        del quarentena[registro["nome"]]
+    remover = {r["nome"] for r in mortos_ativos}
+    alterou = gravar(args.base, "router.db", mesclar_linhas(linhas, readmitidos, remover))
+    gravar_quarentena(args.base, quarentena)
+    gravar_metricas(args.base, {"new": len(readmitidos), "quarantined": len(mortos_ativos)}, len(quarentena), duracao)
+    if alterou:
+        print(f"router.db atualizado: {len(readmitidos)} readmitido(s), {len(mortos_ativos)} em quarentena.")
+    return 0
+
+
+def exportar(args):
+    registros = [r for _, r in ler_linhas(os.path.join(args.base, "router.db")) if r]
+    situacoes = {r["nome"]: "" for r in registros}
+    if args.incluir_quarentena:
+        for registro, motivo in ler_quarentena(args.base).values():
+            if registro["nome"] not in situacoes:
+                registros.append(registro)
+            situacoes[registro["nome"]] = motivo
+    campos = inventario_oxidized.CAMPOS + (["quarentena"] if args.incluir_quarentena else [])
+    linhas = []
+    for registro in registros:
+        linha = dict(registro, senha="" if args.sem_senhas else registro["senha"])
+        if args.incluir_quarentena:
+            linha["quarentena"] = situacoes[registro["nome"]]
+        linhas.append(linha)
+
+    saida = sys.stdout if args.saida == "-" else open(args.saida, "w", newline="")
+    try:
+        if args.formato == "json":
+            json.dump(linhas, saida, indent=1, ensure_ascii=False)
+            saida.write("\n")
+        else:
+            escritor = csv.DictWriter(saida, fieldnames=campos)
+            escritor.writeheader()
+            escritor.writerows(linhas)
+    finally:
+        if saida is not sys.stdout:
+            saida.close()
+    if args.saida != "-":
+        print(f"{len(linhas)} equipamento(s) exportado(s) para {args.saida}")
+    return 0
+
+
+def listar_quarentena(args):
+    entradas = ler_quarentena(args.base)
+    for registro, motivo in sorted(entradas.values(), key=lambda e: e[0]["nome"]):
+        print(f"{registro['nome']:<30} {registro['ip']}:{registro['porta']:<6} {registro['grupo']:<15} {motivo}")
+    print(f"{len(entradas)} equipamento(s) em quarentena")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importação/exportação em massa do router.db com sondagem de alcance")
+    parser.add_argument("--base", default=CAMINHO_CONFIG, help="Diretório base do Oxidized (padrão: %(default)s)")
+    sondagem = argparse.ArgumentParser(add_help=False)
+    sondagem.add_argument("--concorrencia", type=int, default=1000, help="Conexões simultâneas na sondagem")
+    sondagem.add_argument("--tempo-limite", type=float, default=3.0, help="Segundos por tentativa de conexão")
+    sondagem.add_argument("--tentativas", type=int, default=2, help="Tentativas por equipamento (só em timeout)")
+    sub = parser.add_subparsers(dest="acao", required=True)
+
+    p_importar = sub.add_parser("importar", parents=[sondagem],
+                                help="Mescla um CSV/JSON/export do NetBox no router.db, sondando os equipamentos")
+    p_importar.add_argument("arquivo", help="Arquivo de entrada ('-' para a entrada padrão)")
+    p_importar.add_argument("--formato", choices=["auto", "csv", "json", "router-db"], default="auto")
+    p_importar.add_argument("--usuario", default="", help="Usuário para as linhas sem usuário (ex.: export do NetBox)")
+    p_importar.add_argument("--senha", default="", help="Senha para as linhas sem senha")
+    p_importar.add_argument("--porta", type=int, default=22, help="Porta para as linhas sem porta (23 para telnet)")
+    p_importar.add_argument("--grupo", default="default", help="Grupo para as linhas sem grupo")
+    p_importar.add_argument("--grupo-por", help="Coluna usada como grupo (ex.: role, tenant; padrão: grupo/site)")
+    p_importar.add_argument("--modelo-padrao", help="Modelo do Oxidized para as linhas sem modelo")
+    p_importar.add_argument("--modelo", action="append", default=[], metavar="ORIGEM=MODELO",
+                            help="Traduz plataforma da entrada para modelo do Oxidized (ex.: cisco-ios=ios)")
+    p_importar.add_argument("--substituir", action="store_true",
+                            help="Remove do router.db os equipamentos ausentes da entrada")
+    p_importar.add_argument("--sem-sonda", action="store_true", help="Mescla sem sondar os equipamentos")
+    p_importar.add_argument("--manter-mortos", action="store_true",
+                            help="Mescla também os que não responderem (só aparecem no relatório)")
+    p_importar.add_argument("--simular", action="store_true", help="Mostra o resultado sem gravar nada")
+
+    p_sondar = sub.add_parser("sondar", parents=[sondagem], help="Sonda o router.db e a quarentena")
+    p_sondar.add_argument("--aplicar", action="store_true",
+                          help="Move para a quarentena os que não respondem e readmite os que voltaram")
+    p_sondar.add_argument("--limite-quarentena", type=float, default=0.2,
+                          help="Fração máxima do router.db movida para a quarentena de uma vez (padrão: %(default)s)")
+
+    p_exportar = sub.add_parser("exportar", help="Exporta o router.db em CSV ou JSON")
+    p_exportar.add_argument("--formato", choices=["csv", "json"], default="csv")
+    p_exportar.add_argument("--saida", default="-", help="Arquivo de saída (padrão: saída padrão)")
+    p_exportar.add_argument("--incluir-quarentena", action="store_true", help="Inclui a quarentena, com o motivo")
+    p_exportar.add_argument("--sem-senhas", action="store_true", help="Deixa a coluna senha vazia")
+
+    sub.add_parser("quarentena", help="Lista os equipamentos em quarentena")
+
+    args = parser.parse_args()
+    if getattr(args, "concorrencia", 1) < 1 or getattr(args, "tentativas", 1) < 1:
+        print("--concorrencia e --tentativas devem ser ao menos 1.")
+        sys.exit(1)
+    acoes = {"importar": importar, "sondar": sondar_inventario, "exportar": exportar, "quarentena": listar_quarentena}
+    sys.exit(acoes[args.acao](args))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@ import subprocess
 import os
 import sys
 
+import configuracao_oxidized
+
 def run_command(command, shell=False):
     print(f"Executing: {command}")
     try:
@@ -11,6 +13,9 @@ def run_command(command, shell=False):
         print(f"Error executing command: {e}")
         sys.exit(1)
 
+def installed_version(package):
+    return subprocess.run(["dpkg-query", "-W", "-f=${Version}", package], capture_output=True, text=True).stdout.strip()
+
 def main():
     if os.getuid() != 0:
         print("This script must be run with sudo.")
@@ -19,25 +24,32 @@ def main():
     print("--- Installing Grafana Enterprise ---")
 
     # 1. Install prerequisites
-    run_command(["apt-get", "update"])
-    run_command(["apt-get", "install", "-y", "apt-transport-https", "software-properties-common", "wget"])
+    # install_stack.py runs a single "apt-get update" before all stacks
+    if not os.getenv("INSTALADOR_APT_ATUALIZADO"):
+        run_command(["apt-get", "update"])
+    run_command(["apt-get", "install", "-y", "-o", "DPkg::Lock::Timeout=600", "apt-transport-https", "software-properties-common", "wget"])
 
-    # 2. Add GPG Key
-    run_command("mkdir -p /etc/apt/keyrings", shell=True)
-    run_command("wget -q -O - https://apt.grafana.com/gpg.key | gpg --dearmor | tee /etc/apt/keyrings/grafana.gpg > /dev/null", shell=True)
+    # 2. Add GPG Key (skipped when already present)
+    key_file = "/etc/apt/keyrings/grafana.gpg"
+    if not os.path.exists(key_file) or os.path.getsize(key_file) == 0:
+        run_command("mkdir -p /etc/apt/keyrings", shell=True)
+        run_command(f"wget -q -O - https://apt.grafana.com/gpg.key | gpg --dearmor | tee {key_file} > /dev/null", shell=True)
 
     # 3. Add APT Repository
-    repo_line = 'echo "deb [signed-by=/etc/apt/keyrings/grafana.gpg] https://apt.grafana.com stable main" | tee /etc/apt/sources.list.d/grafana.list'
-    run_command(repo_line, shell=True)
+    repo_file = "/etc/apt/sources.list.d/grafana.list"
+    repo_entry = f"deb [signed-by={key_file}] https://apt.grafana.com stable main\n"
+    configuracao_oxidized.gravar_se_mudou(repo_file, repo_entry)
 
-    # 4. Install Grafana
-    run_command(["apt-get", "update"])
-    run_command(["apt-get", "install", "-y", "grafana-enterprise"])
+    # 4. Install Grafana (refreshes only the Grafana source list)
+    installed = installed_version("grafana-enterprise")
+    run_command(["apt-get", "update", "-o", f"Dir::Etc::sourcelist={repo_file}",
+                 "-o", "Dir::Etc::sourceparts=-", "-o", "APT::Get::List-Cleanup=0"])
+    run_command(["apt-get", "install", "-y", "-o", "DPkg::Lock::Timeout=600", "grafana-enterprise"])
 
-    # 5. Enable and Start Service
+    # 5. Enable and Start Service (restarted only when apt installed or upgraded the package)
     run_command(["systemctl", "daemon-reload"])
     run_command(["systemctl", "enable", "grafana-server"])
-    run_command(["systemctl", "start", "grafana-server"])
+    configuracao_oxidized.reiniciar_se_mudou(["grafana-server"], installed_version("grafana-enterprise") != installed)
 
     print("\n--- Grafana Installation Complete ---")
     print("Web UI: http://<machine-ip>:3000")
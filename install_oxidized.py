@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
+import argparse
+import json
 import subprocess
 import os
 import sys
+import shutil
+
+import configuracao_oxidized
 
 # Função para executar comandos no terminal e tratar erros
 def executar_comando(comando, shell=False):
@@ -13,37 +18,70 @@ def executar_comando(comando, shell=False):
         sys.exit(1)
 
 def main():
-    # Detecta o usuário que rodou o sudo para aplicar as permissões corretas
-    candidato_usuario = os.getenv("SUDO_USER")
-    if not candidato_usuario or candidato_usuario == "root":
-        # Procura o primeiro usuário comum no diretório /home
-        casas = [d for d in os.listdir('/home') if os.path.isdir(os.path.join('/home', d)) and d != 'lost+found']
-        if casas:
-            usuario = casas[0]
-        else:
-            usuario = "root"
-    else:
-        usuario = candidato_usuario
+    parser = argparse.ArgumentParser(description="Instalação do Oxidized com sincronização para o GitHub")
+    parser.add_argument("url_github", nargs="?", default="", help="URL SSH do repositório de backup")
+    parser.add_argument("--espelho", choices=["incremental", "completo", "replicacao"], default="incremental",
+                        help="Modo de envio de configs ao backup (replicacao: push do histórico para o branch 'equipamentos')")
+    parser.add_argument("--fonte", choices=["csv", "sql"], default="csv",
+                        help="Fonte do inventário: router.db (csv) ou banco SQLite indexado (sql)")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Instâncias do Oxidized (oxidized@N), cada uma com parte do router.db")
+    parser.add_argument("--particao", choices=["hash", "grupo"], default="hash",
+                        help="Divisão do router.db entre os shards: hash do nome do nodo ou grupo inteiro")
+    parser.add_argument("--snapshots", action="store_true",
+                        help="Mantém também o armazém local de snapshots deduplicados (restauração por instante)")
+    parser.add_argument("--agendador", action="store_true",
+                        help="Agendamento por falhas: backoff dos nodos que falham e prioridade aos atrasados/críticos")
+    parser.add_argument("--grupos-criticos", nargs="*", default=[],
+                        help="Grupos coletados com prioridade pelo agendador")
+    parser.add_argument("--importar", metavar="ARQUIVO",
+                        help="Inventário inicial de um CSV/JSON/export do NetBox, sondado antes de entrar no router.db")
+    args = parser.parse_args()
+    if args.shards < 1:
+        print("--shards deve ser ao menos 1.")
+        sys.exit(1)
 
-    # Define o novo caminho padrão em /opt/oxidized
-    diretorio_home = os.path.expanduser(f"~{usuario}")
-    caminho_config = "/opt/oxidized"
+    # Detecta o usuário que rodou o sudo para aplicar as permissões corretas
+    usuario = configuracao_oxidized.detectar_usuario()
+    # threads/timeout já ajustados pelo ajuste_oxidized.py são preservados
+    cfg = configuracao_oxidized.Configuracao(
+        usuario=usuario, espelho=args.espelho, fonte=args.fonte, shards=args.shards, particao=args.particao,
+        snapshots=args.snapshots, agendador=args.agendador, grupos_criticos=tuple(args.grupos_criticos),
+        **configuracao_oxidized.parametros_instalados())
+    caminho_config = cfg.caminho_config
     
     print(f"--- Iniciando Instalação do Oxidized em {caminho_config} ---")
 
     # 1. Instalação de Dependências do Sistema
     print("Instalando dependências do sistema...")
-    executar_comando(["apt-get", "update"])
+    # Quando chamado pelo install_stack.py o "apt-get update" já foi feito uma vez para todas as etapas
+    if not os.getenv("INSTALADOR_APT_ATUALIZADO"):
+        executar_comando(["apt-get", "update"])
     dependencias = [
         "ruby", "ruby-dev", "make", "gcc", "g++", "cmake", "libcurl4-openssl-dev", 
         "libssl-dev", "pkg-config", "libicu-dev", "libsqlite3-dev", "libyaml-dev", 
-        "zlib1g-dev", "git", "rsync"
+        "zlib1g-dev", "git", "rsync", "curl"
     ]
-    executar_comando(["apt-get", "install", "-y"] + dependencias)
+    if args.snapshots:
+        # Blocos dos snapshots comprimidos com zstd (sem o módulo o snapshots_oxidized.py cairia para zlib)
+        dependencias.append("python3-zstandard")
+    # Espera o lock do dpkg: outras etapas podem estar instalando pacotes em paralelo
+    executar_comando(["apt-get", "install", "-y", "-o", "DPkg::Lock::Timeout=600"] + dependencias)
+    if args.snapshots and subprocess.run(["/usr/bin/python3", "-c", "import zstandard"],
+                                         stderr=subprocess.DEVNULL).returncode != 0:
+        print("Erro: --snapshots exige o módulo zstandard (pacote python3-zstandard), que não pôde ser instalado.")
+        sys.exit(1)
 
     # 2. Instalação das Gems do Ruby
     print("Instalando gems do Oxidized...")
-    executar_comando(["gem", "install", "oxidized", "oxidized-web", "rugged"])
+    gems = ["oxidized", "oxidized-web", "rugged"]
+    if args.fonte == "sql":
+        gems += ["sequel", "sqlite3"]
+    faltando = [g for g in gems if subprocess.run(["gem", "list", "-i", f"^{g}$"], stdout=subprocess.DEVNULL).returncode != 0]
+    if faltando:
+        executar_comando(["gem", "install"] + faltando)
+    else:
+        print("Gems já instaladas.")
 
     # 3. Criação da Estrutura de Diretórios
     print(f"Criando diretórios em {caminho_config}...")
@@ -55,16 +93,14 @@ def main():
     # 4. Configuração de Chaves SSH (Centralizado em /opt/oxidized/.ssh)
     diretorio_ssh = os.path.join(caminho_config, ".ssh")
     os.makedirs(diretorio_ssh, exist_ok=True)
-    arquivo_chave = os.path.join(diretorio_ssh, "id_ed25519_github")
+    arquivo_chave = cfg.arquivo_chave
 
     # Ajusta permissões cedo para evitar erro de 'Permission Denied' no ssh-keygen
     executar_comando(f"chown -R {usuario}:{usuario} {caminho_config}", shell=True)
 
     # 5. Configuração do GitHub
-    url_github = ""
-    if len(sys.argv) > 1:
-        url_github = sys.argv[1].strip()
-    
+    url_github = args.url_github.strip()
+
     if not url_github:
         try:
             url_github = input("Digite a URL SSH do seu GitHub (ex: git@github.com:usuario/repo.git) ou deixe vazio: ").strip()
@@ -90,18 +126,7 @@ def main():
             pass
 
     # Configura o arquivo SSH config no perfil do usuário para usar a chave em /opt
-    diretorio_ssh_usuario = os.path.join(diretorio_home, ".ssh")
-    os.makedirs(diretorio_ssh_usuario, exist_ok=True)
-    executar_comando(f"chown {usuario}:{usuario} {diretorio_ssh_usuario}", shell=True)
-    
-    config_ssh = os.path.join(diretorio_ssh_usuario, "config")
-    entrada_ssh = f"\nHost github.com\n  HostName github.com\n  User git\n  IdentityFile {arquivo_chave}\n  StrictHostKeyChecking no\n"
-    
-    if not os.path.exists(config_ssh) or arquivo_chave not in open(config_ssh).read():
-        with open(config_ssh, "a") as f:
-            f.write(entrada_ssh)
-        executar_comando(f"chmod 600 {config_ssh}", shell=True)
-        executar_comando(f"chown {usuario}:{usuario} {config_ssh}", shell=True)
+    configuracao_oxidized.configurar_ssh_github(usuario, arquivo_chave)
 
     # 6. Inicialização dos Repositórios Git Locais
     if not os.path.exists(os.path.join(diretorio_backups, ".git")):
@@ -118,118 +143,139 @@ def main():
     if url_github:
         executar_comando(f"sudo -u {usuario} git -C {repositorio_sincronizacao} remote add origin {url_github} || sudo -u {usuario} git -C {repositorio_sincronizacao} remote set-url origin {url_github}", shell=True)
 
-    # 7. Criação do arquivo de configuração do Oxidized (config)
-    comando_hook = (
-        f'git -C {caminho_config}/configs/ checkout master . 2>/dev/null; '
-        f'REPO_DIR="{caminho_config}/repo_sync"; '
-        'mkdir -p $REPO_DIR/equipamentos_configuracao $REPO_DIR/setup/model; '
-        f'rsync -av --exclude ".git" {caminho_config}/configs/ $REPO_DIR/equipamentos_configuracao/; '
-        'find $REPO_DIR/equipamentos_configuracao/ -maxdepth 1 -type f -exec mkdir -p $REPO_DIR/equipamentos_configuracao/default/ \\; -exec mv {} $REPO_DIR/equipamentos_configuracao/default/ \\;; '
-        f'cp {caminho_config}/config $REPO_DIR/setup/config; '
-        f'cp {caminho_config}/router.db $REPO_DIR/setup/router.db; '
-        f'cp {caminho_config}/model/vrp.rb $REPO_DIR/setup/model/vrp.rb; '
-        f'cp {caminho_config}/install_oxidized.py $REPO_DIR/setup/install_oxidized.py; '
-        f'cp {caminho_config}/restore_oxidized.py $REPO_DIR/setup/restore_oxidized.py; '
-        f'[ -f {caminho_config}/last_failures.log ] && cp {caminho_config}/last_failures.log $REPO_DIR/setup/last_failures.log; '
-        'git -C $REPO_DIR config user.name "Oxidized"; '
-        'git -C $REPO_DIR config user.email "oxidized@backup.local"; '
-        'git -C $REPO_DIR add .; '
-        'git -C $REPO_DIR commit -m "Sincronismo Automático: Estado do Projeto e Configurações" --allow-empty; '
-        'git -C $REPO_DIR push origin master --force'
-    )
-    
-    config_oxidized = f"""---
-resolve_dns: true
-interval: 3600
-use_max_threads: false
-threads: 30
-timeout: 20
-retries: 3
-prompt: !ruby/regexp /^([\\w.@-]+[#>][\\s]?)$/
-pid: "{caminho_config}/pid"
-rest: 0.0.0.0:8888
-extensions:
-  oxidized-web:
-    load: true
-hooks:
-  error_report:
-    type: exec
-    events: [node_fail]
-    cmd: 'echo "$(date "+%Y-%m-%d %H:%M:%S") | Nodo: ${{OX_NODE_NAME}} | Status: ${{OX_JOB_STATUS}} | Erro: ${{OX_ERR_TYPE}} | Motivo: ${{OX_ERR_REASON}}" >> {caminho_config}/last_failures.log'
-    async: true
-  full_project_sync:
-    type: exec
-    events: [post_store]
-    cmd: '{comando_hook}'
-    async: true
-input:
-  default: ssh, telnet
-  debug: false
-  ssh:
-    secure: false
-output:
-  default: git
-  git:
-    user: Oxidized
-    email: oxidized@backup.local
-    repo: "{caminho_config}/configs"
-source:
-  default: csv
-  csv:
-    file: "{caminho_config}/router.db"
-    delimiter: !ruby/regexp /:/
-    map:
-      name: 0
-      ip: 1
-      model: 2
-      username: 3
-      password: 4
-      group: 6
-    vars_map:
-      ssh_port: 5
-"""
-    with open(os.path.join(caminho_config, "config"), "w") as f:
-        f.write(config_oxidized)
-    
-    # 8. Criação do arquivo router.db (Exemplo)
+    # 7. Scripts do projeto e spool do sincronizador
+    # Só os scripts com conteúdo novo são regravados; se algum mudou, os serviços Python são reiniciados
+    diretorio_scripts = os.path.dirname(os.path.abspath(__file__))
+    scripts_alterados = [script for script in configuracao_oxidized.SCRIPTS_PROJETO
+                         if os.path.exists(os.path.join(diretorio_scripts, script))
+                         and configuracao_oxidized.copiar_se_mudou(os.path.join(diretorio_scripts, script),
+                                                                   os.path.join(caminho_config, script))]
+    os.makedirs(cfg.diretorio_spool, exist_ok=True)
+    executar_comando(f"chown -R {usuario}:{usuario} {cfg.diretorio_spool}", shell=True)
+
+    # Falhas estruturadas: migra o last_failures.log antigo para o registro em falhas/ (uma única vez)
+    log_antigo = os.path.join(caminho_config, "last_failures.log")
+    if os.path.exists(log_antigo) and not os.path.exists(os.path.join(caminho_config, "falhas", "falhas.db")):
+        executar_comando(f"sudo -u {usuario} python3 {caminho_config}/falhas_oxidized.py --base {caminho_config} importar-log {log_antigo}", shell=True)
+        os.replace(log_antigo, log_antigo + ".migrado")
+
+    # O observador da recarga fica parado durante a instalação: quem decide entre reiniciar e recarregar é o instalador
+    subprocess.run(["systemctl", "stop", "oxidized-recarga"], stderr=subprocess.DEVNULL)
+
+    # 8. Criação do arquivo de configuração do Oxidized (config), regravado só se o conteúdo mudou
+    arquivo_config = os.path.join(caminho_config, "config")
+    config_alterado = configuracao_oxidized.gravar_se_mudou(arquivo_config, configuracao_oxidized.renderizar_config(cfg))
+    shutil.chown(arquivo_config, usuario, usuario)
+
+    # 9. Criação do arquivo router.db: importado em massa (equipamentos sem resposta ficam na quarentena) ou exemplo
     arquivo_router_db = os.path.join(caminho_config, "router.db")
+    if args.importar:
+        print(f"Importando o inventário de {args.importar}...")
+        resultado = subprocess.run(["python3", f"{caminho_config}/importacao_oxidized.py", "--base", caminho_config,
+                                    "importar", os.path.abspath(args.importar)], capture_output=True, text=True)
+        print(resultado.stdout, end="")
+        if resultado.returncode != 0:
+            print(f"Importação com erros; as linhas válidas foram mescladas ao router.db. {resultado.stderr.strip()}")
     if not os.path.exists(arquivo_router_db):
         with open(arquivo_router_db, "w") as f:
             f.write("# nome:ip:modelo:usuario:senha:porta_ssh:grupo\n")
             f.write("DUMMY_NODE:127.0.0.1:routeros:admin:admin:22:default\n")
 
-    # 9. Configuração do Serviço no Systemd
-    conteudo_servico = f"""[Unit]
-Description=Oxidized - Backup de Configurações de Rede
-After=network.target
-
-[Service]
-User={usuario}
-Environment="OXIDIZED_HOME={caminho_config}"
-ExecStart=/usr/local/bin/oxidized
-Restart=on-failure
-RestartSec=30s
-
-[Install]
-WantedBy=multi-user.target
-"""
-    print(f"Configurando serviço systemd para o usuário {usuario}...")
-    with open("/etc/systemd/system/oxidized.service", "w") as f:
-        f.write(conteudo_servico)
-    
-    os.chmod("/etc/systemd/system/oxidized.service", 0o644)
-    executar_comando(["systemctl", "daemon-reload"])
-    executar_comando(["systemctl", "enable", "oxidized"])
-    
+    if args.fonte == "sql":
+        # Carrega o router.db no banco indexado (o router.db continua sendo o arquivo versionado no backup)
+        print("Gerando inventário indexado a partir do router.db...")
+        resultado = subprocess.run(["sudo", "-u", usuario, "python3", f"{caminho_config}/inventario_oxidized.py",
+                                    "--banco", f"{caminho_config}/inventario.db", "--router-db", arquivo_router_db,
+                                    "importar", "--substituir"], capture_output=True, text=True)
+        print(resultado.stdout, end="")
+        if resultado.returncode != 0:
+            print(f"Erro ao gerar o inventário indexado: {resultado.stderr.strip()}")
+            sys.exit(1)
+
+    # 10. Serviços no systemd: só as unidades com conteúdo novo são regravadas
+    print(f"Configurando serviços systemd para o usuário {usuario}...")
+    unidades_alteradas = configuracao_oxidized.aplicar_unidades(configuracao_oxidized.renderizar_unidades(cfg))
+
+    # 10.1 Modo com shards: uma instância oxidized@N por parte do router.db, cada uma com
+    # OXIDIZED_HOME, porta REST e repositório configs próprios; o sincronizador mescla os repositórios
+    arquivo_shards = os.path.join(caminho_config, "shards", "shards.json")
+    shards_anteriores = 0
+    if os.path.exists(arquivo_shards):
+        with open(arquivo_shards) as f:
+            shards_anteriores = json.load(f).get("quantidade", 0)
+    if args.shards > 1:
+        print(f"Dividindo o router.db em {args.shards} shards ({args.particao})...")
+        resultado = subprocess.run(["sudo", "-u", usuario, "python3", f"{caminho_config}/shards_oxidized.py",
+                                    "--base", caminho_config, "particionar", "--quantidade", str(args.shards),
+                                    "--modo", args.particao], capture_output=True, text=True)
+        print(resultado.stdout, end="")
+        if resultado.returncode != 0:
+            print(f"Erro ao particionar o router.db: {resultado.stderr.strip()}")
+            sys.exit(1)
+        servicos_parados = ["oxidized"] + [f"oxidized@{i}" for i in range(args.shards, shards_anteriores)]
+    else:
+        servicos_parados = [f"oxidized@{i}" for i in range(shards_anteriores)]
+        if os.path.exists(arquivo_shards):
+            # Sem a definição o sincronizador deixa de mesclar; os repositórios dos shards ficam preservados
+            os.remove(arquivo_shards)
+
+    # 10.2 Inventário ativo inicial (o agendador o mantém depois, a cada passe)
+    if args.agendador:
+        executar_comando(f"sudo -u {usuario} python3 {caminho_config}/agendador_oxidized.py --base {caminho_config} "
+                         f"executar --sem-rest", shell=True)
+        servicos_apoio = ["oxidized-sync", "oxidized-agendador", "oxidized-recarga"]
+    else:
+        servicos_apoio = ["oxidized-sync", "oxidized-recarga"]
+        servicos_parados.append("oxidized-agendador")
+    servicos_oxidized = list(cfg.servicos_oxidized)
+
+    executar_comando(["systemctl", "enable"] + servicos_apoio + servicos_oxidized)
+    executar_comando(["systemctl", "enable", "--now", "oxidized-manutencao.timer"])
+    for servico in servicos_parados:
+        subprocess.run(["systemctl", "disable", "--now", servico], stderr=subprocess.DEVNULL)
+
     # Limpa possíveis configurações antigas do root que podem causar erro
     if os.path.exists("/root/.config/oxidized"):
         executar_comando(["rm", "-rf", "/root/.config/oxidized"])
 
-    executar_comando(["systemctl", "restart", "oxidized"])
+    # Reinício só do que mudou: reiniciar o Oxidized descarta a fila e recoleta a frota inteira.
+    # Se só o inventário mudou, o /reload basta e mantém o agendamento dos nodos já conhecidos.
+    apoio_alterado = bool(scripts_alterados) or any(f"{s}.service" in unidades_alteradas for s in servicos_apoio)
+    configuracao_oxidized.reiniciar_se_mudou(servicos_apoio, apoio_alterado)
+    # O exportador embutido roda os scripts copiados acima; o try-restart não mexe nele se não estiver em execução
+    # (ou ainda não instalado)
+    if set(scripts_alterados) & set(configuracao_oxidized.SCRIPTS_EXPORTADOR):
+        subprocess.run(["systemctl", "try-restart", "oxidized-exporter"], stderr=subprocess.DEVNULL)
+    oxidized_ativo = subprocess.run(["systemctl", "is-active", "--quiet"] + servicos_oxidized).returncode == 0
+    oxidized_alterado = config_alterado or bool(unidades_alteradas & {"oxidized.service", "oxidized@.service"})
+    configuracao_oxidized.reiniciar_se_mudou(servicos_oxidized, oxidized_alterado)
+    if oxidized_ativo and not oxidized_alterado:
+        executar_comando(f"sudo -u {usuario} python3 {caminho_config}/recarga_oxidized.py --base {caminho_config} "
+                         f"recarregar", shell=True)
+
+    # Integra as métricas do sincronizador ao Prometheus local, se existir
+    config_prometheus = "/etc/prometheus/prometheus.yml"
+    if os.path.exists(config_prometheus):
+        with open(config_prometheus, "r") as f:
+            conteudo_prometheus = f.read()
+        # Com o install_prometheus.py atual o job vem do perfil de dimensionamento em /etc/prometheus/scrape
+        if "job_name: 'oxidized_sync'" not in conteudo_prometheus and not os.path.exists("/etc/prometheus/scrape/oxidized.yml"):
+            with open(config_prometheus, "a") as f:
+                f.write("""
+  - job_name: 'oxidized_sync'
+    static_configs:
+      - targets: ['localhost:8890']
+""")
+            executar_comando(["systemctl", "restart", "prometheus"])
 
     print("\n--- Instalação e Sincronização Desacoplada Concluída ---")
-    print(f"Interface Web: http://<ip-da-maquina>:8888")
+    if args.shards > 1:
+        for indice in range(args.shards):
+            print(f"Shard {indice}: http://<ip-da-maquina>:{configuracao_oxidized.PORTA_BASE_SHARDS + indice} ({caminho_config}/shards/{indice})")
+    else:
+        print(f"Interface Web: http://<ip-da-maquina>:{configuracao_oxidized.PORTA_REST}")
     print(f"Diretório Base: {caminho_config}")
+    print(f"Métricas do sincronizador: http://127.0.0.1:{configuracao_oxidized.PORTA_SYNC}/metrics")
 
 if __name__ == "__main__":
     main()
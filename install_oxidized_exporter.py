@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
+import argparse
+import json
 import subprocess
 import os
 import sys
 
+import configuracao_oxidized
+
 def run_command(command, shell=False):
     print(f"Executing: {command}")
     try:
@@ -13,6 +17,11 @@ def run_command(command, shell=False):
     return True
 
 def main():
+    parser = argparse.ArgumentParser(description="Install the Oxidized Prometheus exporter")
+    parser.add_argument("--native", action="store_true",
+                        help="Use the bundled Python exporter (exportador_oxidized.py) instead of the oxidized-exporter .deb")
+    args = parser.parse_args()
+
     if os.getuid() != 0:
         print("This script must be run with sudo.")
         sys.exit(1)
@@ -23,13 +32,41 @@ def main():
 
     print(f"--- Installing Oxidized Exporter v{version} ---")
 
-    # 1. Download .deb
-    if not os.path.exists(deb_file):
-        print(f"Downloading Exporter v{version}...")
-        run_command(["wget", url])
+    # Sharded deployment (install_oxidized.py --shards): one REST API per oxidized@N instance
+    rest_urls = ["http://127.0.0.1:8888"]
+    shards_file = "/opt/oxidized/shards/shards.json"
+    if os.path.exists(shards_file):
+        with open(shards_file) as f:
+            shards = json.load(f)
+        rest_urls = [f"http://127.0.0.1:{shards['porta_base'] + i}" for i in range(shards["quantidade"])]
+        if not args.native:
+            print(f"{len(rest_urls)} Oxidized shards found: using the bundled exporter, the .deb one reads a single instance.")
+            args.native = True
 
-    # 2. Install package
-    run_command(f"apt-get install -y ./{deb_file}", shell=True)
+    # 1. Download .deb and 2. Install package (skipped when this version is already installed)
+    installed = subprocess.run(["dpkg-query", "-W", "-f=${Version}", "oxidized-exporter"], capture_output=True, text=True).stdout
+    # Only a new binary/script or a new unit restarts the exporter; an unchanged re-run just makes sure it is running
+    changed = False
+    exec_start = '/usr/bin/oxidized-exporter --url="http://127.0.0.1:8888"'
+    if args.native:
+        # Bundled exporter: in-memory node cache, pre-rendered /metrics, same series and port
+        print("Installing the bundled Python exporter...")
+        os.makedirs("/opt/oxidized", exist_ok=True)
+        # tamanhos_oxidized.py and mudancas_oxidized.py read config size and churn straight from the configs git repo
+        for name in configuracao_oxidized.SCRIPTS_EXPORTADOR:
+            script = os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+            changed |= configuracao_oxidized.copiar_se_mudou(script, os.path.join("/opt/oxidized", name))
+        target = "/opt/oxidized/exportador_oxidized.py"
+        url_args = " ".join(f'--url "{rest_url}"' for rest_url in rest_urls)
+        exec_start = f'/usr/bin/python3 {target} {url_args} --porta 8080 --intervalo 60'
+    elif installed.strip() == version:
+        print(f"Oxidized Exporter v{version} already installed, skipping download.")
+    else:
+        if not os.path.exists(deb_file):
+            print(f"Downloading Exporter v{version}...")
+            run_command(["wget", url])
+        run_command(f"apt-get install -y -o DPkg::Lock::Timeout=600 ./{deb_file}", shell=True)
+        changed = True
 
     # 3. Configure/Verify Service
     # The deb package usually creates a service, but let's ensure it knows where Oxidized is.
@@ -40,18 +77,16 @@ After=network.target oxidized.service
 
 [Service]
 Type=simple
-ExecStart=/usr/bin/oxidized-exporter --url="http://127.0.0.1:8888"
+ExecStart={exec_start}
 Restart=always
 
 [Install]
 WantedBy=multi-user.target
 """
-    with open("/etc/systemd/system/oxidized-exporter.service", "w") as f:
-        f.write(service_content)
+    changed_units = configuracao_oxidized.aplicar_unidades({"oxidized-exporter.service": service_content})
 
-    run_command(["systemctl", "daemon-reload"])
     run_command(["systemctl", "enable", "oxidized-exporter"])
-    run_command(["systemctl", "start", "oxidized-exporter"])
+    configuracao_oxidized.reiniciar_se_mudou(["oxidized-exporter"], changed or bool(changed_units))
 
     # 4. Integrate with Prometheus if available
     prom_config = "/etc/prometheus/prometheus.yml"
@@ -60,15 +95,17 @@ WantedBy=multi-user.target
         with open(prom_config, "r") as f:
             content = f.read()
         
-        if "job_name: 'oxidized'" not in content:
+        if os.path.exists("/etc/prometheus/scrape/oxidized.yml"):
+            # Job managed by install_prometheus.py, with the interval and drop rules of the sizing profile
+            print("Oxidized job already defined in /etc/prometheus/scrape/oxidized.yml.")
+        elif "job_name: 'oxidized'" not in content:
             scrape_job = """
   - job_name: 'oxidized'
     static_configs:
       - targets: ['localhost:8080']
 """
-            with open(prom_config, "a") as f:
-                f.write(scrape_job)
-            run_command(["systemctl", "restart", "prometheus"])
+            configuracao_oxidized.gravar_se_mudou(prom_config, content + scrape_job)
+            configuracao_oxidized.reiniciar_se_mudou(["prometheus"], True)
             print("Prometheus configuration updated and service restarted.")
         else:
             print("Oxidized job already exists in Prometheus config.")
@@ -1,10 +1,125 @@
 #!/usr/bin/env python3
+import argparse
+import math
+import re
 import subprocess
 import os
 import sys
 import tarfile
 import shutil
 
+import configuracao_oxidized
+
+# Sizing profiles picked from the router.db device count. Backup state only changes once per
+# Oxidized interval and the exporter refreshes its cache every 60s, so the oxidized job never needs
+# to be scraped faster than that; intervals stay under the 5m lookback so panels have no gaps.
+PROFILES = {
+    "small": {"max_devices": 500, "global": "30s", "oxidized": "60s", "oxidized_sync": "30s",
+              "retention_days": 90, "drop_churn": False},
+    "medium": {"max_devices": 5000, "global": "60s", "oxidized": "120s", "oxidized_sync": "60s",
+               "retention_days": 60, "drop_churn": True},
+    "large": {"max_devices": None, "global": "60s", "oxidized": "180s", "oxidized_sync": "60s",
+              "retention_days": 30, "drop_churn": True},
+}
+# Series per device: status, lines, size and backup time, plus the churn counters of mudancas_oxidized.py
+SERIES_PER_DEVICE = 4
+CHURN_SERIES_PER_DEVICE = 5
+# Never charted: Go runtime/process series of the .deb exporter, and the per-device churn counters on
+# bigger fleets (changes_total and last_change_timestamp stay for ad-hoc queries)
+DROP_ALWAYS = "go_.*|process_.*|promhttp_.*"
+DROP_CHURN = "oxidized_device_config_(lines_added|lines_removed|churn_bytes)_total"
+BYTES_PER_SAMPLE = 2
+BYTES_PER_ACTIVE_SERIES = 4096
+SCRAPE_DIR = "/etc/prometheus/scrape"
+DATA_DIR = "/var/lib/prometheus"
+
+
+def count_devices(router_db):
+    try:
+        with open(router_db) as f:
+            return sum(1 for line in f if line.strip() and not line.lstrip().startswith("#"))
+    except FileNotFoundError:
+        return 0
+
+
+def choose_profile(devices):
+    for name, profile in PROFILES.items():
+        if profile["max_devices"] is None or devices <= profile["max_devices"]:
+            return name
+
+
+def seconds(duration):
+    return int(duration[:-1]) * {"s": 1, "m": 60, "h": 3600}[duration[-1]]
+
+
+# Expected active series, disk for the whole retention and head block memory for a profile
+def estimate(devices, profile):
+    per_device = SERIES_PER_DEVICE + (2 if profile["drop_churn"] else CHURN_SERIES_PER_DEVICE)
+    device_series = devices * per_device
+    other_series = 1000
+    samples_per_day = (device_series * 86400 / seconds(profile["oxidized"])
+                       + other_series * 86400 / seconds(profile["global"]))
+    disk = samples_per_day * profile["retention_days"] * BYTES_PER_SAMPLE
+    return {
+        "series": device_series + other_series,
+        "disk_bytes": disk,
+        # Retention by size as a backstop: twice the estimate, at least 1GB
+        "retention_size_gb": max(1, math.ceil(disk * 2 / 1024 ** 3)),
+        "memory_bytes": (device_series + other_series) * BYTES_PER_ACTIVE_SERIES,
+    }
+
+
+def render_scrape_config(profile):
+    drop = DROP_ALWAYS + ("|" + DROP_CHURN if profile["drop_churn"] else "")
+    jobs = []
+    for job, target in (("oxidized", "localhost:8080"), ("oxidized_sync", "localhost:8890")):
+        interval = profile[job]
+        jobs.append(f"""  - job_name: '{job}'
+    scrape_interval: {interval}
+    scrape_timeout: {min(seconds(interval), 30)}s
+    static_configs:
+      - targets: ['{target}']
+    metric_relabel_configs:
+      - source_labels: [__name__]
+        regex: '{drop}'
+        action: drop
+""")
+    return "# Generated by install_prometheus.py from the sizing profile; edits are overwritten.\nscrape_configs:\n" + "".join(jobs)
+
+
+# Jobs appended to prometheus.yml by older installers, now defined in the scrape directory
+def remove_legacy_jobs(content):
+    for job, target in (("oxidized", "localhost:8080"), ("oxidized_sync", "localhost:8890")):
+        content = content.replace(f"""
+  - job_name: '{job}'
+    static_configs:
+      - targets: ['{target}']
+""", "")
+    return content
+
+
+def report(router_db, profile_name):
+    devices = count_devices(router_db)
+    profile_name = profile_name if profile_name != "auto" else choose_profile(devices)
+    expected = estimate(devices, PROFILES[profile_name])
+    print(f"Devices in {router_db}: {devices} -> profile '{profile_name}'")
+    print(f"Expected: {expected['series']} active series, {expected['disk_bytes'] / 1024 ** 3:.2f} GB on disk, "
+          f"{expected['memory_bytes'] / 1024 ** 2:.0f} MB of head memory")
+    usage = subprocess.run(["du", "-sb", DATA_DIR], capture_output=True, text=True).stdout.split()
+    if usage:
+        print(f"Current size of {DATA_DIR}: {int(usage[0]) / 1024 ** 3:.2f} GB")
+    # Cardinality of the latest block: which metrics and labels actually cost series
+    analysis = subprocess.run(["/usr/local/bin/promtool", "tsdb", "analyze", DATA_DIR], capture_output=True, text=True)
+    if analysis.returncode != 0:
+        print(f"promtool tsdb analyze failed: {analysis.stderr.strip()}")
+        return
+    print(analysis.stdout.strip())
+    found = re.search(r"Total Series: (\d+)", analysis.stdout)
+    if found and int(found.group(1)) > expected["series"] * 1.5:
+        print(f"\nWARNING: {found.group(1)} series in the latest block, well above the expected {expected['series']}; "
+              "check the highest cardinality metrics above.")
+
+
 def run_command(command, shell=False):
     print(f"Executing: {command}")
     try:
@@ -14,6 +129,18 @@ def run_command(command, shell=False):
         sys.exit(1)
 
 def main():
+    parser = argparse.ArgumentParser(description="Install Prometheus sized for the Oxidized fleet")
+    parser.add_argument("--profile", choices=["auto"] + list(PROFILES), default="auto",
+                        help="Sizing profile (auto: from the router.db device count)")
+    parser.add_argument("--router-db", default="/opt/oxidized/router.db", help="Inventory used to size the profile")
+    parser.add_argument("--report", action="store_true",
+                        help="Only compare the profile estimate with the TSDB (promtool tsdb analyze)")
+    args = parser.parse_args()
+
+    if args.report:
+        report(args.router_db, args.profile)
+        return
+
     if os.getuid() != 0:
         print("This script must be run with sudo.")
         sys.exit(1)
@@ -31,27 +158,45 @@ def main():
     os.makedirs("/etc/prometheus", exist_ok=True)
     os.makedirs("/var/lib/prometheus", exist_ok=True)
 
-    # 2. Download and Extract
-    if not os.path.exists(tar_file):
-        print(f"Downloading Prometheus v{version}...")
-        run_command(["wget", url])
-    
-    with tarfile.open(tar_file, "r:gz") as tar:
-        tar.extractall()
-
-    # 3. Copy Binaries and Assets
-    shutil.copy2(f"{prom_dir}/prometheus", "/usr/local/bin/")
-    shutil.copy2(f"{prom_dir}/promtool", "/usr/local/bin/")
-    
-    if os.path.exists(f"{prom_dir}/consoles"):
-        shutil.copytree(f"{prom_dir}/consoles", "/etc/prometheus/consoles", dirs_exist_ok=True)
-    if os.path.exists(f"{prom_dir}/console_libraries"):
-        shutil.copytree(f"{prom_dir}/console_libraries", "/etc/prometheus/console_libraries", dirs_exist_ok=True)
+    # 2. Download and Extract (skipped when this version is already installed)
+    installed = subprocess.run("/usr/local/bin/prometheus --version 2>&1", shell=True, capture_output=True, text=True).stdout
+    binaries_changed = f"version {version} " not in installed
+    if not binaries_changed:
+        print(f"Prometheus v{version} already installed, skipping download.")
+    else:
+        if not os.path.exists(tar_file):
+            print(f"Downloading Prometheus v{version}...")
+            run_command(["wget", url])
+
+        with tarfile.open(tar_file, "r:gz") as tar:
+            tar.extractall()
+
+        # 3. Copy Binaries and Assets
+        shutil.copy2(f"{prom_dir}/prometheus", "/usr/local/bin/")
+        shutil.copy2(f"{prom_dir}/promtool", "/usr/local/bin/")
+
+        if os.path.exists(f"{prom_dir}/consoles"):
+            shutil.copytree(f"{prom_dir}/consoles", "/etc/prometheus/consoles", dirs_exist_ok=True)
+        if os.path.exists(f"{prom_dir}/console_libraries"):
+            shutil.copytree(f"{prom_dir}/console_libraries", "/etc/prometheus/console_libraries", dirs_exist_ok=True)
 
     # 4. Create Initial Config
-    config_content = """global:
-  scrape_interval: 15s
-  evaluation_interval: 15s
+    devices = count_devices(args.router_db)
+    profile_name = args.profile if args.profile != "auto" else choose_profile(devices)
+    profile = PROFILES[profile_name]
+    expected = estimate(devices, profile)
+    print(f"Sizing profile '{profile_name}' for {devices} devices: ~{expected['series']} series, "
+          f"~{expected['disk_bytes'] / 1024 ** 3:.2f} GB over {profile['retention_days']} days")
+
+    config_content = f"""global:
+  scrape_interval: {profile['global']}
+  evaluation_interval: {profile['global']}
+
+rule_files:
+  - /etc/prometheus/rules/*.yml
+
+scrape_config_files:
+  - {SCRAPE_DIR}/*.yml
 
 scrape_configs:
   - job_name: 'prometheus'
@@ -60,8 +205,31 @@ scrape_configs:
 """
     config_path = "/etc/prometheus/prometheus.yml"
     if not os.path.exists(config_path):
-        with open(config_path, "w") as f:
-            f.write(config_content)
+        updated = config_content
+    else:
+        with open(config_path) as f:
+            updated = f.read()
+        if "rule_files:" not in updated:
+            print("Adding rule_files to the existing prometheus.yml...")
+            updated = updated.replace("scrape_configs:", "rule_files:\n  - /etc/prometheus/rules/*.yml\n\nscrape_configs:", 1)
+        if "scrape_config_files:" not in updated:
+            updated = updated.replace("scrape_configs:", f"scrape_config_files:\n  - {SCRAPE_DIR}/*.yml\n\nscrape_configs:", 1)
+        updated = remove_legacy_jobs(updated)
+        updated = re.sub(r"^(  (?:scrape|evaluation)_interval:) \S+$", lambda m: f"{m.group(1)} {profile['global']}",
+                         updated, count=2, flags=re.M)
+    config_changed = configuracao_oxidized.gravar_se_mudou(config_path, updated)
+
+    # 4.0 Oxidized scrape jobs, with per-job intervals and drop rules from the profile
+    config_changed |= configuracao_oxidized.gravar_se_mudou(os.path.join(SCRAPE_DIR, "oxidized.yml"),
+                                                            render_scrape_config(profile))
+    run_command(["/usr/local/bin/promtool", "check", "config", config_path])
+
+    # 4.1 Recording rules for the dashboard aggregates, validated before Prometheus loads them
+    rules_source = os.path.join(os.path.dirname(os.path.abspath(__file__)), "oxidized-rules.yml")
+    rules_path = "/etc/prometheus/rules/oxidized.yml"
+    if os.path.exists(rules_source):
+        run_command(["/usr/local/bin/promtool", "check", "rules", rules_source])
+        config_changed |= configuracao_oxidized.copiar_se_mudou(rules_source, rules_path)
 
     # 5. Set Permissions
     run_command("chown -R prometheus:prometheus /etc/prometheus", shell=True)
@@ -70,7 +238,7 @@ scrape_configs:
     run_command("chown prometheus:prometheus /usr/local/bin/promtool", shell=True)
 
     # 6. Create systemd service
-    service_content = """[Unit]
+    service_content = f"""[Unit]
 Description=Prometheus
 Wants=network-online.target
 After=network-online.target
@@ -81,20 +249,27 @@ Group=prometheus
 Type=simple
 ExecStart=/usr/local/bin/prometheus \\
     --config.file /etc/prometheus/prometheus.yml \\
-    --storage.tsdb.path /var/lib/prometheus/ \\
+    --storage.tsdb.path {DATA_DIR}/ \\
+    --storage.tsdb.retention.time={profile['retention_days']}d \\
+    --storage.tsdb.retention.size={expected['retention_size_gb']}GB \\
+    --storage.tsdb.wal-compression \\
     --web.console.templates=/etc/prometheus/consoles \\
     --web.console.libraries=/etc/prometheus/console_libraries
+ExecReload=/bin/kill -HUP $MAINPID
 
 [Install]
 WantedBy=multi-user.target
 """
-    with open("/etc/systemd/system/prometheus.service", "w") as f:
-        f.write(service_content)
+    restart = bool(configuracao_oxidized.aplicar_unidades({"prometheus.service": service_content})) or binaries_changed
 
     # 7. Start Service
-    run_command(["systemctl", "daemon-reload"])
     run_command(["systemctl", "enable", "prometheus"])
-    run_command(["systemctl", "start", "prometheus"])
+    # Reload (SIGHUP) picks up new rules and scrape jobs without dropping the running instance;
+    # retention and WAL flags or a new binary need a restart, and an unchanged install only makes sure it is running
+    if config_changed and not restart:
+        run_command(["systemctl", "reload-or-restart", "prometheus"])
+    else:
+        configuracao_oxidized.reiniciar_se_mudou(["prometheus"], restart)
 
     # Cleanup
     if os.path.exists(prom_dir):
@@ -104,6 +279,7 @@ WantedBy=multi-user.target
 
     print("\n--- Prometheus Installation Complete ---")
     print("Web UI: http://<machine-ip>:9090")
+    print("Sizing report: sudo python3 install_prometheus.py --report")
 
 if __name__ == "__main__":
     main()
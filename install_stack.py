@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import configuracao_oxidized
+import install_prometheus
+
+# Instalação unificada: Oxidized, Prometheus, Grafana e exporter.
+#
+# As etapas formam um grafo de dependências; as independentes rodam em paralelo,
+# com um único "apt-get update" no início. Cada etapa guarda o hash do script,
+# dos argumentos e dos arquivos que gera; numa nova execução, se nada mudou e os
+# arquivos continuam iguais, a etapa é pulada.
+
+DIRETORIO_SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+ARQUIVO_ESTADO = "/var/lib/oxidized-instalador/estado.json"
+DIRETORIO_LOGS = "/var/log/oxidized-instalador"
+
+# nome: (script, dependências, arquivos gerados)
+ETAPAS = {
+    "oxidized": ("install_oxidized.py", [], [
+        "/opt/oxidized/config",
+        "/etc/systemd/system/oxidized.service",
+        "/etc/systemd/system/oxidized-sync.service",
+        "/etc/systemd/system/oxidized-agendador.service",
+        "/etc/systemd/system/oxidized-recarga.service",
+        "/etc/systemd/system/oxidized-manutencao.service",
+        "/etc/systemd/system/oxidized-manutencao.timer",
+    ]),
+    "prometheus": ("install_prometheus.py", [], [
+        "/usr/local/bin/prometheus",
+        "/etc/prometheus/prometheus.yml",
+        "/etc/prometheus/rules/oxidized.yml",
+        "/etc/prometheus/scrape/oxidized.yml",
+        "/etc/systemd/system/prometheus.service",
+    ]),
+    "grafana": ("install_grafana.py", [], [
+        "/etc/apt/keyrings/grafana.gpg",
+        "/etc/apt/sources.list.d/grafana.list",
+    ]),
+    "exporter": ("install_oxidized_exporter.py", ["oxidized", "prometheus"], [
+        "/etc/systemd/system/oxidized-exporter.service",
+    ]),
+}
+
+
+def hash_arquivo(caminho):
+    if not os.path.exists(caminho):
+        return None
+    resumo = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b""):
+            resumo.update(bloco)
+    return resumo.hexdigest()
+
+
+def carregar_estado():
+    try:
+        with open(ARQUIVO_ESTADO) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def salvar_estado(estado):
+    os.makedirs(os.path.dirname(ARQUIVO_ESTADO), exist_ok=True)
+    temporario = ARQUIVO_ESTADO + ".tmp"
+    with open(temporario, "w") as f:
+        json.dump(estado, f, indent=2, sort_keys=True)
+    os.replace(temporario, ARQUIVO_ESTADO)
+
+
+# Impressão digital da etapa: conteúdo do script + argumentos.
+# O install_oxidized.py também copia os demais *_oxidized.py para /opt/oxidized, e o install_prometheus.py
+# instala o oxidized-rules.yml, então eles entram no hash; o exportador embutido roda os próprios scripts. O perfil de dimensionamento do Prometheus
+# depende da quantidade de equipamentos, então a etapa roda de novo quando o router.db muda de faixa.
+def entrada_etapa(nome, argumentos):
+    scripts = [ETAPAS[nome][0]]
+    resumo = hashlib.sha256(json.dumps(argumentos).encode())
+    if nome == "oxidized":
+        scripts += sorted(a for a in os.listdir(DIRETORIO_SCRIPTS) if a.endswith("_oxidized.py"))
+    else:
+        # Os demais instaladores gravam arquivos e reiniciam serviços pelos helpers do configuracao_oxidized.py
+        scripts.append("configuracao_oxidized.py")
+    if nome == "exporter":
+        scripts += configuracao_oxidized.SCRIPTS_EXPORTADOR
+    if nome == "prometheus":
+        scripts.append("oxidized-rules.yml")
+        resumo.update(install_prometheus.choose_profile(install_prometheus.count_devices("/opt/oxidized/router.db")).encode())
+    for script in scripts:
+        resumo.update((hash_arquivo(os.path.join(DIRETORIO_SCRIPTS, script)) or "").encode())
+    return resumo.hexdigest()
+
+
+def saidas_etapa(nome):
+    return {caminho: hash_arquivo(caminho) for caminho in ETAPAS[nome][2]}
+
+
+def etapa_atualizada(nome, argumentos, estado):
+    anterior = estado.get(nome)
+    if not anterior or anterior.get("entrada") != entrada_etapa(nome, argumentos):
+        return False
+    atuais = saidas_etapa(nome)
+    return all(atuais.values()) and atuais == anterior.get("saidas")
+
+
+def executar_etapa(nome, argumentos):
+    os.makedirs(DIRETORIO_LOGS, exist_ok=True)
+    arquivo_log = os.path.join(DIRETORIO_LOGS, f"{nome}.log")
+    comando = [sys.executable, os.path.join(DIRETORIO_SCRIPTS, ETAPAS[nome][0])] + argumentos
+    # Os instaladores reutilizam o "apt-get update" já feito aqui
+    ambiente = dict(os.environ, INSTALADOR_APT_ATUALIZADO="1")
+    inicio = time.monotonic()
+    with open(arquivo_log, "w") as log:
+        resultado = subprocess.run(comando, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, env=ambiente)
+    return resultado.returncode == 0, time.monotonic() - inicio, arquivo_log
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Instala Oxidized, Prometheus, Grafana e exporter em paralelo, pulando o que já está pronto")
+    parser.add_argument("url_github", nargs="?", default="", help="URL SSH do repositório de backup (repassada ao install_oxidized.py)")
+    parser.add_argument("--etapas", nargs="+", choices=list(ETAPAS), default=list(ETAPAS), help="Etapas a considerar")
+    parser.add_argument("--forcar", action="store_true", help="Executa todas as etapas, ignorando o cache")
+    parser.add_argument("--paralelo", type=int, default=4, help="Etapas simultâneas")
+    parser.add_argument("--exporter-nativo", action="store_true", help="Usa o exportador Python embutido no lugar do .deb")
+    args, extras_oxidized = parser.parse_known_args()
+
+    if os.getuid() != 0:
+        print("Este script precisa ser executado com sudo.")
+        sys.exit(1)
+
+    argumentos = {nome: [] for nome in ETAPAS}
+    argumentos["oxidized"] = ([args.url_github] if args.url_github else []) + extras_oxidized
+    if args.exporter_nativo:
+        argumentos["exporter"] = ["--native"]
+
+    estado = carregar_estado()
+    # Dependências fora de --etapas entram na execução se não estiverem instaladas e atualizadas
+    etapas = list(args.etapas)
+    for nome in etapas:
+        for dependencia in ETAPAS[nome][1]:
+            if dependencia not in etapas and not etapa_atualizada(dependencia, argumentos[dependencia], estado):
+                print(f"[{dependencia}] incluída: {nome} depende dela e ela não está instalada/atualizada.")
+                etapas.append(dependencia)
+    pendentes = [n for n in etapas if args.forcar or not etapa_atualizada(n, argumentos[n], estado)]
+    for nome in etapas:
+        if nome not in pendentes:
+            print(f"[{nome}] sem alterações, pulando.")
+    if not pendentes:
+        print("\n--- Nada a fazer: todas as etapas estão atualizadas ---")
+        return
+
+    inicio = time.monotonic()
+    print("Atualizando índices do apt (uma única vez)...")
+    subprocess.run(["apt-get", "update"], check=True)
+
+    concluidas = set(n for n in etapas if n not in pendentes)
+    concluidas |= set(n for n in ETAPAS if n not in etapas and etapa_atualizada(n, argumentos[n], estado))
+    falhas = set()
+    em_execucao = {}
+    with ThreadPoolExecutor(max_workers=args.paralelo) as executor:
+        while pendentes or em_execucao:
+            for nome in list(pendentes):
+                dependencias = ETAPAS[nome][1]
+                if any(d in falhas for d in dependencias):
+                    print(f"[{nome}] não executada: dependência falhou.")
+                    pendentes.remove(nome)
+                    falhas.add(nome)
+                elif all(d in concluidas for d in dependencias):
+                    print(f"[{nome}] iniciando...")
+                    em_execucao[executor.submit(executar_etapa, nome, argumentos[nome])] = nome
+                    pendentes.remove(nome)
+            if not em_execucao:
+                break
+            prontos, _ = wait(em_execucao, return_when=FIRST_COMPLETED)
+            for futuro in prontos:
+                nome = em_execucao.pop(futuro)
+                sucesso, duracao, arquivo_log = futuro.result()
+                if sucesso:
+                    concluidas.add(nome)
+                    print(f"[{nome}] concluída em {duracao:.1f}s (log: {arquivo_log})")
+                else:
+                    falhas.add(nome)
+                    print(f"[{nome}] FALHOU após {duracao:.1f}s, veja {arquivo_log}")
+
+    # Os hashes são gravados no fim: etapas posteriores também alteram arquivos (ex.: prometheus.yml)
+    for nome in concluidas - falhas:
+        if nome in etapas:
+            estado[nome] = {"entrada": entrada_etapa(nome, argumentos[nome]), "saidas": saidas_etapa(nome)}
+    for nome in falhas:
+        estado.pop(nome, None)
+    salvar_estado(estado)
+
+    chave_publica = "/opt/oxidized/.ssh/id_ed25519_github.pub"
+    if os.path.exists(chave_publica):
+        print("\nChave pública usada no GitHub:")
+        with open(chave_publica) as f:
+            print(f.read().strip())
+
+    print(f"\n--- Instalação concluída em {time.monotonic() - inicio:.1f}s ---")
+    if falhas:
+        print(f"Etapas com falha: {', '.join(sorted(falhas))}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+
+# Inventário do Oxidized indexado em SQLite.
+#
+# O router.db (nome:ip:modelo:usuario:senha:porta_ssh:grupo) é validado e carregado
+# numa única passada para a tabela "equipamentos", com índices por nome, IP, grupo
+# e modelo. O router.db pode ser regenerado atomicamente a partir do banco, e o
+# próprio banco pode ser usado como fonte "sql" do Oxidized (view equipamentos_ativos,
+# que exclui os nodos postos em espera pelo agendador).
+
+CAMINHO_CONFIG = os.getenv("OXIDIZED_HOME", "/opt/oxidized")
+CAMPOS = ["nome", "ip", "modelo", "usuario", "senha", "porta", "grupo"]
+CABECALHO = "# nome:ip:modelo:usuario:senha:porta_ssh:grupo\n"
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS equipamentos (
+    nome    TEXT PRIMARY KEY,
+    ip      TEXT NOT NULL,
+    modelo  TEXT NOT NULL,
+    usuario TEXT NOT NULL,
+    senha   TEXT NOT NULL,
+    porta   INTEGER NOT NULL DEFAULT 22,
+    grupo   TEXT NOT NULL DEFAULT 'default'
+);
+CREATE INDEX IF NOT EXISTS idx_equipamentos_ip ON equipamentos(ip);
+CREATE INDEX IF NOT EXISTS idx_equipamentos_grupo ON equipamentos(grupo);
+CREATE INDEX IF NOT EXISTS idx_equipamentos_modelo ON equipamentos(modelo);
+-- Nodos em espera (backoff do agendador_oxidized.py) ficam fora da view lida pelo Oxidized
+CREATE TABLE IF NOT EXISTS espera (
+    nome TEXT PRIMARY KEY,
+    ate  REAL NOT NULL
+);
+CREATE VIEW IF NOT EXISTS equipamentos_ativos AS
+    SELECT * FROM equipamentos WHERE nome NOT IN (SELECT nome FROM espera);
+"""
+
+
+def abrir_banco(caminho_banco):
+    conexao = sqlite3.connect(caminho_banco)
+    conexao.execute("PRAGMA journal_mode=WAL")
+    conexao.executescript(ESQUEMA)
+    return conexao
+
+
+# Converte uma linha do router.db em registro; devolve (registro, erro)
+def analisar_linha(linha):
+    campos = linha.rstrip("\n").split(":")
+    if len(campos) == 6:
+        campos.append("default")
+    if len(campos) != 7:
+        return None, f"esperados 7 campos separados por ':', encontrados {len(campos)}"
+    registro = dict(zip(CAMPOS, (c.strip() for c in campos)))
+    for obrigatorio in ("nome", "ip", "modelo"):
+        if not registro[obrigatorio]:
+            return None, f"campo '{obrigatorio}' vazio"
+    if " " in registro["nome"] or " " in registro["ip"]:
+        return None, "nome/ip não podem conter espaços"
+    porta = registro["porta"] or "22"
+    if not porta.isdigit() or not 1 <= int(porta) <= 65535:
+        return None, f"porta inválida '{registro['porta']}'"
+    registro["porta"] = int(porta)
+    registro["grupo"] = registro["grupo"] or "default"
+    return registro, None
+
+
+def formatar_linha(registro):
+    return ":".join(str(registro[campo]) for campo in CAMPOS) + "\n"
+
+
+# Lê e valida o router.db numa única passada (streaming), detectando duplicados
+def ler_router_db(caminho_router_db):
+    registros, erros, avisos = [], [], []
+    nomes, ips = {}, {}
+    with open(caminho_router_db, "r") as f:
+        for numero, linha in enumerate(f, 1):
+            if not linha.strip() or linha.lstrip().startswith("#"):
+                continue
+            registro, erro = analisar_linha(linha)
+            if erro:
+                erros.append(f"linha {numero}: {erro}")
+                continue
+            if registro["nome"] in nomes:
+                erros.append(f"linha {numero}: nome '{registro['nome']}' duplicado (já definido na linha {nomes[registro['nome']]})")
+                continue
+            if registro["ip"] in ips:
+                avisos.append(f"linha {numero}: ip '{registro['ip']}' também usado na linha {ips[registro['ip']]}")
+            nomes[registro["nome"]] = numero
+            ips.setdefault(registro["ip"], numero)
+            registros.append(registro)
+    return registros, erros, avisos
+
+
+# Linhas do router.db com o registro de cada uma (None para comentários e linhas inválidas, mantidas como estão)
+def ler_linhas(caminho):
+    linhas = []
+    try:
+        with open(caminho) as f:
+            for linha in f:
+                registro = None
+                if linha.strip() and not linha.lstrip().startswith("#"):
+                    registro, _ = analisar_linha(linha)
+                linhas.append((linha if linha.endswith("\n") else linha + "\n", registro))
+    except FileNotFoundError:
+        pass
+    return linhas
+
+
+# Aplica registros ao router.db mantendo comentários e a ordem das linhas existentes; os novos vão para o fim
+def mesclar_linhas(linhas, registros, remover=()):
+    pendentes = {r["nome"]: r for r in registros}
+    resultado = []
+    for linha, atual in linhas:
+        if atual is None:
+            resultado.append(linha)
+        elif atual["nome"] in remover:
+            continue
+        elif atual["nome"] in pendentes:
+            resultado.append(formatar_linha(pendentes.pop(atual["nome"])))
+        else:
+            resultado.append(linha)
+    if not resultado:
+        resultado.append(CABECALHO)
+    return "".join(resultado) + "".join(formatar_linha(r) for r in pendentes.values())
+
+
+# Carrega o router.db no banco; só as linhas novas ou alteradas são escritas
+def importar(conexao, registros, substituir=False):
+    with conexao:
+        cursor = conexao.executemany(
+            """INSERT INTO equipamentos (nome, ip, modelo, usuario, senha, porta, grupo)
+               VALUES (:nome, :ip, :modelo, :usuario, :senha, :porta, :grupo)
+               ON CONFLICT(nome) DO UPDATE SET
+                   ip=excluded.ip, modelo=excluded.modelo, usuario=excluded.usuario,
+                   senha=excluded.senha, porta=excluded.porta, grupo=excluded.grupo
+               WHERE (ip, modelo, usuario, senha, porta, grupo) IS NOT
+                     (excluded.ip, excluded.modelo, excluded.usuario, excluded.senha, excluded.porta, excluded.grupo)""",
+            registros,
+        )
+        alterados = cursor.rowcount
+        removidos = 0
+        if substituir:
+            conexao.execute("CREATE TEMP TABLE IF NOT EXISTS nomes_importados (nome TEXT PRIMARY KEY)")
+            conexao.execute("DELETE FROM nomes_importados")
+            conexao.executemany("INSERT OR IGNORE INTO nomes_importados VALUES (?)", ((r["nome"],) for r in registros))
+            removidos = conexao.execute(
+                "DELETE FROM equipamentos WHERE nome NOT IN (SELECT nome FROM nomes_importados)").rowcount
+    return alterados, removidos
+
+
+# Regrava o router.db de forma atômica (arquivo temporário + rename), mantendo as permissões do atual
+def gravar_router_db(caminho_router_db, texto):
+    diretorio = os.path.dirname(os.path.abspath(caminho_router_db))
+    descritor, temporario = tempfile.mkstemp(prefix=".router.db.", dir=diretorio)
+    try:
+        with os.fdopen(descritor, "w") as f:
+            f.write(texto)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(caminho_router_db):
+            os.chmod(temporario, os.stat(caminho_router_db).st_mode & 0o777)
+        os.replace(temporario, caminho_router_db)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+
+
+# Regenera o router.db inteiro a partir do banco (ordenado por grupo e nome; comentários não são preservados)
+def exportar(conexao, caminho_router_db):
+    linhas = conexao.execute(f"SELECT {', '.join(CAMPOS)} FROM equipamentos ORDER BY grupo, nome")
+    gravar_router_db(caminho_router_db, CABECALHO + "".join(formatar_linha(dict(zip(CAMPOS, l))) for l in linhas))
+
+
+def buscar(conexao, filtros):
+    condicoes = [f"{campo} = ?" for campo in filtros]
+    sql = f"SELECT {', '.join(CAMPOS)} FROM equipamentos"
+    if condicoes:
+        sql += " WHERE " + " AND ".join(condicoes)
+    return conexao.execute(sql + " ORDER BY grupo, nome", list(filtros.values())).fetchall()
+
+
+def imprimir_relatorio(erros, avisos):
+    for erro in erros:
+        print(f"ERRO  {erro}")
+    for aviso in avisos:
+        print(f"AVISO {aviso}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inventário indexado (SQLite) do router.db do Oxidized")
+    parser.add_argument("--banco", default=os.path.join(CAMINHO_CONFIG, "inventario.db"), help="Banco SQLite (padrão: %(default)s)")
+    parser.add_argument("--router-db", default=os.path.join(CAMINHO_CONFIG, "router.db"), help="Arquivo router.db (padrão: %(default)s)")
+    sub = parser.add_subparsers(dest="acao", required=True)
+
+    sub.add_parser("validar", help="Valida o router.db sem alterar o banco")
+    p_importar = sub.add_parser("importar", help="Carrega o router.db no banco")
+    p_importar.add_argument("--substituir", action="store_true", help="Remove do banco os nomes ausentes no router.db")
+    sub.add_parser("exportar", help="Regenera o router.db a partir do banco")
+
+    p_buscar = sub.add_parser("buscar", help="Consulta equipamentos pelos índices")
+    for campo in ("nome", "ip", "grupo", "modelo"):
+        p_buscar.add_argument(f"--{campo}")
+
+    p_adicionar = sub.add_parser("adicionar", help="Adiciona ou atualiza um equipamento no router.db e no banco")
+    for campo in ("nome", "ip", "modelo", "usuario", "senha"):
+        p_adicionar.add_argument(campo)
+    p_adicionar.add_argument("--porta", default="22")
+    p_adicionar.add_argument("--grupo", default="default")
+
+    p_remover = sub.add_parser("remover", help="Remove um equipamento do router.db e do banco")
+    p_remover.add_argument("nome")
+
+    args = parser.parse_args()
+
+    if args.acao in ("validar", "importar"):
+        registros, erros, avisos = ler_router_db(args.router_db)
+        imprimir_relatorio(erros, avisos)
+        print(f"{len(registros)} equipamento(s) válidos, {len(erros)} erro(s), {len(avisos)} aviso(s)")
+        if erros:
+            sys.exit(1)
+        if args.acao == "importar":
+            alterados, removidos = importar(abrir_banco(args.banco), registros, args.substituir)
+            print(f"Banco atualizado: {alterados} inserido(s)/alterado(s), {removidos} removido(s)")
+        return
+
+    conexao = abrir_banco(args.banco)
+    if args.acao == "exportar":
+        exportar(conexao, args.router_db)
+        print(f"router.db regenerado em {args.router_db}")
+    elif args.acao == "buscar":
+        filtros = {c: getattr(args, c) for c in ("nome", "ip", "grupo", "modelo") if getattr(args, c)}
+        for linha in buscar(conexao, filtros):
+            print(":".join(str(c) for c in linha))
+    elif args.acao in ("adicionar", "remover"):
+        # O router.db é a fonte: a mudança é aplicada nele (comentários e ordem preservados) e o banco
+        # é sincronizado em seguida, mesmo que nunca tenha sido importado ou esteja defasado
+        registros, erros, avisos = ler_router_db(args.router_db) if os.path.exists(args.router_db) else ([], [], [])
+        if erros:
+            imprimir_relatorio(erros, avisos)
+            print("Corrija o router.db antes de alterá-lo.")
+            sys.exit(1)
+        linhas = ler_linhas(args.router_db)
+        if args.acao == "adicionar":
+            linha = ":".join([args.nome, args.ip, args.modelo, args.usuario, args.senha, args.porta, args.grupo])
+            registro, erro = analisar_linha(linha)
+            if erro:
+                print(f"Erro: {erro}")
+                sys.exit(1)
+            gravar_router_db(args.router_db, mesclar_linhas(linhas, [registro]))
+        else:
+            if args.nome not in {r["nome"] for r in registros}:
+                print(f"Equipamento {args.nome} não encontrado.")
+                sys.exit(1)
+            gravar_router_db(args.router_db, mesclar_linhas(linhas, [], {args.nome}))
+        registros, _, _ = ler_router_db(args.router_db)
+        importar(conexao, registros, substituir=True)
+        print(f"Equipamento {args.nome} {'gravado' if args.acao == 'adicionar' else 'removido'}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+import argparse
+import fcntl
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Manutenção dos repositórios git do Oxidized (configs, shards e repo_sync).
+#
+# Executado pelo timer oxidized-manutencao em horário de pouco movimento:
+# empacota objetos soltos, faz repack incremental com multi-pack-index e
+# bitmap, grava o commit-graph (com filtros de caminhos alterados) e remove
+# objetos soltos antigos. O gc automático do git é desligado nesses
+# repositórios para não travar um commit do sincronizador no meio do lote.
+# A trava do sincronizador (sync.lock) é tomada a cada tarefa, e as durações
+# vão para metricas/manutencao.prom, publicado no /metrics do sincronizador.
+
+CAMINHO_CONFIG = os.getenv("OXIDIZED_HOME", "/opt/oxidized")
+
+# nome: comandos git (o primeiro que funcionar vale; versões antigas do git caem no seguinte)
+TAREFAS = {
+    "loose-objects": [["maintenance", "run", "--task=loose-objects"], ["repack", "-d", "-q"]],
+    "incremental-repack": [["maintenance", "run", "--task=incremental-repack"], ["repack", "-d", "-q"]],
+    "bitmap": [["multi-pack-index", "write", "--bitmap"], ["repack", "-a", "-d", "-q", "--write-bitmap-index"]],
+    "commit-graph": [["commit-graph", "write", "--reachable", "--changed-paths"], ["commit-graph", "write", "--reachable"]],
+    "pack-refs": [["pack-refs", "--all"]],
+    "prune": [["prune", "--expire=2.weeks.ago"]],
+}
+
+# Configuração aplicada uma vez por repositório: a manutenção passa a ser só deste serviço
+CONFIGURACAO = {
+    "gc.auto": "0",
+    "maintenance.auto": "false",
+    "core.untrackedCache": "true",
+    "core.commitGraph": "true",
+    "fetch.writeCommitGraph": "true",
+    "pack.writeBitmapHashCache": "true",
+}
+
+
+def repositorios(caminho_config):
+    candidatos = [os.path.join(caminho_config, "configs"), os.path.join(caminho_config, "repo_sync")]
+    diretorio_shards = os.path.join(caminho_config, "shards")
+    if os.path.isdir(diretorio_shards):
+        candidatos += sorted(os.path.join(diretorio_shards, d, "configs") for d in os.listdir(diretorio_shards)
+                             if d.isdigit())
+    return [r for r in candidatos if os.path.isdir(os.path.join(r, ".git"))]
+
+
+def rotulo(caminho_config, repositorio):
+    return os.path.relpath(repositorio, caminho_config)
+
+
+def configurar(repositorio):
+    for chave, valor in CONFIGURACAO.items():
+        atual = subprocess.run(["git", "-C", repositorio, "config", "--get", chave], capture_output=True, text=True)
+        if atual.stdout.strip() != valor:
+            subprocess.run(["git", "-C", repositorio, "config", chave, valor], check=True)
+
+
+# Objetos soltos e tamanho dos packs ("git count-objects -v")
+def estatisticas(repositorio):
+    saida = subprocess.run(["git", "-C", repositorio, "count-objects", "-v"], capture_output=True, text=True).stdout
+    valores = dict(linha.split(": ", 1) for linha in saida.splitlines() if ": " in linha)
+    return {
+        "objetos_soltos": int(valores.get("count", 0)),
+        "bytes_soltos": int(valores.get("size", 0)) * 1024,
+        "packs": int(valores.get("packs", 0)),
+        "bytes_packs": int(valores.get("size-pack", 0)) * 1024,
+    }
+
+
+# Espera a trava do sincronizador sem bloqueá-lo indefinidamente: desiste após "espera" segundos
+def adquirir_trava(caminho_trava, espera):
+    trava = open(caminho_trava, "w")
+    limite = time.monotonic() + espera
+    while True:
+        try:
+            fcntl.flock(trava, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return trava
+        except BlockingIOError:
+            if time.monotonic() >= limite:
+                trava.close()
+                return None
+            time.sleep(1)
+
+
+def executar_tarefa(repositorio, tarefa):
+    for comando in TAREFAS[tarefa]:
+        resultado = subprocess.run(["git", "-C", repositorio] + comando, capture_output=True, text=True)
+        if resultado.returncode == 0:
+            return True
+    print(f"{repositorio}: {tarefa} falhou: {(resultado.stdout + resultado.stderr).strip()}", flush=True)
+    return False
+
+
+def gravar_metricas(caminho_config, resultados):
+    linhas = [
+        "# HELP oxidized_git_maintenance_duration_seconds Duração da última execução de cada tarefa de manutenção.",
+        "# TYPE oxidized_git_maintenance_duration_seconds gauge",
+    ]
+    linhas += [f'oxidized_git_maintenance_duration_seconds{{repo="{r}",task="{t}"}} {d["duracao"]:.3f}'
+               for r, dados in resultados.items() for t, d in dados["tarefas"].items()]
+    linhas += [
+        "# HELP oxidized_git_maintenance_success Última execução da tarefa terminou bem (1) ou não (0).",
+        "# TYPE oxidized_git_maintenance_success gauge",
+    ]
+    linhas += [f'oxidized_git_maintenance_success{{repo="{r}",task="{t}"}} {int(d["sucesso"])}'
+               for r, dados in resultados.items() for t, d in dados["tarefas"].items()]
+    for chave, metrica, ajuda in (("objetos_soltos", "oxidized_git_loose_objects", "Objetos soltos após a manutenção."),
+                                  ("bytes_soltos", "oxidized_git_loose_bytes", "Bytes em objetos soltos após a manutenção."),
+                                  ("packs", "oxidized_git_packs", "Quantidade de packs após a manutenção."),
+                                  ("bytes_packs", "oxidized_git_pack_bytes", "Bytes em packs após a manutenção.")):
+        linhas += [f"# HELP {metrica} {ajuda}", f"# TYPE {metrica} gauge"]
+        linhas += [f'{metrica}{{repo="{r}"}} {dados["estatisticas"][chave]}' for r, dados in resultados.items()]
+    linhas += [
+        "# HELP oxidized_git_maintenance_last_run_timestamp_seconds Fim da última execução da manutenção.",
+        "# TYPE oxidized_git_maintenance_last_run_timestamp_seconds gauge",
+        f"oxidized_git_maintenance_last_run_timestamp_seconds {time.time():.3f}",
+    ]
+    diretorio = os.path.join(caminho_config, "metricas")
+    os.makedirs(diretorio, exist_ok=True)
+    descritor, temporario = tempfile.mkstemp(prefix=".manutencao.", dir=diretorio)
+    with os.fdopen(descritor, "w") as f:
+        f.write("\n".join(linhas) + "\n")
+    os.chmod(temporario, 0o644)
+    os.replace(temporario, os.path.join(diretorio, "manutencao.prom"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manutenção (repack, commit-graph, prune) dos repositórios git do Oxidized")
+    parser.add_argument("--base", default=CAMINHO_CONFIG, help="Diretório base do Oxidized (padrão: %(default)s)")
+    parser.add_argument("--tarefas", nargs="+", choices=list(TAREFAS), default=list(TAREFAS))
+    parser.add_argument("--espera-trava", type=float, default=600, help="Segundos aguardando o sincronizador liberar a trava")
+    args = parser.parse_args()
+
+    caminho_trava = os.path.join(args.base, "sync.lock")
+    resultados = {}
+    falhou = False
+    for repositorio in repositorios(args.base):
+        nome = rotulo(args.base, repositorio)
+        configurar(repositorio)
+        resultados[nome] = {"tarefas": {}}
+        for tarefa in args.tarefas:
+            # Trava por tarefa: um lote do sincronizador pode entrar entre uma tarefa e outra
+            trava = adquirir_trava(caminho_trava, args.espera_trava)
+            if trava is None:
+                print(f"{nome}: sincronizador ocupado há mais de {args.espera_trava:.0f}s, {tarefa} adiada.", flush=True)
+                falhou = True
+                continue
+            try:
+                inicio = time.monotonic()
+                sucesso = executar_tarefa(repositorio, tarefa)
+                duracao = time.monotonic() - inicio
+            finally:
+                trava.close()
+            resultados[nome]["tarefas"][tarefa] = {"duracao": duracao, "sucesso": sucesso}
+            falhou |= not sucesso
+            print(f"{nome}: {tarefa} {'ok' if sucesso else 'ERRO'} em {duracao:.2f}s", flush=True)
+        resultados[nome]["estatisticas"] = estatisticas(repositorio)
+
+    gravar_metricas(args.base, resultados)
+    if falhou:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sqlite3
+import subprocess
+import time
+
+# Índice de mudanças do histórico de backups.
+#
+# O histórico do repositório configs é percorrido uma única vez (e depois só os
+# commits novos) com "git log --raw --numstat"; para cada dispositivo alterado
+# em cada commit ficam gravadas as linhas adicionadas/removidas e a variação em
+# bytes. Taxa de mudança, churn e "quem mais muda" passam a ser consultas no
+# índice, sem replay do histórico com "git log -p".
+
+CAMINHO_CONFIG = os.getenv("OXIDIZED_HOME", "/opt/oxidized")
+SHA_NULO = "0" * 40
+
+# Tabela sem rowid com chave (ts, dispositivo, commit) inteira: uma linha compacta por alteração.
+# "totais" é o agregado por dispositivo, mantido na mesma transação, que alimenta o /metrics.
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS dispositivos (id INTEGER PRIMARY KEY, caminho TEXT UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS commits (id INTEGER PRIMARY KEY, sha TEXT UNIQUE NOT NULL, ts INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS mudancas (
+    ts          INTEGER NOT NULL,
+    dispositivo INTEGER NOT NULL,
+    commit_id   INTEGER NOT NULL,
+    adicionadas INTEGER NOT NULL,
+    removidas   INTEGER NOT NULL,
+    bytes       INTEGER NOT NULL,
+    PRIMARY KEY (ts, dispositivo, commit_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_mudancas_dispositivo ON mudancas(dispositivo, ts);
+CREATE TABLE IF NOT EXISTS totais (
+    dispositivo    INTEGER PRIMARY KEY,
+    mudancas       INTEGER NOT NULL DEFAULT 0,
+    adicionadas    INTEGER NOT NULL DEFAULT 0,
+    removidas      INTEGER NOT NULL DEFAULT 0,
+    bytes_churn    INTEGER NOT NULL DEFAULT 0,
+    ultima_mudanca INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS estado (chave TEXT PRIMARY KEY, valor TEXT);
+"""
+
+
+class Indice:
+    def __init__(self, repositorio, caminho_indice):
+        self.repositorio = repositorio
+        self.conexao = sqlite3.connect(caminho_indice, check_same_thread=False)
+        self.conexao.execute("PRAGMA journal_mode=WAL")
+        self.conexao.executescript(ESQUEMA)
+        self.ids = dict((c, i) for i, c in self.conexao.execute("SELECT id, caminho FROM dispositivos"))
+
+    def git(self, *argumentos, **opcoes):
+        comando = ["git", "-c", f"safe.directory={self.repositorio}", "-c", "core.quotePath=off",
+                   "-C", self.repositorio] + list(argumentos)
+        return subprocess.run(comando, capture_output=True, **opcoes)
+
+    def estado(self, chave):
+        linha = self.conexao.execute("SELECT valor FROM estado WHERE chave = ?", (chave,)).fetchone()
+        return linha[0] if linha else None
+
+    def id_dispositivo(self, caminho):
+        if caminho not in self.ids:
+            self.ids[caminho] = self.conexao.execute("INSERT INTO dispositivos (caminho) VALUES (?)",
+                                                     (caminho,)).lastrowid
+        return self.ids[caminho]
+
+    # Tamanho de cada blob com um único "git cat-file --batch-check"
+    def tamanhos(self, shas):
+        shas = sorted(set(shas) - {SHA_NULO})
+        if not shas:
+            return {}
+        saida = self.git("cat-file", "--batch-check=%(objectname) %(objectsize)",
+                         input="\n".join(shas).encode(), check=True).stdout
+        tamanhos = {}
+        for linha in saida.decode().splitlines():
+            partes = linha.split()
+            if len(partes) == 2 and partes[1].isdigit():
+                tamanhos[partes[0]] = int(partes[1])
+        return tamanhos
+
+    # Lê "git log --raw --numstat -z" e devolve [(sha, ts, {caminho: [adicionadas, removidas, sha_antigo, sha_novo]})].
+    # Com -z os caminhos vêm sem aspas/escapes do git e cada campo termina em NUL.
+    def ler_log(self, intervalo):
+        saida = self.git("log", "--reverse", "--no-renames", "--raw", "--numstat", "--abbrev=40", "-z",
+                         "--format=%x01%H %ct", intervalo, check=True).stdout.decode(errors="replace")
+        commits = []
+        for bloco in saida.split("\x01")[1:]:
+            campos = bloco.split("\0")
+            sha, ts = campos[0].split()
+            arquivos = {}
+            pendentes = iter(campos[1:])
+            for campo in pendentes:
+                campo = campo.lstrip("\n")
+                if campo.startswith(":"):
+                    partes = campo.split()
+                    arquivos.setdefault(next(pendentes), [0, 0, None, None])[2:] = [partes[2], partes[3]]
+                elif campo:
+                    adicionadas, removidas, caminho = campo.split("\t", 2)
+                    registro = arquivos.setdefault(caminho, [0, 0, None, None])
+                    # Arquivos binários aparecem como "-"
+                    registro[0] = int(adicionadas) if adicionadas.isdigit() else 0
+                    registro[1] = int(removidas) if removidas.isdigit() else 0
+            commits.append((sha, int(ts), arquivos))
+        return commits
+
+    # Indexa os commits novos; reconstrói o índice se o histórico foi reescrito
+    def atualizar(self):
+        cabeca = self.git("rev-parse", "--verify", "-q", "HEAD", text=True).stdout.strip()
+        if not cabeca:
+            return 0
+        ultimo = self.estado("ultimo_commit")
+        if ultimo == cabeca:
+            return 0
+        intervalo = cabeca
+        if ultimo and self.git("merge-base", "--is-ancestor", ultimo, cabeca).returncode == 0:
+            intervalo = f"{ultimo}..{cabeca}"
+        elif ultimo:
+            with self.conexao:
+                for tabela in ("mudancas", "totais", "commits", "dispositivos"):
+                    self.conexao.execute(f"DELETE FROM {tabela}")
+            self.ids = {}
+
+        commits = self.ler_log(intervalo)
+        tamanhos = self.tamanhos(sha for _, _, arquivos in commits for r in arquivos.values() for sha in r[2:] if sha)
+        with self.conexao:
+            for sha, ts, arquivos in commits:
+                cursor = self.conexao.execute("INSERT OR IGNORE INTO commits (sha, ts) VALUES (?, ?)", (sha, ts))
+                if cursor.rowcount == 0:
+                    # Commit já indexado (nova varredura): lastrowid seria de outra linha e os totais dobrariam
+                    continue
+                commit_id = cursor.lastrowid
+                for caminho, (adicionadas, removidas, antigo, novo) in arquivos.items():
+                    dispositivo = self.id_dispositivo(caminho)
+                    variacao = tamanhos.get(novo, 0) - tamanhos.get(antigo, 0)
+                    self.conexao.execute("INSERT OR REPLACE INTO mudancas VALUES (?, ?, ?, ?, ?, ?)",
+                                         (ts, dispositivo, commit_id, adicionadas, removidas, variacao))
+                    self.conexao.execute(
+                        """INSERT INTO totais VALUES (?, 1, ?, ?, ?, ?)
+                           ON CONFLICT(dispositivo) DO UPDATE SET
+                               mudancas = mudancas + 1, adicionadas = adicionadas + excluded.adicionadas,
+                               removidas = removidas + excluded.removidas,
+                               bytes_churn = bytes_churn + excluded.bytes_churn,
+                               ultima_mudanca = max(ultima_mudanca, excluded.ultima_mudanca)""",
+                        (dispositivo, adicionadas, removidas, abs(variacao), ts))
+            self.conexao.execute("INSERT OR REPLACE INTO estado VALUES ('ultimo_commit', ?)", (cabeca,))
+        return len(commits)
+
+    # Dispositivos com mais linhas alteradas nos últimos N dias
+    def top(self, dias, limite=20):
+        desde = int(time.time() - dias * 86400)
+        return self.conexao.execute(
+            """SELECT d.caminho, count(*), sum(m.adicionadas), sum(m.removidas), sum(abs(m.bytes)), max(m.ts)
+               FROM mudancas m JOIN dispositivos d ON d.id = m.dispositivo
+               WHERE m.ts >= ?
+               GROUP BY m.dispositivo
+               ORDER BY sum(m.adicionadas + m.removidas) DESC, count(*) DESC
+               LIMIT ?""", (desde, limite)).fetchall()
+
+    # Séries Prometheus a partir do agregado; rate()/increase() dão a taxa de mudança por janela
+    def metricas(self):
+        series = {
+            "oxidized_device_config_changes_total": ("Commits que alteraram o config do dispositivo.", "mudancas"),
+            "oxidized_device_config_lines_added_total": ("Linhas adicionadas ao config no histórico.", "adicionadas"),
+            "oxidized_device_config_lines_removed_total": ("Linhas removidas do config no histórico.", "removidas"),
+            "oxidized_device_config_churn_bytes_total": ("Soma das variações de tamanho do config em bytes.", "bytes_churn"),
+            "oxidized_device_config_last_change_timestamp_seconds": ("Horário do último commit que alterou o config.", "ultima_mudanca"),
+        }
+        linhas = self.conexao.execute(
+            """SELECT d.caminho, t.mudancas, t.adicionadas, t.removidas, t.bytes_churn, t.ultima_mudanca
+               FROM totais t JOIN dispositivos d ON d.id = t.dispositivo ORDER BY d.caminho""").fetchall()
+        colunas = ["mudancas", "adicionadas", "removidas", "bytes_churn", "ultima_mudanca"]
+        partes = []
+        for metrica, (ajuda, campo) in series.items():
+            tipo = "gauge" if campo == "ultima_mudanca" else "counter"
+            partes.append(f"# HELP {metrica} {ajuda}")
+            partes.append(f"# TYPE {metrica} {tipo}")
+            for caminho, *valores in linhas:
+                grupo, _, nome = caminho.rpartition("/")
+                rotulos = f'name="{escapar(nome)}",full_name="{escapar(caminho)}",group="{escapar(grupo)}"'
+                partes.append(f"{metrica}{{{rotulos}}} {valores[colunas.index(campo)]}")
+        return partes
+
+
+def escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Índice de taxa de mudança e churn dos configs no histórico de backup")
+    parser.add_argument("--repo", default=os.path.join(CAMINHO_CONFIG, "configs"))
+    parser.add_argument("--indice", default=os.path.join(CAMINHO_CONFIG, "mudancas.db"))
+    sub = parser.add_subparsers(dest="acao", required=True)
+
+    sub.add_parser("indexar", help="Processa os commits ainda não indexados")
+
+    p_top = sub.add_parser("top", help="Dispositivos que mais mudaram nos últimos N dias")
+    p_top.add_argument("--dias", type=float, default=7)
+    p_top.add_argument("--limite", type=int, default=20)
+
+    sub.add_parser("metricas", help="Imprime as séries Prometheus do índice")
+
+    args = parser.parse_args()
+    indice = Indice(args.repo, args.indice)
+
+    if args.acao == "indexar":
+        inicio = time.monotonic()
+        novos = indice.atualizar()
+        print(f"{novos} commit(s) indexado(s) em {time.monotonic() - inicio:.2f}s")
+    elif args.acao == "top":
+        indice.atualizar()
+        for caminho, mudancas, adicionadas, removidas, churn, ultima in indice.top(args.dias, args.limite):
+            data = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ultima))
+            print(f"{caminho:<40} mudanças={mudancas:<5} +{adicionadas:<6} -{removidas:<6} bytes={churn:<8} última={data}")
+    elif args.acao == "metricas":
+        indice.atualizar()
+        print("\n".join(indice.metricas()))
+
+
+if __name__ == "__main__":
+    main()
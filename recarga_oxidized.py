@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+import argparse
+import ctypes
+import ctypes.util
+import json
+import os
+import pwd
+import re
+import select
+import struct
+import subprocess
+import sys
+import time
+
+import agendador_oxidized
+import configuracao_oxidized
+import inventario_oxidized
+import shards_oxidized
+
+# Recarga a quente do inventário e do config do Oxidized.
+#
+# Reiniciar o Oxidized descarta os jobs em andamento e o histórico de cada nodo, e o
+# ciclo seguinte recoleta a frota inteira. O /reload da API REST relê só o inventário
+# e mantém o último backup dos nodos já conhecidos: só os nodos novos vão para a fila.
+# O serviço oxidized-recarga observa router.db e config (inotify, ou varredura do mtime
+# onde não houver inotify), agrupa as mudanças numa janela de debounce e:
+#   - router.db: valida o arquivo, regenera os inventários derivados (banco sql, shards,
+#     router.ativo.db do agendador) e chama /reload de cada instância, espaçadas;
+#   - config: compara o texto sem comentários e linhas em branco e, se algo mudou,
+#     reinicia uma instância por vez, só as que rodam com um config mais antigo.
+# Com o agendador, uma leva grande de nodos novos entra em lotes (admissao.json) em vez
+# de ir toda de uma vez para a frente da fila.
+# O serviço roda como root (systemctl); o trabalho nos arquivos roda como o dono do diretório base.
+
+CAMINHO_CONFIG = os.getenv("OXIDIZED_HOME", "/opt/oxidized")
+ARQUIVOS_OBSERVADOS = ("router.db", "config")
+
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+EVENTO = struct.Struct("iIII")
+
+
+# inotify pelo libc (sem dependências); None se o sistema não oferecer
+def abrir_inotify(diretorio):
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        descritor = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if descritor < 0:
+        return None
+    # O diretório, e não os arquivos: gravações atômicas (rename) trocam o inode do arquivo
+    mascara = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    if libc.inotify_add_watch(descritor, os.fsencode(diretorio), mascara) < 0:
+        os.close(descritor)
+        return None
+    return descritor
+
+
+# Espera eventos por até "espera" segundos; devolve os nomes dos arquivos tocados
+def ler_eventos(descritor, espera):
+    prontos, _, _ = select.select([descritor], [], [], espera)
+    if not prontos:
+        return set()
+    try:
+        dados = os.read(descritor, 65536)
+    except BlockingIOError:
+        return set()
+    nomes, posicao = set(), 0
+    while posicao + EVENTO.size <= len(dados):
+        _, _, _, tamanho = EVENTO.unpack_from(dados, posicao)
+        inicio = posicao + EVENTO.size
+        nomes.add(os.fsdecode(dados[inicio:inicio + tamanho].rstrip(b"\0")))
+        posicao = inicio + tamanho
+    return nomes
+
+
+def assinatura(caminho):
+    try:
+        estado = os.stat(caminho)
+    except FileNotFoundError:
+        return None
+    return estado.st_ino, estado.st_size, estado.st_mtime_ns
+
+
+# Config sem linhas de comentário, espaços finais e linhas em branco: reformatar ou comentar não reinicia
+def normalizar_config(texto):
+    linhas = (linha.rstrip() for linha in texto.splitlines())
+    return "\n".join(linha for linha in linhas if linha and not linha.lstrip().startswith("#"))
+
+
+def usa_agendador(texto_config):
+    return configuracao_oxidized.ARQUIVO_ATIVO in texto_config or "equipamentos_ativos" in texto_config
+
+
+def nodos_conhecidos(instancias):
+    conhecidos = set()
+    for _, url in instancias:
+        conhecidos |= {n["name"] for n in json.loads(agendador_oxidized.requisitar(url, "/nodes.json")) if n.get("name")}
+    return conhecidos
+
+
+# Aplica o router.db: inventários derivados, admissão escalonada e /reload. Roda como o dono do diretório base.
+def recarregar(caminho_config, lote, passo, escalonamento, usar_rest=True):
+    agora = time.time()
+    registros, erros, avisos = inventario_oxidized.ler_router_db(os.path.join(caminho_config, "router.db"))
+    inventario_oxidized.imprimir_relatorio(erros, avisos)
+    if erros:
+        # Um router.db pela metade não é carregado: o Oxidized segue com o inventário anterior
+        print(f"router.db com {len(erros)} erro(s), recarga cancelada.", flush=True)
+        return {"recargas": 0, "novos": 0, "retidos": 0, "erros": len(erros)}
+
+    texto_config = agendador_oxidized.ler_config(caminho_config)
+    instancias = agendador_oxidized.instancias(caminho_config)
+    contadores = {"recargas": 0, "novos": 0, "retidos": 0, "erros": 0}
+
+    # Nodos novos: os do router.db que nenhuma instância conhece e que não estão em espera
+    novos = []
+    if usar_rest:
+        try:
+            conhecidos = nodos_conhecidos(instancias)
+        except (OSError, ValueError) as e:
+            print(f"Nodos atuais do Oxidized indisponíveis ({e}); sem admissão escalonada.", flush=True)
+        else:
+            retidos = set(agendador_oxidized.ler_admissao(caminho_config))
+            if usa_agendador(texto_config):
+                for diretorio, _ in instancias:
+                    retidos |= set(agendador_oxidized.espera_aplicada(diretorio))
+            novos = sorted({r["nome"] for r in registros} - conhecidos - retidos)
+    contadores["novos"] = len(novos)
+
+    definicao = shards_oxidized.ler_definicao(caminho_config)
+    if definicao:
+        shards_oxidized.particionar(caminho_config, definicao["quantidade"], definicao["modo"], definicao["porta_base"])
+    elif re.search(r"^\s*default: sql\s*$", texto_config, re.M):
+        conexao = inventario_oxidized.abrir_banco(os.path.join(caminho_config, "inventario.db"))
+        inventario_oxidized.importar(conexao, registros, substituir=True)
+        conexao.close()
+
+    if usa_agendador(texto_config):
+        admissao = agendador_oxidized.admitir(caminho_config, novos, lote, passo, agora)
+        contadores["retidos"] = len(admissao)
+        for diretorio, _ in instancias:
+            if os.path.exists(os.path.join(diretorio, "router.db")):
+                agendador_oxidized.aplicar_espera(diretorio, {**agendador_oxidized.espera_aplicada(diretorio), **admissao})
+    elif lote > 0 and len(novos) > lote:
+        print(f"{len(novos)} nodos novos entram de uma vez: a admissão em lotes depende do agendador (--agendador).",
+              flush=True)
+
+    if usar_rest:
+        for posicao, (_, url) in enumerate(instancias):
+            if posicao and escalonamento:
+                time.sleep(escalonamento)
+            try:
+                agendador_oxidized.requisitar(url, "/reload.json")
+                contadores["recargas"] += 1
+            except OSError as e:
+                print(f"Erro ao recarregar o Oxidized em {url}: {e}", flush=True)
+                contadores["erros"] += 1
+    return contadores
+
+
+# Serviços do Oxidized e o config que cada um lê
+def servicos_e_configs(caminho_config):
+    definicao = shards_oxidized.ler_definicao(caminho_config)
+    if definicao:
+        return [(f"oxidized@{i}", os.path.join(shards_oxidized.diretorio_shard(caminho_config, i), "config"))
+                for i in range(definicao["quantidade"])]
+    return [("oxidized", os.path.join(caminho_config, "config"))]
+
+
+# Início do serviço em epoch, ou None se não está rodando
+def inicio_servico(servico):
+    saida = subprocess.run(["systemctl", "show", "-p", "ActiveState", "-p", "ActiveEnterTimestampMonotonic", servico],
+                           capture_output=True, text=True).stdout
+    valores = dict(linha.split("=", 1) for linha in saida.splitlines() if "=" in linha)
+    monotonico = valores.get("ActiveEnterTimestampMonotonic", "")
+    if valores.get("ActiveState") != "active" or not monotonico.isdigit():
+        return None
+    return time.time() - (time.monotonic() - int(monotonico) / 1e6)
+
+
+# Reinicia, uma por vez, as instâncias que rodam com um config mais antigo que o atual
+def reiniciar_desatualizados(caminho_config, escalonamento):
+    reiniciados = []
+    for servico, arquivo in servicos_e_configs(caminho_config):
+        inicio = inicio_servico(servico)
+        if inicio is None or not os.path.exists(arquivo) or inicio >= os.stat(arquivo).st_mtime:
+            continue
+        if reiniciados and escalonamento:
+            time.sleep(escalonamento)
+        print(f"Reiniciando {servico}: config alterado", flush=True)
+        if subprocess.run(["systemctl", "restart", servico]).returncode == 0:
+            reiniciados.append(servico)
+    return reiniciados
+
+
+# Executa a recarga como o dono do diretório base (o serviço roda como root por causa do systemctl)
+def recarregar_como_dono(args, usar_rest):
+    comando = [sys.executable, os.path.abspath(__file__), "--base", args.base, "--lote", str(args.lote),
+               "--passo", str(args.passo), "--escalonamento", str(args.escalonamento), "recarregar", "--json"]
+    if not usar_rest:
+        comando.append("--sem-rest")
+    opcoes = {}
+    dono = os.stat(args.base)
+    if os.geteuid() == 0 and dono.st_uid != 0:
+        opcoes = {"user": dono.st_uid, "group": dono.st_gid,
+                  "env": dict(os.environ, HOME=pwd.getpwuid(dono.st_uid).pw_dir)}
+    resultado = subprocess.run(comando, capture_output=True, text=True, **opcoes)
+    linhas = resultado.stdout.splitlines()
+    for linha in linhas[:-1]:
+        print(linha, flush=True)
+    try:
+        return json.loads(linhas[-1])
+    except (IndexError, ValueError):
+        print(f"Erro na recarga: {resultado.stderr.strip()}", flush=True)
+        return {"recargas": 0, "novos": 0, "retidos": 0, "erros": 1}
+
+
+def gravar_metricas(caminho_config, modo, totais):
+    linhas = []
+    for chave, metrica, ajuda in (("recargas", "oxidized_reload_reloads_total", "Chamadas ao /reload feitas pelo observador."),
+                                  ("reinicios", "oxidized_reload_restarts_total", "Instâncias reiniciadas por mudança no config."),
+                                  ("ignorados", "oxidized_reload_ignored_config_changes_total",
+                                   "Mudanças no config só em comentários/formatação (sem reinício)."),
+                                  ("novos", "oxidized_reload_new_nodes_total", "Nodos novos encontrados no router.db."),
+                                  ("erros", "oxidized_reload_errors_total", "Recargas com erro (router.db inválido ou API indisponível).")):
+        linhas += [f"# HELP {metrica} {ajuda}", f"# TYPE {metrica} counter", f"{metrica} {totais[chave]}"]
+    linhas += [
+        "# HELP oxidized_reload_held_nodes Nodos novos aguardando a admissão escalonada.",
+        "# TYPE oxidized_reload_held_nodes gauge",
+        f"oxidized_reload_held_nodes {totais['retidos']}",
+        "# HELP oxidized_reload_watch_info Mecanismo usado para observar os arquivos.",
+        "# TYPE oxidized_reload_watch_info gauge",
+        f'oxidized_reload_watch_info{{mode="{modo}"}} 1',
+        "# HELP oxidized_reload_last_run_timestamp_seconds Fim da última recarga aplicada.",
+        "# TYPE oxidized_reload_last_run_timestamp_seconds gauge",
+        f"oxidized_reload_last_run_timestamp_seconds {time.time():.3f}",
+    ]
+    diretorio = os.path.join(caminho_config, "metricas")
+    if not os.path.isdir(diretorio):
+        os.makedirs(diretorio)
+        dono = os.stat(caminho_config)
+        os.chown(diretorio, dono.st_uid, dono.st_gid)
+    configuracao_oxidized.gravar_se_mudou(os.path.join(diretorio, "recarga.prom"), "\n".join(linhas) + "\n")
+
+
+def observar(args):
+    caminhos = {nome: os.path.join(args.base, nome) for nome in ARQUIVOS_OBSERVADOS}
+    assinaturas = {nome: assinatura(caminho) for nome, caminho in caminhos.items()}
+    config_aplicado = normalizar_config(agendador_oxidized.ler_config(args.base))
+    descritor = None if args.sem_inotify else abrir_inotify(args.base)
+    modo = "inotify" if descritor is not None else "varredura"
+    totais = dict.fromkeys(("recargas", "reinicios", "ignorados", "novos", "erros", "retidos"), 0)
+    gravar_metricas(args.base, modo, totais)
+    print(f"Observando {', '.join(caminhos.values())} ({modo}, janela de {args.janela}s)", flush=True)
+
+    pendentes, prazo = set(), None
+    while True:
+        limite = args.varredura if prazo is None else max(0.0, prazo - time.monotonic())
+        if descritor is not None:
+            ler_eventos(descritor, limite)
+        else:
+            time.sleep(min(limite, args.varredura))
+        # O evento só acorda o laço; a assinatura decide (outros arquivos do diretório também geram eventos)
+        for nome, caminho in caminhos.items():
+            atual = assinatura(caminho)
+            if atual != assinaturas[nome]:
+                assinaturas[nome] = atual
+                pendentes.add(nome)
+                prazo = time.monotonic() + args.janela
+        if not pendentes or time.monotonic() < prazo:
+            continue
+
+        reiniciar = False
+        if "config" in pendentes:
+            novo = normalizar_config(agendador_oxidized.ler_config(args.base))
+            if novo != config_aplicado:
+                config_aplicado, reiniciar = novo, True
+            else:
+                print("config: só comentários/formatação mudaram, sem reinício", flush=True)
+                totais["ignorados"] += 1
+        if "router.db" in pendentes or reiniciar:
+            # Com reinício pela frente o inventário é lido na partida: só regenera os derivados (e os configs dos shards)
+            resultado = recarregar_como_dono(args, usar_rest=not reiniciar)
+            for chave in ("recargas", "novos", "erros"):
+                totais[chave] += resultado[chave]
+            totais["retidos"] = resultado["retidos"]
+            print(f"router.db: {resultado['novos']} nodo(s) novo(s), {resultado['retidos']} aguardando admissão, "
+                  f"{resultado['recargas']} recarga(s)", flush=True)
+        if reiniciar:
+            totais["reinicios"] += len(reiniciar_desatualizados(args.base, args.escalonamento))
+        pendentes, prazo = set(), None
+        gravar_metricas(args.base, modo, totais)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recarga a quente do inventário e do config do Oxidized")
+    parser.add_argument("--base", default=CAMINHO_CONFIG, help="Diretório base do Oxidized (padrão: %(default)s)")
+    parser.add_argument("--lote", type=int, default=50,
+                        help="Nodos novos admitidos de uma vez; os demais esperam --passo por lote (0 desliga)")
+    parser.add_argument("--passo", type=float, default=300, help="Segundos entre lotes de nodos novos")
+    parser.add_argument("--escalonamento", type=float, default=10,
+                        help="Segundos entre a recarga/reinício de uma instância e da seguinte (shards)")
+    sub = parser.add_subparsers(dest="acao", required=True)
+
+    p_observar = sub.add_parser("observar", help="Observa router.db e config e aplica as mudanças")
+    p_observar.add_argument("--janela", type=float, default=5, help="Segundos sem novas mudanças antes de aplicar")
+    p_observar.add_argument("--varredura", type=float, default=30,
+                            help="Intervalo da varredura do mtime (sem inotify) e da verificação de segurança")
+    p_observar.add_argument("--sem-inotify", action="store_true", help="Usa só a varredura do mtime")
+
+    p_recarregar = sub.add_parser("recarregar", help="Aplica o router.db atual e chama /reload, sem reiniciar")
+    p_recarregar.add_argument("--sem-rest", action="store_true", help="Só regenera os inventários derivados")
+    p_recarregar.add_argument("--json", action="store_true", help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.acao == "observar":
+        observar(args)
+    elif args.acao == "recarregar":
+        contadores = recarregar(args.base, args.lote, args.passo, args.escalonamento, usar_rest=not args.sem_rest)
+        if args.json:
+            print(json.dumps(contadores))
+        else:
+            print(f"{contadores['novos']} nodo(s) novo(s), {contadores['retidos']} aguardando admissão, "
+                  f"{contadores['recargas']} recarga(s), {contadores['erros']} erro(s)")
+        if contadores["erros"] and not contadores["recargas"]:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+# Verificação das recording rules do Prometheus usadas pelo dashboard.
+#
+# Valida o arquivo de regras com "promtool check rules" e confere se toda série
+# pré-calculada consultada no grafana-dashboard.json (nomes no formato
+# nivel:metrica:operacao) está definida em alguma regra.
+
+DIRETORIO_SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+
+
+def series_gravadas(arquivo_regras):
+    with open(arquivo_regras) as f:
+        return set(re.findall(r"^\s*-?\s*record:\s*(\S+)\s*$", f.read(), re.M))
+
+
+def series_do_dashboard(arquivo_dashboard):
+    with open(arquivo_dashboard) as f:
+        dashboard = json.load(f)
+    usadas = set()
+    for painel in dashboard.get("panels", []):
+        for alvo in painel.get("targets", []):
+            usadas.update(re.findall(r"\b[a-zA-Z_][a-zA-Z0-9_]*:[a-zA-Z0-9_:]+\b", alvo.get("expr", "")))
+    return usadas
+
+
+def verificar(arquivo_regras, arquivo_dashboard, promtool="promtool"):
+    ok = True
+    executavel = shutil.which(promtool) or (promtool if os.path.exists(promtool) else None)
+    if executavel:
+        resultado = subprocess.run([executavel, "check", "rules", arquivo_regras], capture_output=True, text=True)
+        print((resultado.stdout + resultado.stderr).strip())
+        ok = resultado.returncode == 0
+    else:
+        print(f"{promtool} não encontrado; pulando a validação de sintaxe das regras.")
+
+    faltando = series_do_dashboard(arquivo_dashboard) - series_gravadas(arquivo_regras)
+    for serie in sorted(faltando):
+        print(f"Série usada no dashboard sem recording rule: {serie}")
+    return ok and not faltando
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Valida as recording rules do Oxidized e as consultas do dashboard")
+    sub = parser.add_subparsers(dest="acao", required=True)
+    p_verificar = sub.add_parser("verificar", help="promtool check rules + séries do dashboard definidas")
+    p_verificar.add_argument("--regras", default=os.path.join(DIRETORIO_SCRIPTS, "oxidized-rules.yml"))
+    p_verificar.add_argument("--dashboard", default=os.path.join(DIRETORIO_SCRIPTS, "grafana-dashboard.json"))
+    p_verificar.add_argument("--promtool", default="/usr/local/bin/promtool")
+    args = parser.parse_args()
+
+    if args.acao == "verificar":
+        if not verificar(args.regras, args.dashboard, args.promtool):
+            sys.exit(1)
+        print("Regras e dashboard consistentes.")
+
+
+if __name__ == "__main__":
+    main()
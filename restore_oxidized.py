@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
+import argparse
 import subprocess
 import os
 import sys
 import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import configuracao_oxidized
 
 # Função para executar comandos no terminal
 def executar_comando(comando, shell=False):
@@ -14,29 +19,144 @@ def executar_comando(comando, shell=False):
         return False
     return True
 
-def main():
-    # Detecta o usuário comum para aplicar as permissões
-    candidato_usuario = os.getenv("SUDO_USER")
-    if not candidato_usuario or candidato_usuario == "root":
-        casas = [d for d in os.listdir('/home') if os.path.isdir(os.path.join('/home', d)) and d != 'lost+found']
-        if casas:
-            usuario = casas[0]
+# Copia (ou cria hardlinks de) uma árvore inteira usando um pool de threads, com progresso e vazão
+def copiar_paralelo(origem, destino, trabalhadores=16, vincular=True):
+    tarefas = []
+    for raiz, pastas, arquivos in os.walk(origem):
+        pastas[:] = [p for p in pastas if p != ".git"]
+        relativo = os.path.relpath(raiz, origem)
+        os.makedirs(os.path.join(destino, relativo), exist_ok=True)
+        for arquivo in arquivos:
+            caminho = os.path.join(raiz, arquivo)
+            tarefas.append((caminho, os.path.join(destino, relativo, arquivo), os.path.getsize(caminho)))
+
+    def copiar(o, d):
+        # Remove o destino antes: escrever sobre um hardlink antigo alteraria também a origem
+        if os.path.lexists(d):
+            os.remove(d)
+        if vincular:
+            try:
+                os.link(o, d)
+                return
+            except OSError:
+                # Sistemas de arquivos diferentes (ex.: /tmp em tmpfs): cai para cópia normal
+                pass
+        shutil.copy2(o, d)
+
+    total = len(tarefas)
+    copiados = bytes_copiados = 0
+    inicio = ultimo_relatorio = time.monotonic()
+    with ThreadPoolExecutor(max_workers=trabalhadores) as executor:
+        futuros = {executor.submit(copiar, o, d): tamanho for o, d, tamanho in tarefas}
+        for futuro in as_completed(futuros):
+            futuro.result()
+            copiados += 1
+            bytes_copiados += futuros[futuro]
+            agora = time.monotonic()
+            if agora - ultimo_relatorio >= 1.0 or copiados == total:
+                ultimo_relatorio = agora
+                decorrido = max(agora - inicio, 1e-6)
+                print(f"  {copiados}/{total} arquivos | {copiados / decorrido:.0f} arq/s | "
+                      f"{bytes_copiados / decorrido / 1024 / 1024:.1f} MB/s", flush=True)
+
+    duracao = time.monotonic() - inicio
+    print(f"Cópia concluída: {total} arquivos, {bytes_copiados / 1024 / 1024:.1f} MB em {duracao:.2f}s")
+    return total, bytes_copiados, duracao
+
+# Restauração seletiva: só os caminhos pedidos, no instante pedido, sem clone completo.
+# Clone parcial sem blobs (commits e árvores) e sparse checkout: o checkout do commit escolhido
+# busca num único lote apenas os blobs dos dispositivos selecionados.
+def restaurar_seletivo(url_github, args, usuario, branch_replicacao):
+    inicio = time.monotonic()
+    como_usuario = ["sudo", "-u", usuario] if os.getuid() == 0 and usuario != "root" else []
+
+    def git(*argumentos):
+        return subprocess.run(como_usuario + ["git"] + list(argumentos), capture_output=True, text=True)
+
+    # Backups em modo replicação têm o histórico por equipamento no branch dedicado, sem prefixo
+    replicado = git("ls-remote", "--exit-code", "--heads", url_github, branch_replicacao).returncode == 0
+    branch, prefixo = (branch_replicacao, "") if replicado else ("master", "equipamentos_configuracao/")
+
+    clone = f"/tmp/oxidized_seletivo_{os.getpid()}"
+    resultado = git("clone", "-q", "--filter=blob:none", "--no-checkout", "--single-branch", "--no-tags",
+                    "-b", branch, url_github, clone)
+    if resultado.returncode != 0:
+        print(f"Falha ao clonar o repositório: {resultado.stderr.strip()}")
+        sys.exit(1)
+    try:
+        # --em aceita um commit/ref ou uma data ("2026-03-01 08:00", "last tuesday", epoch com @)
+        commit = None
+        if args.em:
+            commit = git("-C", clone, "rev-parse", "--verify", "-q", f"{args.em}^{{commit}}").stdout.strip()
+            if not commit:
+                commit = git("-C", clone, "rev-list", "-1", f"--before={args.em}", "HEAD").stdout.strip()
+            if not commit:
+                print(f"Nenhum backup encontrado em ou antes de '{args.em}'.")
+                sys.exit(1)
         else:
-            usuario = "root"
-    else:
-        usuario = candidato_usuario
+            commit = git("-C", clone, "rev-parse", "HEAD").stdout.strip()
+        print(f"Commit selecionado: {git('-C', clone, 'log', '-1', '--format=%h %ci %s', commit).stdout.strip()}")
+
+        if args.grupo and args.dispositivo:
+            padroes = [f"/{prefixo}{args.grupo}/{args.dispositivo}"]
+        elif args.grupo:
+            padroes = [f"/{prefixo}{args.grupo}/"]
+        elif args.dispositivo:
+            padroes = [f"/{prefixo}*/{args.dispositivo}", f"/{prefixo}{args.dispositivo}"]
+        else:
+            padroes = [f"/{prefixo}"]
+        git("-C", clone, "config", "core.sparseCheckout", "true")
+        subprocess.run(como_usuario + ["tee", os.path.join(clone, ".git", "info", "sparse-checkout")],
+                       input="\n".join(padroes) + "\n", text=True, stdout=subprocess.DEVNULL, check=True)
+        resultado = git("-C", clone, "checkout", "-q", "--detach", commit)
+        if resultado.returncode != 0:
+            print(f"Falha no checkout: {resultado.stderr.strip()}")
+            sys.exit(1)
+
+        origem = os.path.join(clone, prefixo)
+        restaurados = 0
+        for raiz, pastas, arquivos in os.walk(origem):
+            pastas[:] = [p for p in pastas if p != ".git"]
+            for arquivo in arquivos:
+                relativo = os.path.relpath(os.path.join(raiz, arquivo), origem)
+                destino = os.path.join(args.destino, relativo)
+                os.makedirs(os.path.dirname(destino), exist_ok=True)
+                shutil.copy2(os.path.join(raiz, arquivo), destino)
+                restaurados += 1
+    finally:
+        shutil.rmtree(clone, ignore_errors=True)
+
+    print(f"{restaurados} config(s) restaurado(s) em {args.destino} em {time.monotonic() - inicio:.2f}s")
+    if not restaurados:
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Recuperação de desastres do Oxidized a partir do backup no GitHub")
+    parser.add_argument("url_github", nargs="?", default="", help="URL SSH do repositório de backup")
+    parser.add_argument("--trabalhadores", type=int, default=min(32, (os.cpu_count() or 1) * 4),
+                        help="Threads usadas na cópia dos backups (padrão: %(default)s)")
+    parser.add_argument("--sem-hardlink", action="store_true", help="Sempre copia os arquivos em vez de criar hardlinks")
+    parser.add_argument("--clone-completo", action="store_true",
+                        help="Clona todo o histórico do repositório (padrão: clone raso só do último estado)")
+    seletiva = parser.add_argument_group("restauração seletiva (só extrai configs, sem reinstalar o Oxidized)")
+    seletiva.add_argument("--dispositivo", help="Restaura só este dispositivo")
+    seletiva.add_argument("--grupo", help="Restaura só os dispositivos deste grupo")
+    seletiva.add_argument("--em", help="Instante do backup: commit, data ('2026-03-01 08:00', 'last tuesday') ou @epoch")
+    seletiva.add_argument("--destino", default="/tmp/oxidized_restaurado",
+                          help="Onde gravar os configs na restauração seletiva (padrão: %(default)s)")
+    args = parser.parse_args()
 
-    diretorio_home = os.path.expanduser(f"~{usuario}")
-    caminho_config = "/opt/oxidized"
+    # Detecta o usuário comum para aplicar as permissões
+    usuario = configuracao_oxidized.detectar_usuario()
+    caminho_config = configuracao_oxidized.CAMINHO_CONFIG
     clone_temporario = "/tmp/oxidized_recovery"
+    branch_replicacao = configuracao_oxidized.BRANCH_REPLICACAO
     
     print("--- Iniciando Recuperação de Desastres do Oxidized ---")
 
     # 1. Obtém a URL do GitHub
-    url_github = ""
-    if len(sys.argv) > 1:
-        url_github = sys.argv[1].strip()
-    
+    url_github = args.url_github.strip()
+
     if not url_github:
         try:
             url_github = input("Digite a URL SSH do seu repositório GitHub (ex: git@github.com:user/repo.git): ").strip()
@@ -54,6 +174,11 @@ def main():
         url_github = f"git@github.com:{caminho_repo}.git"
         print(f"URL formatada automaticamente para: {url_github}")
 
+    # Restauração seletiva: usa a chave SSH já configurada e não reinstala nada
+    if args.dispositivo or args.grupo or args.em:
+        restaurar_seletivo(url_github, args, usuario, branch_replicacao)
+        return
+
     # 2. Instalação do Git se necessário
     print("Verificando dependências básicas (git)...")
     executar_comando(["apt-get", "update"])
@@ -75,87 +200,106 @@ def main():
         input("Pressione Enter DEPOIS de adicionar a chave ao GitHub para continuar...")
 
     # Garante que o SSH local do usuário aponte para a chave em /opt
-    diretorio_ssh_usuario = os.path.join(diretorio_home, ".ssh")
-    os.makedirs(diretorio_ssh_usuario, exist_ok=True)
-    executar_comando(f"chown {usuario}:{usuario} {diretorio_ssh_usuario}", shell=True)
-    
-    config_ssh = os.path.join(diretorio_ssh_usuario, "config")
-    entrada_ssh = f"\nHost github.com\n  HostName github.com\n  User git\n  IdentityFile {arquivo_chave}\n  StrictHostKeyChecking no\n"
-    
-    if not os.path.exists(config_ssh) or arquivo_chave not in open(config_ssh).read():
-        with open(config_ssh, "a") as f:
-            f.write(entrada_ssh)
-        executar_comando(f"chmod 600 {config_ssh}", shell=True)
-        executar_comando(f"chown {usuario}:{usuario} {config_ssh}", shell=True)
+    configuracao_oxidized.configurar_ssh_github(usuario, arquivo_chave)
 
     # 4. Clonagem do Repositório
     if os.path.exists(clone_temporario):
         shutil.rmtree(clone_temporario)
     
     print(f"Clonando repositório de backup: {url_github}")
-    if not executar_comando(f"sudo -u {usuario} git clone {url_github} {clone_temporario}", shell=True):
+    # O clone temporário só precisa do último estado de setup/ e equipamentos_configuracao/
+    opcoes_clone = "" if args.clone_completo else "--depth 1 --single-branch --no-tags"
+    if not executar_comando(f"sudo -u {usuario} git clone {opcoes_clone} {url_github} {clone_temporario}", shell=True):
         print("Falha ao clonar o repositório. Verifique suas permissões no GitHub.")
         sys.exit(1)
 
+    # Backups feitos em modo replicação guardam o histórico de configs num branch próprio
+    replicado = subprocess.run(f"sudo -u {usuario} git ls-remote --exit-code --heads {url_github} {branch_replicacao}",
+                               shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+
     # 5. Executa script de instalação para garantir dependências e serviço
     print("Finalizando ambiente (Executando instalador)...")
     instalador = os.path.join(caminho_config, "install_oxidized.py")
     if os.path.exists(instalador):
-        executar_comando(f"sudo python3 {instalador} '{url_github}'", shell=True)
+        modo_espelho = "replicacao" if replicado else "incremental"
+        opcoes_instalador = f"--espelho {modo_espelho}"
+        config_backup = os.path.join(clone_temporario, "setup", "config")
+        if os.path.exists(config_backup):
+            with open(config_backup) as f:
+                texto_backup = f.read()
+            if "router.ativo.db" in texto_backup or "equipamentos_ativos" in texto_backup:
+                opcoes_instalador += " --agendador"
+        executar_comando(f"sudo python3 {instalador} '{url_github}' {opcoes_instalador}", shell=True)
 
     # 6. RESTAURAÇÃO DOS DADOS DO GIT
     print("Aplicando dados restaurados do Git sobre as configurações...")
     pasta_setup = os.path.join(clone_temporario, "setup")
+    # Só reinicia o Oxidized se o config ou os modelos restaurados diferem do que o instalador deixou;
+    # se só o router.db mudou, basta o /reload. O observador da recarga fica parado até o fim.
+    subprocess.run(["systemctl", "stop", "oxidized-recarga"], stderr=subprocess.DEVNULL)
+    config_alterado = inventario_alterado = False
     if os.path.exists(pasta_setup):
         os.makedirs(caminho_config, exist_ok=True)
-        shutil.copy2(os.path.join(pasta_setup, "config"), os.path.join(caminho_config, "config"))
-        shutil.copy2(os.path.join(pasta_setup, "router.db"), os.path.join(caminho_config, "router.db"))
-        
+        # NORMALIZAÇÃO DE CAMINHOS: Ajusta o config restaurado (home de qualquer usuário) para o padrão /opt/oxidized
+        print("Normalizando caminhos no arquivo config...")
+        with open(os.path.join(pasta_setup, "config")) as f:
+            novo_conteudo = configuracao_oxidized.normalizar_caminhos(f.read(), caminho_config)
+        config_alterado |= configuracao_oxidized.gravar_se_mudou(os.path.join(caminho_config, "config"), novo_conteudo)
+        inventario_alterado |= configuracao_oxidized.copiar_se_mudou(os.path.join(pasta_setup, "router.db"),
+                                                                     os.path.join(caminho_config, "router.db"))
+        # Equipamentos importados que ainda aguardam responder à sondagem (importacao_oxidized.py)
+        if os.path.exists(os.path.join(pasta_setup, "router.quarentena.db")):
+            configuracao_oxidized.copiar_se_mudou(os.path.join(pasta_setup, "router.quarentena.db"),
+                                                  os.path.join(caminho_config, "router.quarentena.db"))
+
         origem_modelo = os.path.join(pasta_setup, "model")
         if os.path.exists(origem_modelo):
-            os.makedirs(os.path.join(caminho_config, "model"), exist_ok=True)
             for arquivo in os.listdir(origem_modelo):
-                shutil.copy2(os.path.join(origem_modelo, arquivo), os.path.join(caminho_config, "model", arquivo))
-        
-        # Protege os próprios scripts salvando-os em /opt/oxidized
-        shutil.copy2(os.path.join(pasta_setup, "install_oxidized.py"), os.path.join(caminho_config, "install_oxidized.py"))
-        shutil.copy2(os.path.join(pasta_setup, "restore_oxidized.py"), os.path.join(caminho_config, "restore_oxidized.py"))
+                config_alterado |= configuracao_oxidized.copiar_se_mudou(os.path.join(origem_modelo, arquivo),
+                                                                         os.path.join(caminho_config, "model", arquivo))
 
-        # NORMALIZAÇÃO DE CAMINHOS: Ajusta o config restaurado para o novo padrão /opt/oxidized
-        print("Normalizando caminhos no arquivo config...")
-        arquivo_config = os.path.join(caminho_config, "config")
-        if os.path.exists(arquivo_config):
-            with open(arquivo_config, "r") as f:
-                conteudo = f.read()
-            
-            # Substitui o caminho antigo pelo novo
-            novo_conteudo = conteudo.replace("/home/erick/.config/oxidized", "/opt/oxidized")
-            # Garante que referências aos scripts também sejam corrigidas
-            novo_conteudo = novo_conteudo.replace("/home/erick/install_oxidized.py", "/opt/oxidized/install_oxidized.py")
-            novo_conteudo = novo_conteudo.replace("/home/erick/restore_oxidized.py", "/opt/oxidized/restore_oxidized.py")
-            
-            with open(arquivo_config, "w") as f:
-                f.write(novo_conteudo)
+        # Protege os próprios scripts (instalador, restauração, sincronizador...) salvando-os em /opt/oxidized
+        for arquivo in os.listdir(pasta_setup):
+            if arquivo.endswith(".py"):
+                configuracao_oxidized.copiar_se_mudou(os.path.join(pasta_setup, arquivo), os.path.join(caminho_config, arquivo))
+
+        # Com a fonte sql o Oxidized lê o banco indexado, que é reconstruído a partir do router.db restaurado
+        if "default: sql" in novo_conteudo:
+            print("Reconstruindo inventário indexado a partir do router.db...")
+            executar_comando(f"python3 {caminho_config}/inventario_oxidized.py --banco {caminho_config}/inventario.db "
+                             f"--router-db {caminho_config}/router.db importar --substituir", shell=True)
+
+        # Com o agendador o Oxidized lê o inventário ativo, que não vai para o backup: recria a partir do router.db
+        if "router.ativo.db" in novo_conteudo:
+            executar_comando(f"python3 {caminho_config}/agendador_oxidized.py --base {caminho_config} executar --sem-rest",
+                             shell=True)
 
     # Restaura o histórico de backup dos equipamentos
     print("Restaurando histórico de backups dos equipamentos...")
-    origem_backup = os.path.join(clone_temporario, "equipamentos_configuracao")
     diretorio_backups = os.path.join(caminho_config, "configs")
-    if os.path.exists(origem_backup):
+    if replicado:
+        # Modo replicação: o histórico de configs está no branch dedicado; busca os objetos direto, sem cópia de arquivos
+        print(f"Branch '{branch_replicacao}' encontrado. Recuperando o histórico completo de configs...")
+        os.makedirs(diretorio_backups, exist_ok=True)
+        executar_comando(f"chown -R {usuario}:{usuario} {diretorio_backups}", shell=True)
+        if not os.path.exists(os.path.join(diretorio_backups, ".git")):
+            executar_comando(f"sudo -u {usuario} git -C {diretorio_backups} init", shell=True)
+        executar_comando(f"sudo -u {usuario} git -C {diretorio_backups} fetch --update-head-ok {url_github} +refs/heads/{branch_replicacao}:refs/heads/master", shell=True)
+        executar_comando(f"sudo -u {usuario} git -C {diretorio_backups} symbolic-ref HEAD refs/heads/master", shell=True)
+        executar_comando(f"sudo -u {usuario} git -C {diretorio_backups} reset -q --hard master", shell=True)
+        executar_comando(f"sudo -u {usuario} git -C {diretorio_backups} config user.name 'Oxidized'", shell=True)
+        executar_comando(f"sudo -u {usuario} git -C {diretorio_backups} config user.email 'oxidized@backup.local'", shell=True)
+
+    origem_backup = os.path.join(clone_temporario, "equipamentos_configuracao")
+    if not replicado and os.path.exists(origem_backup):
         os.makedirs(diretorio_backups, exist_ok=True)
         if not os.path.exists(os.path.join(diretorio_backups, ".git")):
             executar_comando(f"sudo -u {usuario} git -C {diretorio_backups} init", shell=True)
             executar_comando(f"sudo -u {usuario} git -C {diretorio_backups} config user.name 'Oxidized'", shell=True)
             executar_comando(f"sudo -u {usuario} git -C {diretorio_backups} config user.email 'oxidized@backup.local'", shell=True)
         
-        # Copia os backups restaurados para o pool local
-        for item in os.listdir(origem_backup):
-            o = os.path.join(origem_backup, item)
-            d = os.path.join(diretorio_backups, item)
-            if os.path.isdir(o):
-                shutil.copytree(o, d, dirs_exist_ok=True)
-            else:
-                shutil.copy2(o, d)
+        # Copia os backups restaurados para o pool local (em paralelo, com hardlink quando possível)
+        copiar_paralelo(origem_backup, diretorio_backups, args.trabalhadores, vincular=not args.sem_hardlink)
         
         # Commita a restauração para garantir que o histórico apareça na aba 'Versions'
         executar_comando(f"sudo -u {usuario} git -C {diretorio_backups} add .", shell=True)
@@ -166,7 +310,12 @@ def main():
     # Corrige permissões finais e reinicia o serviço
     print("Finalizando permissões e reiniciando serviço...")
     executar_comando(f"chown -R {usuario}:{usuario} {caminho_config}", shell=True)
-    executar_comando("systemctl restart oxidized", shell=True)
+    oxidized_ativo = subprocess.run(["systemctl", "is-active", "--quiet", "oxidized"]).returncode == 0
+    configuracao_oxidized.reiniciar_se_mudou(["oxidized"], config_alterado)
+    if oxidized_ativo and inventario_alterado and not config_alterado:
+        executar_comando(f"sudo -u {usuario} python3 {caminho_config}/recarga_oxidized.py --base {caminho_config} "
+                         f"recarregar --lote 0", shell=True)
+    subprocess.run(["systemctl", "start", "oxidized-recarga"], stderr=subprocess.DEVNULL)
 
     print("\n--- RECUPERAÇÃO CONCLUÍDA ---")
     print(f"O sistema foi restaurado em {caminho_config}.")
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+
+import configuracao_oxidized
+import inventario_oxidized
+
+# Modo com várias instâncias do Oxidized (shards).
+#
+# O router.db principal é dividido em K partes (hash consistente do nome do nodo
+# ou do grupo) e cada shard roda em shards/N/ com seu próprio config, porta REST
+# e repositório configs (serviço oxidized@N). A etapa de mesclagem, executada
+# pelo sincronizador, junta os repositórios dos shards no configs principal com
+# um commit de merge, e daí em diante o envio ao backup é o mesmo do modo simples.
+
+CAMINHO_CONFIG = os.getenv("OXIDIZED_HOME", "/opt/oxidized")
+PORTA_BASE = configuracao_oxidized.PORTA_BASE_SHARDS
+gravar_se_mudou = configuracao_oxidized.gravar_se_mudou
+
+
+def caminho_definicao(caminho_config):
+    return os.path.join(caminho_config, "shards", "shards.json")
+
+
+def diretorio_shard(caminho_config, indice):
+    return os.path.join(caminho_config, "shards", str(indice))
+
+
+def ler_definicao(caminho_config):
+    try:
+        with open(caminho_definicao(caminho_config)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def urls_rest(definicao):
+    return [f"http://127.0.0.1:{definicao['porta_base'] + i}" for i in range(definicao["quantidade"])]
+
+
+# Rendezvous hashing: ao mudar K só os nodos do shard novo/removido trocam de instância.
+# Nodo sem grupo conta como "default" tanto no particionamento quanto na mesclagem (arquivo na raiz de configs).
+def shard_de(nome, grupo, quantidade, modo="hash"):
+    chave = (grupo or "default") if modo == "grupo" else nome
+    return max(range(quantidade), key=lambda i: hashlib.sha1(f"{i}:{chave}".encode()).digest())
+
+
+# Config do shard: o mesmo do principal, com pid, porta REST, router.db/inventário e repositório próprios.
+# Os hooks continuam apontando para o spool e o receptor do sincronizador principal.
+def config_shard(texto, caminho_config, indice, porta):
+    diretorio = diretorio_shard(caminho_config, indice)
+    substituicoes = {
+        "pid": os.path.join(diretorio, "pid"),
+        "repo": os.path.join(diretorio, "configs"),
+        "database": os.path.join(diretorio, "inventario.db"),
+    }
+    for chave, valor in substituicoes.items():
+        texto = re.sub(rf'^(\s*){chave}: .*$', lambda m: f'{m.group(1)}{chave}: "{valor}"', texto, flags=re.M)
+    # O inventário mantém o nome do arquivo lido pelo principal (router.db, ou router.ativo.db com o agendador)
+    texto = re.sub(r'^(\s*)file: "?([^"\n]*?)"?\s*$',
+                   lambda m: f'{m.group(1)}file: "{os.path.join(diretorio, os.path.basename(m.group(2)))}"', texto, flags=re.M)
+    return re.sub(r"^rest: (.*):\d+\s*$", lambda m: f"rest: {m.group(1)}:{porta}", texto, flags=re.M)
+
+
+# Divide o router.db entre os shards e gera os configs; devolve os shards cujo inventário ou config mudou
+def particionar(caminho_config, quantidade, modo="hash", porta_base=PORTA_BASE):
+    partes = [[] for _ in range(quantidade)]
+    registros = [[] for _ in range(quantidade)]
+    with open(os.path.join(caminho_config, "router.db")) as f:
+        for numero, linha in enumerate(f, 1):
+            if not linha.strip() or linha.lstrip().startswith("#"):
+                continue
+            registro, erro = inventario_oxidized.analisar_linha(linha)
+            if erro:
+                print(f"router.db linha {numero}: {erro} (ignorada)")
+                continue
+            indice = shard_de(registro["nome"], registro["grupo"], quantidade, modo)
+            partes[indice].append(linha if linha.endswith("\n") else linha + "\n")
+            registros[indice].append(registro)
+
+    with open(os.path.join(caminho_config, "config")) as f:
+        config_principal = f.read()
+    usa_sql = re.search(r"^\s*default: sql\s*$", config_principal, re.M) is not None
+
+    alterados = []
+    for indice in range(quantidade):
+        diretorio = diretorio_shard(caminho_config, indice)
+        os.makedirs(diretorio, exist_ok=True)
+        mudou = gravar_se_mudou(os.path.join(diretorio, "router.db"), inventario_oxidized.CABECALHO + "".join(partes[indice]))
+        mudou |= gravar_se_mudou(os.path.join(diretorio, "config"),
+                                 config_shard(config_principal, caminho_config, indice, porta_base + indice))
+        if usa_sql and mudou:
+            conexao = inventario_oxidized.abrir_banco(os.path.join(diretorio, "inventario.db"))
+            inventario_oxidized.importar(conexao, registros[indice], substituir=True)
+            conexao.close()
+        if mudou:
+            alterados.append(indice)
+
+    gravar_se_mudou(caminho_definicao(caminho_config), json.dumps(
+        {"quantidade": quantidade, "modo": modo, "porta_base": porta_base}, indent=1) + "\n")
+    return alterados, [len(p) for p in partes]
+
+
+def git(repositorio, *argumentos, **opcoes):
+    return subprocess.run(["git", "-C", repositorio] + list(argumentos), capture_output=True, **opcoes)
+
+
+def revisao(repositorio, referencia="HEAD"):
+    resultado = git(repositorio, "rev-parse", "--verify", "-q", referencia, text=True)
+    return resultado.stdout.strip() or None
+
+
+# Junta os repositórios dos shards no configs principal. Os heads dos shards alterados entram como
+# pais do commit de merge, então o histórico por equipamento continua navegável a partir do configs.
+def mesclar(caminho_config):
+    definicao = ler_definicao(caminho_config)
+    if not definicao:
+        return None
+    destino = os.path.join(caminho_config, "configs")
+    if not os.path.isdir(os.path.join(destino, ".git")):
+        os.makedirs(destino, exist_ok=True)
+        git(destino, "init", "-q", "-b", "master", check=True)
+        git(destino, "config", "user.name", "Oxidized", check=True)
+        git(destino, "config", "user.email", "oxidized@backup.local", check=True)
+
+    entradas, novos = {}, []
+    for indice in range(definicao["quantidade"]):
+        repositorio = os.path.join(diretorio_shard(caminho_config, indice), "configs")
+        cabeca = revisao(repositorio) if os.path.isdir(repositorio) else None
+        if cabeca is None:
+            continue
+        referencia = f"refs/shards/{indice}"
+        if revisao(destino, referencia) != cabeca:
+            git(destino, "fetch", "-q", "--no-tags", repositorio, f"+{cabeca}:{referencia}", check=True)
+            novos.append((indice, cabeca))
+        for entrada in git(destino, "ls-tree", "-r", "-z", referencia, check=True).stdout.split(b"\0"):
+            if not entrada:
+                continue
+            meta, caminho = entrada.split(b"\t", 1)
+            grupo, _, nome = os.fsdecode(caminho).rpartition("/")
+            # Nodo que mudou de shard: vale a cópia do shard que o coleta hoje
+            dono = shard_de(nome, grupo, definicao["quantidade"], definicao["modo"]) == indice
+            if caminho not in entradas or dono:
+                entradas[caminho] = meta
+
+    anterior = revisao(destino)
+    if not novos and anterior:
+        return anterior
+
+    indice_temporario = os.path.join(destino, ".git", "index.mesclagem")
+    ambiente = dict(os.environ, GIT_INDEX_FILE=indice_temporario)
+    try:
+        git(destino, "read-tree", "--empty", env=ambiente, check=True)
+        lista = b"".join(meta + b"\t" + caminho + b"\0" for caminho, meta in sorted(entradas.items()))
+        git(destino, "update-index", "-z", "--index-info", input=lista, env=ambiente, check=True)
+        arvore = git(destino, "write-tree", env=ambiente, text=True, check=True).stdout.strip()
+    finally:
+        if os.path.exists(indice_temporario):
+            os.remove(indice_temporario)
+
+    if anterior and revisao(destino, "HEAD^{tree}") == arvore:
+        return anterior
+    pais = ([anterior] if anterior else []) + [cabeca for _, cabeca in novos]
+    argumentos = [a for pai in pais for a in ("-p", pai)]
+    mensagem = "Mescla dos shards " + ", ".join(str(i) for i, _ in novos)
+    commit = git(destino, "commit-tree", arvore, *argumentos, "-m", mensagem, text=True, check=True).stdout.strip()
+    git(destino, "update-ref", "HEAD", commit, check=True)
+    # Árvore de trabalho atualizada para o espelhamento completo (rsync); só os arquivos alterados são reescritos
+    git(destino, "reset", "-q", "--hard", check=True)
+    return commit
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Particiona o inventário entre instâncias do Oxidized e mescla os configs")
+    parser.add_argument("--base", default=CAMINHO_CONFIG, help="Diretório base do Oxidized (padrão: %(default)s)")
+    sub = parser.add_subparsers(dest="acao", required=True)
+
+    p_particionar = sub.add_parser("particionar", help="Divide o router.db e gera os configs dos shards")
+    p_particionar.add_argument("--quantidade", type=int, required=True)
+    p_particionar.add_argument("--modo", choices=["hash", "grupo"], default="hash",
+                               help="hash: por nome do nodo; grupo: todos os nodos de um grupo no mesmo shard")
+    p_particionar.add_argument("--porta-base", type=int, default=PORTA_BASE, help="Porta REST do shard 0")
+
+    sub.add_parser("mesclar", help="Junta os repositórios dos shards no configs principal")
+    sub.add_parser("listar", help="Mostra os shards e suas URLs REST")
+
+    args = parser.parse_args()
+
+    if args.acao == "particionar":
+        if args.quantidade < 1:
+            print("A quantidade de shards deve ser ao menos 1.")
+            sys.exit(1)
+        alterados, contagens = particionar(args.base, args.quantidade, args.modo, args.porta_base)
+        for indice, contagem in enumerate(contagens):
+            print(f"shard {indice}: {contagem} nodo(s){' (alterado)' if indice in alterados else ''}")
+    elif args.acao == "mesclar":
+        print(mesclar(args.base) or "Modo com shards não configurado.")
+    elif args.acao == "listar":
+        definicao = ler_definicao(args.base)
+        if not definicao:
+            print("Modo com shards não configurado.")
+            return
+        for indice, url in enumerate(urls_rest(definicao)):
+            print(f"shard {indice}: {diretorio_shard(args.base, indice)} {url}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+import argparse
+import bisect
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+# Armazém local de snapshots dos configs, endereçado por conteúdo.
+#
+# Cada config é dividido em blocos nas fronteiras de linha escolhidas pelo
+# próprio conteúdo (uma edição local só muda os blocos ao redor), e cada bloco é
+# gravado uma única vez, comprimido (zstd quando o módulo "zstandard" está
+# instalado, zlib caso contrário), em dados.bin. O índice (indice.bin) é um
+# arquivo de registros fixos ordenados por SHA-256, lido com mmap e busca
+# binária. Cada dispositivo tem um manifesto JSON Lines com a lista de blocos
+# de cada versão; restaurar um instante é ler um manifesto e juntar os blocos,
+# sem replay do histórico do git.
+
+CAMINHO_CONFIG = os.getenv("OXIDIZED_HOME", "/opt/oxidized")
+CABECALHO = b"OXSNAP1\0"
+REGISTRO = struct.Struct(">32sQIB")  # sha256, posição em dados.bin, tamanho comprimido, compressão
+ZLIB, ZSTD = 0, 1
+DIVISOR_FRONTEIRA = 32
+BLOCO_MAXIMO = 64 * 1024
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def caminhos(caminho_config):
+    diretorio = os.path.join(caminho_config, "snapshots")
+    return {
+        "diretorio": diretorio,
+        "dados": os.path.join(diretorio, "dados.bin"),
+        "indice": os.path.join(diretorio, "indice.bin"),
+        "manifestos": os.path.join(diretorio, "manifestos"),
+        "estado": os.path.join(diretorio, "estado.json"),
+        "trava": os.path.join(diretorio, ".trava"),
+    }
+
+
+# Fronteira depois de uma linha quando o CRC dela cai no divisor: mesmo conteúdo, mesmos blocos
+def dividir(conteudo):
+    blocos, inicio, posicao = [], 0, 0
+    while posicao < len(conteudo):
+        fim = conteudo.find(b"\n", posicao)
+        fim = len(conteudo) if fim < 0 else fim + 1
+        if zlib.crc32(conteudo[posicao:fim]) % DIVISOR_FRONTEIRA == 0 or fim - inicio >= BLOCO_MAXIMO:
+            blocos.append(conteudo[inicio:fim])
+            inicio = fim
+        posicao = fim
+    if inicio < len(conteudo):
+        blocos.append(conteudo[inicio:])
+    return blocos
+
+
+def comprimir(bloco):
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=9).compress(bloco), ZSTD
+    return zlib.compress(bloco, 9), ZLIB
+
+
+def descomprimir(dados, compressao):
+    if compressao == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("bloco comprimido com zstd, mas o módulo zstandard não está instalado")
+        return zstandard.ZstdDecompressor().decompress(dados)
+    return zlib.decompress(dados)
+
+
+# Índice ordenado mapeado em memória: consulta por busca binária sem carregar o arquivo
+class Indice:
+    def __init__(self, caminho):
+        self.arquivo = None
+        self.mapa = None
+        self.quantidade = 0
+        if os.path.exists(caminho) and os.path.getsize(caminho) > len(CABECALHO):
+            self.arquivo = open(caminho, "rb")
+            self.mapa = mmap.mmap(self.arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+            if self.mapa[:len(CABECALHO)] != CABECALHO:
+                raise ValueError(f"{caminho}: índice de snapshots inválido")
+            self.quantidade = (len(self.mapa) - len(CABECALHO)) // REGISTRO.size
+
+    def __len__(self):
+        return self.quantidade
+
+    def __getitem__(self, posicao):
+        inicio = len(CABECALHO) + posicao * REGISTRO.size
+        return self.mapa[inicio:inicio + 32]
+
+    def registro(self, posicao):
+        return REGISTRO.unpack_from(self.mapa, len(CABECALHO) + posicao * REGISTRO.size)
+
+    def buscar(self, digest):
+        posicao = bisect.bisect_left(self, digest)
+        if posicao < self.quantidade and self[posicao] == digest:
+            return self.registro(posicao)[1:]
+        return None
+
+    def registros(self):
+        for posicao in range(self.quantidade):
+            yield self.registro(posicao)
+
+    def fechar(self):
+        if self.mapa is not None:
+            self.mapa.close()
+            self.arquivo.close()
+
+
+# Junta os registros antigos (já ordenados) com os novos num índice novo, trocado de forma atômica
+def regravar_indice(dirs, indice, novos):
+    descritor, temporario = tempfile.mkstemp(prefix=".indice.", dir=dirs["diretorio"])
+    with os.fdopen(descritor, "wb") as f:
+        f.write(CABECALHO)
+        antigos = indice.registros()
+        atual = next(antigos, None)
+        for registro in sorted(novos):
+            while atual is not None and atual[0] < registro[0]:
+                f.write(REGISTRO.pack(*atual))
+                atual = next(antigos, None)
+            f.write(REGISTRO.pack(*registro))
+        while atual is not None:
+            f.write(REGISTRO.pack(*atual))
+            atual = next(antigos, None)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporario, dirs["indice"])
+
+
+def git(repositorio, *argumentos, **opcoes):
+    return subprocess.run(["git", "-C", repositorio] + list(argumentos), capture_output=True, **opcoes)
+
+
+def ler_estado(dirs):
+    try:
+        with open(dirs["estado"]) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+# Arquivos alterados entre o último commit capturado e o HEAD: {caminho: sha do blob ou None se removido}
+def alteracoes(repositorio, desde, ate):
+    alterados = {}
+    if desde is None:
+        for entrada in git(repositorio, "ls-tree", "-r", "-z", ate, check=True).stdout.split(b"\0"):
+            if not entrada:
+                continue
+            meta, caminho = entrada.split(b"\t", 1)
+            _, tipo, sha = meta.split()
+            if tipo == b"blob":
+                alterados[os.fsdecode(caminho)] = sha.decode()
+        return alterados
+    campos = git(repositorio, "diff-tree", "-r", "-z", "--no-renames", desde, ate, check=True).stdout.split(b"\0")
+    for meta, caminho in zip(campos[0::2], campos[1::2]):
+        partes = meta.split()
+        if len(partes) >= 5:
+            alterados[os.fsdecode(caminho)] = None if partes[4] == b"D" else partes[3].decode()
+    return alterados
+
+
+def ler_blobs(repositorio, shas):
+    processo = subprocess.Popen(["git", "-C", repositorio, "cat-file", "--batch"],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        for sha in shas:
+            processo.stdin.write(f"{sha}\n".encode())
+            processo.stdin.flush()
+            tamanho = int(processo.stdout.readline().split()[2])
+            conteudo = processo.stdout.read(tamanho)
+            processo.stdout.read(1)
+            yield sha, conteudo
+    finally:
+        processo.stdin.close()
+        processo.wait()
+
+
+# Captura os configs alterados desde o último snapshot; devolve (dispositivos, blocos novos, bytes novos)
+def capturar(caminho_config, repositorio=None):
+    dirs = caminhos(caminho_config)
+    repositorio = repositorio or os.path.join(caminho_config, "configs")
+    os.makedirs(dirs["manifestos"], exist_ok=True)
+    with open(dirs["trava"], "w") as trava:
+        fcntl.flock(trava, fcntl.LOCK_EX)
+        cabeca = git(repositorio, "rev-parse", "--verify", "-q", "HEAD", text=True).stdout.strip()
+        estado = ler_estado(dirs)
+        if not cabeca or estado.get("ultimo_commit") == cabeca:
+            return 0, 0, 0
+        desde = estado.get("ultimo_commit")
+        if desde and git(repositorio, "merge-base", "--is-ancestor", desde, cabeca).returncode != 0:
+            desde = None
+        ts = int(git(repositorio, "show", "-s", "--format=%ct", cabeca, text=True, check=True).stdout.strip())
+        alterados = alteracoes(repositorio, desde, cabeca)
+
+        indice = Indice(dirs["indice"])
+        novos = {}
+        bytes_novos = 0
+        entradas = {}
+        try:
+            with open(dirs["dados"], "ab") as dados:
+                posicao = dados.tell()
+                por_sha = {}
+                for caminho, sha in alterados.items():
+                    if sha is not None:
+                        por_sha.setdefault(sha, []).append(caminho)
+                for sha, conteudo in ler_blobs(repositorio, list(por_sha)):
+                    lista = []
+                    for bloco in dividir(conteudo):
+                        digest = hashlib.sha256(bloco).digest()
+                        lista.append(digest.hex())
+                        if digest in novos or indice.buscar(digest) is not None:
+                            continue
+                        comprimido, compressao = comprimir(bloco)
+                        dados.write(comprimido)
+                        novos[digest] = (digest, posicao, len(comprimido), compressao)
+                        posicao += len(comprimido)
+                        bytes_novos += len(comprimido)
+                    for caminho in por_sha[sha]:
+                        entradas[caminho] = {"ts": ts, "commit": cabeca, "tamanho": len(conteudo), "blocos": lista}
+                dados.flush()
+                os.fsync(dados.fileno())
+            # Os blocos estão no disco antes de o índice e os manifestos apontarem para eles
+            if novos:
+                regravar_indice(dirs, indice, novos.values())
+        finally:
+            indice.fechar()
+
+        for caminho, sha in alterados.items():
+            entrada = entradas.get(caminho) or {"ts": ts, "commit": cabeca, "removido": True}
+            manifesto = os.path.join(dirs["manifestos"], caminho + ".jsonl")
+            os.makedirs(os.path.dirname(manifesto), exist_ok=True)
+            with open(manifesto, "a") as f:
+                f.write(json.dumps(entrada, separators=(",", ":")) + "\n")
+
+        descritor, temporario = tempfile.mkstemp(prefix=".estado.", dir=dirs["diretorio"])
+        with os.fdopen(descritor, "w") as f:
+            json.dump({"ultimo_commit": cabeca, "ts": ts}, f)
+        os.replace(temporario, dirs["estado"])
+        return len(alterados), len(novos), bytes_novos
+
+
+def manifestos(dirs, grupo=None, dispositivo=None):
+    raiz = dirs["manifestos"]
+    for diretorio, _, arquivos in os.walk(raiz):
+        for arquivo in arquivos:
+            if not arquivo.endswith(".jsonl"):
+                continue
+            caminho = os.path.relpath(os.path.join(diretorio, arquivo), raiz)[:-len(".jsonl")]
+            grupo_nodo, _, nome = caminho.rpartition("/")
+            if (dispositivo and nome != dispositivo) or (grupo and grupo_nodo != grupo):
+                continue
+            yield caminho, os.path.join(diretorio, arquivo)
+
+
+# Versão do manifesto vigente no instante pedido (None: nenhuma ou removido)
+def versao_em(arquivo_manifesto, instante):
+    escolhida = None
+    with open(arquivo_manifesto) as f:
+        for linha in f:
+            entrada = json.loads(linha)
+            if entrada["ts"] > instante:
+                break
+            escolhida = entrada
+    return None if escolhida is None or escolhida.get("removido") else escolhida
+
+
+def restaurar(caminho_config, destino, instante=None, grupo=None, dispositivo=None):
+    dirs = caminhos(caminho_config)
+    instante = instante if instante is not None else time.time()
+    indice = Indice(dirs["indice"])
+    restaurados = 0
+    try:
+        with open(dirs["dados"], "rb") as dados:
+            for caminho, arquivo in manifestos(dirs, grupo, dispositivo):
+                versao = versao_em(arquivo, instante)
+                if versao is None:
+                    continue
+                partes = []
+                for digest in versao["blocos"]:
+                    encontrado = indice.buscar(bytes.fromhex(digest))
+                    if encontrado is None:
+                        raise RuntimeError(f"{caminho}: bloco {digest} ausente do índice")
+                    posicao, tamanho, compressao = encontrado
+                    partes.append(descomprimir(os.pread(dados.fileno(), tamanho, posicao), compressao))
+                saida = os.path.join(destino, caminho)
+                os.makedirs(os.path.dirname(saida), exist_ok=True)
+                with open(saida, "wb") as f:
+                    f.write(b"".join(partes))
+                restaurados += 1
+    finally:
+        indice.fechar()
+    return restaurados
+
+
+def estatisticas(caminho_config):
+    dirs = caminhos(caminho_config)
+    indice = Indice(dirs["indice"])
+    blocos = len(indice)
+    indice.fechar()
+    versoes = logico = dispositivos = 0
+    for _, arquivo in manifestos(dirs):
+        dispositivos += 1
+        with open(arquivo) as f:
+            for linha in f:
+                entrada = json.loads(linha)
+                versoes += 1
+                logico += entrada.get("tamanho", 0)
+    fisico = os.path.getsize(dirs["dados"]) if os.path.exists(dirs["dados"]) else 0
+    return {"dispositivos": dispositivos, "versoes": versoes, "blocos": blocos,
+            "bytes_logicos": logico, "bytes_armazenados": fisico}
+
+
+def ler_instante(texto):
+    if texto is None:
+        return None
+    if texto.isdigit():
+        return int(texto)
+    for formato in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(time.strptime(texto, formato))
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError(f"data inválida: {texto} (use AAAA-MM-DD [HH:MM[:SS]] ou epoch)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshots deduplicados dos configs com restauração por instante")
+    parser.add_argument("--base", default=CAMINHO_CONFIG, help="Diretório base do Oxidized (padrão: %(default)s)")
+    sub = parser.add_subparsers(dest="acao", required=True)
+
+    p_capturar = sub.add_parser("capturar", help="Grava os configs alterados desde o último snapshot")
+    p_capturar.add_argument("--repo", help="Repositório configs (padrão: <base>/configs)")
+
+    p_restaurar = sub.add_parser("restaurar", help="Restaura os configs de um instante")
+    p_restaurar.add_argument("destino")
+    p_restaurar.add_argument("--em", type=ler_instante, help="Instante (AAAA-MM-DD [HH:MM[:SS]] ou epoch; padrão: agora)")
+    p_restaurar.add_argument("--grupo")
+    p_restaurar.add_argument("--dispositivo")
+
+    sub.add_parser("estatisticas", help="Mostra a deduplicação obtida")
+
+    args = parser.parse_args()
+
+    if args.acao == "capturar":
+        inicio = time.monotonic()
+        alterados, blocos, tamanho = capturar(args.base, args.repo)
+        print(f"{alterados} dispositivo(s) alterado(s), {blocos} bloco(s) novo(s), {tamanho} bytes gravados "
+              f"em {time.monotonic() - inicio:.2f}s")
+    elif args.acao == "restaurar":
+        inicio = time.monotonic()
+        restaurados = restaurar(args.base, args.destino, args.em, args.grupo, args.dispositivo)
+        print(f"{restaurados} config(s) restaurado(s) em {args.destino} em {time.monotonic() - inicio:.2f}s")
+        if not restaurados:
+            sys.exit(1)
+    elif args.acao == "estatisticas":
+        dados = estatisticas(args.base)
+        razao = dados["bytes_logicos"] / dados["bytes_armazenados"] if dados["bytes_armazenados"] else 0
+        print(f"{dados['dispositivos']} dispositivo(s), {dados['versoes']} versão(ões), {dados['blocos']} bloco(s)")
+        print(f"{dados['bytes_logicos']} bytes lógicos em {dados['bytes_armazenados']} bytes armazenados ({razao:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,859 @@
+#!/usr/bin/env python3
+import argparse
+import bisect
+import collections
+import contextlib
+import fcntl
+import json
+import os
+import queue
+import random
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import configuracao_oxidized
+import falhas_oxidized
+import shards_oxidized
+import snapshots_oxidized
+
+# Daemon de sincronização do Oxidized.
+#
+# O hook post_store apenas cria um arquivo "<grupo>@<nodo>" no diretório de
+# spool, com a duração da coleta (sem processos extras). Este serviço consome o spool, agrupa os
+# eventos dentro de uma janela de debounce e executa UMA sincronização
+# (espelhamento, commit e push) por janela. Também recebe os eventos dos hooks
+# por HTTP (POST /evento/<tipo>) e os processa sem criar processos. No modo com
+# shards, os repositórios das instâncias são mesclados no configs antes do lote.
+# Cada etapa (coleta, espera no spool, mesclagem, espelhamento, commit, push...)
+# gera um span: os últimos ficam num anel em memória (GET /rastros) e as
+# durações vão para histogramas por etapa no /metrics.
+
+CAMINHO_CONFIG = os.getenv("OXIDIZED_HOME", "/opt/oxidized")
+BRANCH_REPLICACAO = configuracao_oxidized.BRANCH_REPLICACAO
+# Limites (segundos) dos histogramas de duração das etapas
+BALDES = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+# Etapas por evento (um span por equipamento); as demais são por lote
+ETAPAS_EVENTO = ("collect", "queue", "end_to_end")
+
+
+# Função para executar comandos no terminal e tratar erros
+def executar_comando(comando, shell=False):
+    print(f"Executando: {comando}", flush=True)
+    try:
+        subprocess.run(comando, check=True, shell=shell)
+    except subprocess.CalledProcessError as e:
+        print(f"Erro ao executar o comando: {e}", flush=True)
+        return False
+    return True
+
+
+# Caminhos derivados do diretório base do Oxidized
+def caminhos(caminho_config):
+    return {
+        "configs": os.path.join(caminho_config, "configs"),
+        "repo": os.path.join(caminho_config, "repo_sync"),
+        "spool": os.path.join(caminho_config, "spool"),
+        "processando": os.path.join(caminho_config, "spool", ".processando"),
+        "trava": os.path.join(caminho_config, "sync.lock"),
+    }
+
+
+# Enfileira um evento no spool (equivalente ao que o hook faz em shell)
+def notificar(caminho_config, nodo, grupo="", tempo=""):
+    spool = caminhos(caminho_config)["spool"]
+    os.makedirs(spool, exist_ok=True)
+    nome = f"{grupo}@{nodo}".replace("/", "_")
+    with open(os.path.join(spool, nome), "w") as f:
+        f.write(f"{tempo}\n" if tempo else "")
+
+
+# Horário do armazenamento (mtime do arquivo do hook) e duração da coleta (OX_JOB_TIME gravado pelo hook)
+def ler_evento(caminho):
+    try:
+        armazenado = os.stat(caminho).st_mtime
+        with open(caminho) as f:
+            conteudo = f.read().strip()
+    except OSError:
+        return None, None
+    try:
+        return armazenado, float(conteudo) if conteudo else None
+    except ValueError:
+        return armazenado, None
+
+
+# Spans das etapas do pipeline: anel com os mais recentes e histogramas cumulativos por etapa
+class Rastros:
+    def __init__(self, capacidade=5000):
+        self.trava = threading.Lock()
+        self.anel = collections.deque(maxlen=capacidade)
+        self.baldes = {}
+        self.somas = {}
+        self.lote = 0
+
+    def novo_lote(self):
+        with self.trava:
+            self.lote += 1
+            return self.lote
+
+    def registrar(self, etapa, inicio, duracao, **atributos):
+        duracao = max(0.0, duracao)
+        with self.trava:
+            self.anel.append({"lote": self.lote, "etapa": etapa, "inicio": round(inicio, 3),
+                              "duracao": round(duracao, 6), **atributos})
+            contagens = self.baldes.setdefault(etapa, [0] * (len(BALDES) + 1))
+            contagens[bisect.bisect_left(BALDES, duracao)] += 1
+            self.somas[etapa] = self.somas.get(etapa, 0.0) + duracao
+
+    # Span de uma etapa do lote; o dicionário devolvido recebe atributos (ex.: sucesso, arquivos)
+    @contextlib.contextmanager
+    def etapa(self, nome, **atributos):
+        inicio, marco = time.time(), time.monotonic()
+        try:
+            yield atributos
+        finally:
+            self.registrar(nome, inicio, time.monotonic() - marco, **atributos)
+
+    def listar(self, etapa=None, limite=None):
+        with self.trava:
+            spans = [s for s in self.anel if etapa is None or s["etapa"] == etapa]
+        return spans[-limite:] if limite else spans
+
+    def renderizar(self):
+        linhas = [
+            "# HELP oxidized_sync_stage_duration_seconds Duração de cada etapa do pipeline de backup "
+            "(collect, queue e end_to_end por equipamento; as demais por lote).",
+            "# TYPE oxidized_sync_stage_duration_seconds histogram",
+        ]
+        with self.trava:
+            for etapa, contagens in sorted(self.baldes.items()):
+                acumulado = 0
+                for limite, contagem in zip(BALDES, contagens):
+                    acumulado += contagem
+                    linhas.append(f'oxidized_sync_stage_duration_seconds_bucket{{stage="{etapa}",le="{limite}"}} {acumulado}')
+                total = acumulado + contagens[-1]
+                linhas += [
+                    f'oxidized_sync_stage_duration_seconds_bucket{{stage="{etapa}",le="+Inf"}} {total}',
+                    f'oxidized_sync_stage_duration_seconds_sum{{stage="{etapa}"}} {self.somas[etapa]:.6f}',
+                    f'oxidized_sync_stage_duration_seconds_count{{stage="{etapa}"}} {total}',
+                ]
+        return "\n".join(linhas) + "\n"
+
+
+class Metricas:
+    def __init__(self, capacidade_rastros=5000):
+        self.trava = threading.Lock()
+        self.rastros = Rastros(capacidade_rastros)
+        self.fila = 0
+        self.eventos = 0
+        self.execucoes = 0
+        self.falhas = 0
+        self.duracao_soma = 0.0
+        self.duracao_ultima = 0.0
+        self.ultimo_sucesso = 0.0
+        self.commits = 0
+        self.commits_pulados = 0
+        self.pushes = 0
+        self.push_falhas = 0
+        self.push_tentativas = 0
+        self.push_duracao = 0.0
+        self.bytes_enviados = 0
+
+    # Os contadores são alterados pelo laço do lote e lidos pela thread do /metrics: tudo sob a trava
+    def somar(self, **incrementos):
+        with self.trava:
+            for campo, valor in incrementos.items():
+                setattr(self, campo, getattr(self, campo) + valor)
+
+    def definir_fila(self, tamanho):
+        with self.trava:
+            self.fila = tamanho
+
+    def registrar_sincronizacao(self, duracao, sucesso):
+        with self.trava:
+            self.execucoes += 1
+            self.duracao_soma += duracao
+            self.duracao_ultima = duracao
+            if sucesso:
+                self.ultimo_sucesso = time.time()
+            else:
+                self.falhas += 1
+
+    def renderizar(self):
+        with self.trava:
+            linhas = [
+                "# HELP oxidized_sync_queue_depth Eventos post_store aguardando sincronização.",
+                "# TYPE oxidized_sync_queue_depth gauge",
+                f"oxidized_sync_queue_depth {self.fila}",
+                "# HELP oxidized_sync_events_total Eventos post_store recebidos.",
+                "# TYPE oxidized_sync_events_total counter",
+                f"oxidized_sync_events_total {self.eventos}",
+                "# HELP oxidized_sync_runs_total Sincronizações em lote executadas.",
+                "# TYPE oxidized_sync_runs_total counter",
+                f"oxidized_sync_runs_total {self.execucoes}",
+                "# HELP oxidized_sync_failures_total Sincronizações que terminaram com erro.",
+                "# TYPE oxidized_sync_failures_total counter",
+                f"oxidized_sync_failures_total {self.falhas}",
+                "# HELP oxidized_sync_duration_seconds Latência das sincronizações em lote.",
+                "# TYPE oxidized_sync_duration_seconds summary",
+                f"oxidized_sync_duration_seconds_sum {self.duracao_soma:.6f}",
+                f"oxidized_sync_duration_seconds_count {self.execucoes}",
+                "# HELP oxidized_sync_last_duration_seconds Duração da última sincronização.",
+                "# TYPE oxidized_sync_last_duration_seconds gauge",
+                f"oxidized_sync_last_duration_seconds {self.duracao_ultima:.6f}",
+                "# HELP oxidized_sync_last_success_timestamp_seconds Horário da última sincronização bem-sucedida.",
+                "# TYPE oxidized_sync_last_success_timestamp_seconds gauge",
+                f"oxidized_sync_last_success_timestamp_seconds {self.ultimo_sucesso:.3f}",
+                "# HELP oxidized_sync_commits_total Commits criados no repo_sync.",
+                "# TYPE oxidized_sync_commits_total counter",
+                f"oxidized_sync_commits_total {self.commits}",
+                "# HELP oxidized_sync_commits_skipped_total Lotes sem alterações no índice (commit não criado).",
+                "# TYPE oxidized_sync_commits_skipped_total counter",
+                f"oxidized_sync_commits_skipped_total {self.commits_pulados}",
+                "# HELP oxidized_sync_pushes_total Pushes concluídos para o remoto de backup.",
+                "# TYPE oxidized_sync_pushes_total counter",
+                f"oxidized_sync_pushes_total {self.pushes}",
+                "# HELP oxidized_sync_push_attempts_total Tentativas de push, incluindo retentativas.",
+                "# TYPE oxidized_sync_push_attempts_total counter",
+                f"oxidized_sync_push_attempts_total {self.push_tentativas}",
+                "# HELP oxidized_sync_push_failures_total Pushes que falharam após todas as retentativas.",
+                "# TYPE oxidized_sync_push_failures_total counter",
+                f"oxidized_sync_push_failures_total {self.push_falhas}",
+                "# HELP oxidized_sync_push_bytes_total Bytes de objetos enviados pelos pushes.",
+                "# TYPE oxidized_sync_push_bytes_total counter",
+                f"oxidized_sync_push_bytes_total {self.bytes_enviados}",
+                "# HELP oxidized_sync_push_duration_seconds_total Tempo gasto em pushes, incluindo retentativas.",
+                "# TYPE oxidized_sync_push_duration_seconds_total counter",
+                f"oxidized_sync_push_duration_seconds_total {self.push_duracao:.6f}",
+            ]
+        return "\n".join(linhas) + "\n" + self.rastros.renderizar()
+
+
+# Receptor de eventos dos hooks: processa node_fail/node_success/post_store dentro deste processo,
+# com um pool limitado de threads. Fila cheia devolve 503 e o hook usa o caminho alternativo.
+class Receptor:
+    TIPOS = ("post_store", "node_fail", "node_success")
+
+    def __init__(self, caminho_config, trabalhadores=4, capacidade=1000):
+        self.caminho_config = caminho_config
+        self.fila = queue.Queue(maxsize=capacidade)
+        self.trava = threading.Lock()
+        self.recebidos = {tipo: 0 for tipo in self.TIPOS}
+        self.rejeitados = 0
+        self.erros = 0
+        self.sucessos = set()
+        for _ in range(trabalhadores):
+            threading.Thread(target=self.trabalhar, daemon=True).start()
+
+    def enfileirar(self, tipo, dados):
+        try:
+            self.fila.put_nowait((tipo, dados))
+        except queue.Full:
+            with self.trava:
+                self.rejeitados += 1
+            return False
+        with self.trava:
+            self.recebidos[tipo] += 1
+        return True
+
+    def processar(self, tipo, dados):
+        nodo = dados.get("nodo", "")
+        if not nodo:
+            return
+        if tipo == "post_store":
+            notificar(self.caminho_config, nodo, dados.get("grupo", ""), dados.get("tempo", ""))
+        elif tipo == "node_success":
+            with self.trava:
+                self.sucessos.add(nodo)
+        elif tipo == "node_fail":
+            falhas_oxidized.registrar_falha(self.caminho_config, {
+                "nodo": nodo,
+                "grupo": dados.get("grupo", ""),
+                "status": dados.get("status", ""),
+                "erro": dados.get("erro", ""),
+                "motivo": dados.get("motivo", ""),
+            })
+
+    # Nodos com coleta bem-sucedida desde a última chamada; o laço principal zera as falhas deles em lote
+    def retirar_sucessos(self):
+        with self.trava:
+            sucessos, self.sucessos = self.sucessos, set()
+        return sucessos
+
+    def trabalhar(self):
+        while True:
+            tipo, dados = self.fila.get()
+            try:
+                self.processar(tipo, dados)
+            except Exception as e:
+                with self.trava:
+                    self.erros += 1
+                print(f"Erro ao processar evento {tipo}: {e}", flush=True)
+            finally:
+                self.fila.task_done()
+
+    def renderizar(self):
+        with self.trava:
+            linhas = [
+                "# HELP oxidized_hook_events_total Eventos de hook aceitos pelo receptor.",
+                "# TYPE oxidized_hook_events_total counter",
+            ]
+            linhas += [f'oxidized_hook_events_total{{event="{tipo}"}} {total}' for tipo, total in self.recebidos.items()]
+            linhas += [
+                "# HELP oxidized_hook_rejected_total Eventos recusados por fila cheia (backpressure).",
+                "# TYPE oxidized_hook_rejected_total counter",
+                f"oxidized_hook_rejected_total {self.rejeitados}",
+                "# HELP oxidized_hook_errors_total Eventos que falharam no processamento.",
+                "# TYPE oxidized_hook_errors_total counter",
+                f"oxidized_hook_errors_total {self.erros}",
+                "# HELP oxidized_hook_queue_depth Eventos aguardando no pool do receptor.",
+                "# TYPE oxidized_hook_queue_depth gauge",
+                f"oxidized_hook_queue_depth {self.fila.qsize()}",
+            ]
+        return "\n".join(linhas) + "\n"
+
+
+# Métricas gravadas por outros processos (ex.: manutencao_oxidized.py) em <base>/metricas/*.prom
+def metricas_externas(diretorio):
+    if not diretorio or not os.path.isdir(diretorio):
+        return ""
+    partes = []
+    for nome in sorted(os.listdir(diretorio)):
+        if nome.endswith(".prom"):
+            try:
+                with open(os.path.join(diretorio, nome)) as f:
+                    partes.append(f.read())
+            except OSError:
+                continue
+    return "".join(partes)
+
+
+# Servidor HTTP local: GET /metrics, GET /rastros?etapa=&limite= e POST /evento/<tipo> (formulário ou JSON)
+def servidor_http(metricas, porta, receptor=None, diretorio_metricas=None):
+    class Manipulador(BaseHTTPRequestHandler):
+        def responder(self, codigo, corpo=b"", tipo="text/plain"):
+            self.send_response(codigo)
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(len(corpo)))
+            if codigo == 503:
+                self.send_header("Retry-After", "1")
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def do_GET(self):
+            endereco = urllib.parse.urlsplit(self.path)
+            if endereco.path == "/rastros":
+                consulta = {k: v[-1] for k, v in urllib.parse.parse_qs(endereco.query).items()}
+                try:
+                    limite = int(consulta.get("limite", 0)) or None
+                except ValueError:
+                    self.send_error(400)
+                    return
+                corpo = json.dumps(metricas.rastros.listar(consulta.get("etapa"), limite))
+                self.responder(200, corpo.encode(), "application/json")
+                return
+            if endereco.path != "/metrics":
+                self.send_error(404)
+                return
+            texto = metricas.renderizar() + (receptor.renderizar() if receptor else "") + metricas_externas(diretorio_metricas)
+            self.responder(200, texto.encode(), "text/plain; version=0.0.4")
+
+        def do_POST(self):
+            tipo = self.path.rstrip("/").rsplit("/", 1)[-1]
+            if receptor is None or not self.path.startswith("/evento/") or tipo not in Receptor.TIPOS:
+                self.send_error(404)
+                return
+            corpo = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+            try:
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    dados = json.loads(corpo or b"{}")
+                else:
+                    dados = {k: v[-1] for k, v in urllib.parse.parse_qs(corpo.decode(), keep_blank_values=True).items()}
+            except ValueError:
+                self.send_error(400)
+                return
+            self.responder(202 if receptor.enfileirar(tipo, dados) else 503)
+
+        def log_message(self, formato, *args):
+            pass
+
+    servidor = ThreadingHTTPServer(("127.0.0.1", porta), Manipulador)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+# Move os eventos do spool para o diretório de processamento.
+# O rename é atômico: um hook que recriar o mesmo arquivo depois disso gera um novo evento.
+def coletar_eventos(dirs):
+    os.makedirs(dirs["processando"], exist_ok=True)
+    novos = []
+    with os.scandir(dirs["spool"]) as entradas:
+        for entrada in entradas:
+            if entrada.name.startswith(".") or not entrada.is_file():
+                continue
+            try:
+                os.rename(entrada.path, os.path.join(dirs["processando"], entrada.name))
+            except FileNotFoundError:
+                continue
+            novos.append(entrada.name)
+    return novos
+
+
+def descartar_eventos(dirs, eventos):
+    for nome in eventos:
+        try:
+            os.remove(os.path.join(dirs["processando"], nome))
+        except FileNotFoundError:
+            pass
+
+
+# Revisão atual do repositório configs (None se ainda não houver commits)
+def revisao_configs(dirs):
+    resultado = subprocess.run(["git", "-C", dirs["configs"], "rev-parse", "--verify", "-q", "HEAD"],
+                               capture_output=True, text=True)
+    return resultado.stdout.strip() or None
+
+
+def ler_ultimo_espelho(dirs):
+    try:
+        with open(os.path.join(dirs["repo"], ".git", "oxidized_ultimo_espelho")) as f:
+            revisao = f.read().strip()
+    except FileNotFoundError:
+        return None
+    # O commit precisa existir em configs para servir de base do diff
+    existe = subprocess.run(["git", "-C", dirs["configs"], "cat-file", "-e", f"{revisao}^{{commit}}"],
+                            stderr=subprocess.DEVNULL)
+    return revisao if existe.returncode == 0 else None
+
+
+def gravar_ultimo_espelho(dirs, revisao):
+    with open(os.path.join(dirs["repo"], ".git", "oxidized_ultimo_espelho"), "w") as f:
+        f.write(revisao + "\n")
+
+
+# Caminho no backup: arquivos sem grupo (raiz de configs) vão para default/
+def caminho_espelho(relativo):
+    if "/" not in relativo:
+        return "default/" + relativo
+    return relativo
+
+
+# Lê o conteúdo de vários arquivos de uma revisão com um único "git cat-file --batch"
+def ler_blobs(repositorio, revisao, arquivos):
+    processo = subprocess.Popen(["git", "-C", repositorio, "cat-file", "--batch"],
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    try:
+        for relativo in arquivos:
+            processo.stdin.write(f"{revisao}:{relativo}\n".encode())
+            processo.stdin.flush()
+            cabecalho = processo.stdout.readline().split()
+            if len(cabecalho) < 3 or cabecalho[1] != b"blob":
+                yield relativo, None
+                continue
+            conteudo = processo.stdout.read(int(cabecalho[2]))
+            processo.stdout.read(1)
+            yield relativo, conteudo
+    finally:
+        processo.stdin.close()
+        processo.wait()
+
+
+# Modo completo: checkout + rsync de toda a árvore (comportamento original do hook)
+def espelhar_completo(dirs, destino):
+    subprocess.run(["git", "-C", dirs["configs"], "checkout", "master", "."], stderr=subprocess.DEVNULL)
+    if not executar_comando(["rsync", "-a", "--exclude", ".git", dirs["configs"] + "/", destino + "/"]):
+        return None
+
+    with os.scandir(destino) as entradas:
+        soltos = [e.path for e in entradas if e.is_file()]
+    if soltos:
+        os.makedirs(os.path.join(destino, "default"), exist_ok=True)
+        for arquivo in soltos:
+            os.replace(arquivo, os.path.join(destino, "default", os.path.basename(arquivo)))
+    return ["equipamentos_configuracao"]
+
+
+# Modo incremental: copia direto dos objetos do git só os arquivos alterados desde o último espelho
+def espelhar_incremental(dirs, destino, desde, ate):
+    if desde == ate:
+        return []
+    resultado = subprocess.run(["git", "-C", dirs["configs"], "diff", "--name-status", "-z", "--no-renames", desde, ate],
+                               capture_output=True, check=True)
+    campos = resultado.stdout.split(b"\0")
+    alterados, removidos = [], []
+    for status, relativo in zip(campos[0::2], campos[1::2]):
+        relativo = os.fsdecode(relativo)
+        (removidos if status == b"D" else alterados).append(relativo)
+
+    for relativo in removidos:
+        try:
+            os.remove(os.path.join(destino, caminho_espelho(relativo)))
+        except FileNotFoundError:
+            pass
+
+    for relativo, conteudo in ler_blobs(dirs["configs"], ate, alterados):
+        if conteudo is None:
+            continue
+        arquivo = os.path.join(destino, caminho_espelho(relativo))
+        os.makedirs(os.path.dirname(arquivo), exist_ok=True)
+        with open(arquivo, "wb") as f:
+            f.write(conteudo)
+
+    print(f"Espelhamento incremental: {len(alterados)} alterado(s), {len(removidos)} removido(s)", flush=True)
+    return ["equipamentos_configuracao/" + caminho_espelho(r) for r in alterados + removidos]
+
+
+UNIDADES_PUSH = {"bytes": 1, "KiB": 1024, "MiB": 1024 ** 2, "GiB": 1024 ** 3}
+
+
+# Tamanho enviado, lido da linha "Writing objects: 100% (n/n), 1.20 KiB | ..." do progresso do git push
+def bytes_do_push(saida):
+    encontrados = re.findall(r"Writing objects:.*?,\s*([\d.]+)\s*(bytes|KiB|MiB|GiB)", saida)
+    if not encontrados:
+        return 0
+    valor, unidade = encontrados[-1]
+    return int(float(valor) * UNIDADES_PUSH[unidade])
+
+
+# Push sem --force (apenas fast-forward) com retentativas em backoff exponencial com jitter.
+# Se o remoto rejeitar por não ser fast-forward, "ao_rejeitar" pode rebasear o branch local antes da próxima tentativa.
+def enviar(comando, metricas, tentativas=5, atraso_base=2.0, atraso_maximo=60.0, ao_rejeitar=None):
+    for tentativa in range(1, tentativas + 1):
+        print(f"Executando: {comando} (tentativa {tentativa}/{tentativas})", flush=True)
+        inicio = time.monotonic()
+        resultado = subprocess.run(comando + ["--progress"], capture_output=True, text=True)
+        metricas.somar(push_tentativas=1, push_duracao=time.monotonic() - inicio)
+        saida = resultado.stdout + resultado.stderr
+        if resultado.returncode == 0:
+            metricas.somar(pushes=1, bytes_enviados=bytes_do_push(saida))
+            return True
+
+        print(saida.strip(), flush=True)
+        if ("non-fast-forward" in saida or "fetch first" in saida) and ao_rejeitar is not None:
+            if not ao_rejeitar():
+                break
+        if tentativa < tentativas:
+            atraso = min(atraso_maximo, atraso_base * 2 ** (tentativa - 1))
+            time.sleep(random.uniform(atraso / 2, atraso))
+    metricas.somar(push_falhas=1)
+    return False
+
+
+def url_remoto(dirs):
+    resultado = subprocess.run(["git", "-C", dirs["repo"], "config", "--get", "remote.origin.url"],
+                               capture_output=True, text=True)
+    return resultado.stdout.strip()
+
+
+# Modo replicação: envia o histórico de configs direto para um branch do remoto de backup.
+# Nenhuma cópia de arquivo é feita; o push transfere só os objetos novos e preserva o histórico por equipamento.
+def replicar_configs(dirs, revisao, branch, metricas):
+    url = url_remoto(dirs)
+    if not url:
+        print("Remoto origin não configurado em repo_sync; replicação ignorada.", flush=True)
+        return True
+    estado = os.path.join(dirs["configs"], ".git", "oxidized_ultimo_replicado")
+    if os.path.exists(estado) and open(estado).read().strip() == revisao:
+        return True
+    if not enviar(["git", "-C", dirs["configs"], "push", url, f"{revisao}:refs/heads/{branch}"], metricas):
+        return False
+    with open(estado, "w") as f:
+        f.write(revisao + "\n")
+    return True
+
+
+# Commits locais ainda não enviados (pushes que falharam ficam acumulados e saem num único push)
+def commits_pendentes(repo):
+    resultado = subprocess.run(["git", "-C", repo, "rev-list", "--count", "refs/remotes/origin/master..master"],
+                               capture_output=True, text=True)
+    if resultado.returncode != 0:
+        # Sem referência remota conhecida (primeiro push): envia se houver algum commit
+        local = subprocess.run(["git", "-C", repo, "rev-parse", "--verify", "-q", "master"], capture_output=True)
+        return 1 if local.returncode == 0 else 0
+    return int(resultado.stdout.strip() or 0)
+
+
+# repo_sync recém-criado (instalação nova ou restauração) com backup já existente no remoto:
+# parte do master remoto, para que o primeiro push seja fast-forward e o histórico continue
+def semear_repo(repo):
+    if subprocess.run(["git", "-C", repo, "rev-parse", "--verify", "-q", "HEAD"], capture_output=True).returncode == 0:
+        return
+    if subprocess.run(["git", "-C", repo, "fetch", "-q", "origin", "master"], capture_output=True).returncode != 0:
+        # Remoto vazio ou inacessível: o primeiro push cria o master (ou o rebase resolve depois)
+        return
+    executar_comando(["git", "-C", repo, "reset", "-q", "--hard", "refs/remotes/origin/master"])
+
+
+# Remoto avançou por fora: traz as mudanças e reaplica os commits locais por cima
+def rebasear_repo(repo):
+    if not executar_comando(["git", "-C", repo, "fetch", "-q", "origin", "master"]):
+        return False
+    comando = ["git", "-C", repo, "rebase", "-q"]
+    # Históricos sem ancestral comum (repo_sync criado do zero com o remoto já populado): os commits locais
+    # são reaplicados sobre o remoto e, nos conflitos add/add, vale o estado local, que é o mais recente
+    if subprocess.run(["git", "-C", repo, "merge-base", "HEAD", "refs/remotes/origin/master"],
+                      capture_output=True).returncode != 0:
+        comando += ["-X", "theirs"]
+    if executar_comando(comando + ["refs/remotes/origin/master"]):
+        return True
+    subprocess.run(["git", "-C", repo, "rebase", "--abort"], stderr=subprocess.DEVNULL)
+    return False
+
+
+# Sincronização em lote: espelhamento, estado do projeto, commit e push, uma vez por janela
+def sincronizar(caminho_config, modo_espelho="incremental", metricas=None):
+    metricas = metricas or Metricas()
+    rastros = metricas.rastros
+    dirs = caminhos(caminho_config)
+    repo = dirs["repo"]
+    destino = os.path.join(repo, "equipamentos_configuracao")
+
+    # Serializa com qualquer outro processo que mexa no repo_sync
+    with open(dirs["trava"], "w") as trava:
+        fcntl.flock(trava, fcntl.LOCK_EX)
+
+        if url_remoto(dirs):
+            semear_repo(repo)
+        os.makedirs(destino, exist_ok=True)
+        os.makedirs(os.path.join(repo, "setup", "model"), exist_ok=True)
+
+        # Modo com shards: consolida os configs das instâncias no repositório principal
+        with rastros.etapa("merge") as span:
+            try:
+                shards_oxidized.mesclar(caminho_config)
+            except subprocess.CalledProcessError as e:
+                print(f"Erro ao mesclar os shards: {e.stderr.decode(errors='replace').strip() if e.stderr else e}", flush=True)
+                span["sucesso"] = False
+                return False
+
+        # No modo replicação o push do histórico de configs faz parte desta etapa
+        with rastros.etapa("mirror", modo=modo_espelho) as span:
+            revisao = revisao_configs(dirs)
+            desde = ler_ultimo_espelho(dirs) if modo_espelho == "incremental" else None
+            if revisao is None:
+                alterados = []
+            elif modo_espelho == "replicacao":
+                alterados = [] if replicar_configs(dirs, revisao, BRANCH_REPLICACAO, metricas) else None
+            elif desde is None:
+                # Sem base conhecida (primeira execução ou modo completo): espelha tudo uma vez
+                alterados = espelhar_completo(dirs, destino)
+            else:
+                alterados = espelhar_incremental(dirs, destino, desde, revisao)
+            span["sucesso"] = alterados is not None
+            span["arquivos"] = len(alterados or [])
+        if alterados is None:
+            return False
+
+        # Estado do projeto (configuração, inventário, modelos e scripts)
+        # Das falhas só o resumo limitado é versionado; o log bruto antigo sai do repositório
+        with rastros.etapa("setup"):
+            falhas_oxidized.exportar_resumo(caminho_config)
+            log_antigo = os.path.join(repo, "setup", "last_failures.log")
+            if os.path.exists(log_antigo):
+                os.remove(log_antigo)
+            arquivos_setup = ["config", "router.db", "router.quarentena.db", "model/vrp.rb", "falhas_resumo.json"] + list(configuracao_oxidized.SCRIPTS_PROJETO)
+            for relativo in arquivos_setup:
+                origem = os.path.join(caminho_config, relativo)
+                if os.path.exists(origem):
+                    shutil.copy2(origem, os.path.join(repo, "setup", relativo))
+
+        executar_comando(["git", "-C", repo, "config", "user.name", "Oxidized"])
+        executar_comando(["git", "-C", repo, "config", "user.email", "oxidized@backup.local"])
+
+        # Só os caminhos tocados entram no "git add", sem reindexar a árvore inteira
+        with rastros.etapa("add") as span:
+            lista = "\0".join(["setup"] + alterados).encode()
+            adicao = subprocess.run(["git", "--literal-pathspecs", "-C", repo, "add", "-A",
+                                     "--pathspec-from-file=-", "--pathspec-file-nul"], input=lista)
+            span["sucesso"] = adicao.returncode == 0
+        if adicao.returncode != 0:
+            print(f"Erro ao executar o comando: git add ({adicao.returncode})", flush=True)
+            return False
+        # Na replicação nada é copiado para equipamentos_configuracao: a base do diff incremental fica onde estava
+        if revisao and modo_espelho != "replicacao":
+            gravar_ultimo_espelho(dirs, revisao)
+
+        with rastros.etapa("commit") as span:
+            # Índice igual ao último commit: nada a registrar
+            if subprocess.run(["git", "-C", repo, "diff", "--cached", "--quiet"]).returncode == 0:
+                metricas.somar(commits_pulados=1)
+                span["pulado"] = True
+            else:
+                span["sucesso"] = executar_comando(["git", "-C", repo, "commit", "-q", "-m",
+                                                    "Sincronismo Automático: Estado do Projeto e Configurações"])
+                if not span["sucesso"]:
+                    return False
+                metricas.somar(commits=1)
+
+        if not url_remoto(dirs) or commits_pendentes(repo) == 0:
+            return True
+        with rastros.etapa("push") as span:
+            span["sucesso"] = enviar(["git", "-C", repo, "push", "origin", "master"], metricas,
+                                     ao_rejeitar=lambda: rebasear_repo(repo))
+        return span["sucesso"]
+
+
+def servir(args):
+    dirs = caminhos(args.base)
+    os.makedirs(dirs["spool"], exist_ok=True)
+    metricas = Metricas(args.rastros)
+    rastros = metricas.rastros
+    receptor = Receptor(args.base, args.trabalhadores, args.capacidade)
+    servidor_http(metricas, args.porta_metricas, receptor, os.path.join(args.base, "metricas"))
+    print(f"Sincronizador ativo: spool={dirs['spool']} janela={args.janela}s atraso máximo={args.atraso_maximo}s espelho={args.espelho}", flush=True)
+
+    # Eventos que sobraram de uma execução interrompida entram no primeiro lote
+    os.makedirs(dirs["processando"], exist_ok=True)
+    pendentes = set(os.listdir(dirs["processando"]))
+    # Evento -> (horário do armazenamento, duração da coleta), para os spans por equipamento
+    chegadas = {nome: ler_evento(os.path.join(dirs["processando"], nome)) for nome in pendentes}
+    primeiro_evento = ultimo_evento = time.monotonic() if pendentes else None
+
+    ultima_compactacao = 0.0
+    while True:
+        # Uma vez por dia remove do agregado de falhas os nodos recuperados há muito tempo e os logs rotacionados vencidos
+        if time.monotonic() - ultima_compactacao >= 86400:
+            falhas_oxidized.compactar(args.base, 30 * 86400)
+            ultima_compactacao = time.monotonic()
+
+        sucessos = receptor.retirar_sucessos()
+        if sucessos:
+            falhas_oxidized.registrar_sucessos(args.base, sucessos)
+
+        novos = coletar_eventos(dirs)
+        agora = time.monotonic()
+        if novos:
+            pendentes.update(novos)
+            metricas.somar(eventos=len(novos))
+            for nome in novos:
+                armazenado, coleta = chegadas[nome] = ler_evento(os.path.join(dirs["processando"], nome))
+                if armazenado and coleta is not None:
+                    rastros.registrar("collect", armazenado - coleta, coleta, nodo=nome)
+            if primeiro_evento is None:
+                primeiro_evento = agora
+            ultimo_evento = agora
+        metricas.definir_fila(len(pendentes))
+
+        pronto = pendentes and (agora - ultimo_evento >= args.janela or agora - primeiro_evento >= args.atraso_maximo)
+        if not pronto:
+            time.sleep(args.varredura)
+            continue
+
+        lote = sorted(pendentes)
+        print(f"Sincronizando lote de {len(lote)} evento(s)...", flush=True)
+        numero_lote = rastros.novo_lote()
+        inicio, inicio_lote = time.monotonic(), time.time()
+        try:
+            sucesso = sincronizar(args.base, args.espelho, metricas)
+        except OSError as e:
+            print(f"Erro na sincronização: {e}", flush=True)
+            sucesso = False
+        duracao = time.monotonic() - inicio
+        metricas.registrar_sincronizacao(duracao, sucesso)
+        rastros.registrar("batch", inicio_lote, duracao, eventos=len(lote), sucesso=sucesso)
+        print(f"Lote {numero_lote} concluído em {duracao:.2f}s ({'ok' if sucesso else 'erro'})", flush=True)
+
+        if sucesso:
+            # Espera no spool até o lote começar e latência total do armazenamento até o backup enviado
+            fim_lote = inicio_lote + duracao
+            for nome in lote:
+                armazenado, _ = chegadas.pop(nome, (None, None))
+                if armazenado:
+                    rastros.registrar("queue", armazenado, inicio_lote - armazenado, nodo=nome)
+                    rastros.registrar("end_to_end", armazenado, fim_lote - armazenado, nodo=nome)
+            descartar_eventos(dirs, lote)
+            # Nodos com config armazenada coletaram com sucesso: zera as falhas consecutivas
+            falhas_oxidized.registrar_sucessos(args.base, [evento.split("@", 1)[-1] for evento in lote])
+            if args.snapshots:
+                try:
+                    with rastros.etapa("snapshot"):
+                        alterados, blocos, tamanho = snapshots_oxidized.capturar(args.base)
+                    print(f"Snapshot: {alterados} config(s), {blocos} bloco(s) novo(s), {tamanho} bytes", flush=True)
+                except (OSError, RuntimeError, ValueError, subprocess.CalledProcessError) as e:
+                    print(f"Erro ao gravar o snapshot: {e}", flush=True)
+            pendentes.clear()
+            primeiro_evento = ultimo_evento = None
+        else:
+            # Mantém o lote e tenta de novo na próxima janela
+            primeiro_evento = ultimo_evento = time.monotonic()
+        metricas.definir_fila(len(pendentes))
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(p / 100 * len(ordenados)))] if ordenados else 0.0
+
+
+def imprimir_rastros(args):
+    consulta = urllib.parse.urlencode({k: v for k, v in (("etapa", args.etapa), ("limite", args.limite)) if v})
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{args.porta_metricas}/rastros?{consulta}", timeout=10) as resposta:
+            spans = json.load(resposta)
+    except (OSError, ValueError) as e:
+        print(f"Sincronizador indisponível: {e}")
+        sys.exit(1)
+    if args.etapa:
+        for span in spans:
+            extras = " ".join(f"{k}={v}" for k, v in span.items() if k not in ("lote", "etapa", "inicio", "duracao"))
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(span['inicio']))} lote {span['lote']:<6} "
+                  f"{span['duracao']:>10.3f}s {extras}")
+        return
+    por_etapa = collections.defaultdict(list)
+    for span in spans:
+        por_etapa[span["etapa"]].append(span["duracao"])
+    print(f"{'etapa':<12} {'spans':>6} {'p50(s)':>9} {'p95(s)':>9} {'máx(s)':>9} {'total(s)':>10}")
+    for etapa, duracoes in sorted(por_etapa.items(), key=lambda e: -sum(e[1])):
+        print(f"{etapa:<12} {len(duracoes):>6} {percentil(duracoes, 50):>9.3f} {percentil(duracoes, 95):>9.3f} "
+              f"{max(duracoes):>9.3f} {sum(duracoes):>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sincronizador em lote do Oxidized para o repositório de backup")
+    parser.add_argument("--base", default=CAMINHO_CONFIG, help="Diretório base do Oxidized (padrão: %(default)s)")
+    parser.add_argument("--espelho", choices=["incremental", "completo", "replicacao"], default="incremental",
+                        help="incremental: só os arquivos alterados em configs; completo: rsync da árvore inteira; "
+                             f"replicacao: push do histórico de configs para o branch '{BRANCH_REPLICACAO}'")
+    sub = parser.add_subparsers(dest="acao", required=True)
+
+    p_servir = sub.add_parser("servir", help="Executa o daemon de sincronização")
+    p_servir.add_argument("--janela", type=float, default=30.0, help="Segundos sem eventos novos antes de sincronizar")
+    p_servir.add_argument("--atraso-maximo", type=float, default=300.0, help="Tempo máximo que um evento espera no lote")
+    p_servir.add_argument("--varredura", type=float, default=1.0, help="Intervalo de leitura do spool")
+    p_servir.add_argument("--porta-metricas", type=int, default=8890, help="Porta local de /metrics e /evento/<tipo>")
+    p_servir.add_argument("--trabalhadores", type=int, default=4, help="Threads que processam eventos dos hooks")
+    p_servir.add_argument("--capacidade", type=int, default=1000, help="Eventos em espera antes de responder 503")
+    p_servir.add_argument("--snapshots", action="store_true",
+                          help="Grava um snapshot deduplicado (snapshots_oxidized.py) após cada lote")
+
+    p_servir.add_argument("--rastros", type=int, default=5000, help="Spans mantidos em memória para GET /rastros")
+
+    sub.add_parser("sincronizar", help="Executa uma sincronização imediata")
+
+    p_rastros = sub.add_parser("rastros", help="Resume por etapa os spans recentes do daemon em execução")
+    p_rastros.add_argument("--porta-metricas", type=int, default=configuracao_oxidized.PORTA_SYNC)
+    p_rastros.add_argument("--etapa", help="Só esta etapa (ex.: push); mostra cada span")
+    p_rastros.add_argument("--limite", type=int, default=0, help="Só os N spans mais recentes")
+
+    p_notificar = sub.add_parser("notificar", help="Enfileira um evento manualmente")
+    p_notificar.add_argument("nodo")
+    p_notificar.add_argument("--grupo", default="")
+
+    args = parser.parse_args()
+    if args.acao == "servir":
+        servir(args)
+    elif args.acao == "sincronizar":
+        sys.exit(0 if sincronizar(args.base, args.espelho) else 1)
+    elif args.acao == "rastros":
+        imprimir_rastros(args)
+    elif args.acao == "notificar":
+        notificar(args.base, args.nodo, args.grupo)
+
+
+if __name__ == "__main__":
+    main()
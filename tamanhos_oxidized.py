@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sqlite3
+import subprocess
+
+# Tamanho e linhas dos configs calculados a partir dos objetos do git.
+#
+# Em vez de ler os arquivos da árvore de trabalho, o repositório configs é
+# percorrido só a partir do último commit processado (diff-tree) e apenas os
+# blobs novos são lidos do object store, com linhas contadas em streaming. O resultado fica num cache em disco indexado pelo SHA do
+# blob, então nodos sem alteração não custam nada.
+
+CAMINHO_CONFIG = os.getenv("OXIDIZED_HOME", "/opt/oxidized")
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS blobs (sha TEXT PRIMARY KEY, tamanho INTEGER NOT NULL, linhas INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS arquivos (caminho TEXT PRIMARY KEY, sha TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS estado (chave TEXT PRIMARY KEY, valor TEXT);
+"""
+
+
+class Medidor:
+    def __init__(self, repositorio, caminho_cache):
+        self.repositorio = repositorio
+        self.conexao = sqlite3.connect(caminho_cache, check_same_thread=False)
+        self.conexao.execute("PRAGMA journal_mode=WAL")
+        self.conexao.executescript(ESQUEMA)
+
+    # safe.directory: o exportador pode rodar com outro usuário que não o dono do repositório
+    def git(self, *argumentos, **opcoes):
+        comando = ["git", "-c", f"safe.directory={self.repositorio}", "-C", self.repositorio] + list(argumentos)
+        return subprocess.run(comando, capture_output=True, **opcoes)
+
+    def estado(self, chave):
+        linha = self.conexao.execute("SELECT valor FROM estado WHERE chave = ?", (chave,)).fetchone()
+        return linha[0] if linha else None
+
+    def commit_existe(self, revisao):
+        return revisao and self.git("cat-file", "-e", f"{revisao}^{{commit}}").returncode == 0
+
+    # Arquivos alterados entre dois commits: {caminho: sha novo ou None se removido}
+    def alteracoes(self, desde, ate):
+        if desde is None:
+            saida = self.git("ls-tree", "-r", "-z", ate, check=True).stdout
+            alterados = {}
+            for entrada in saida.split(b"\0"):
+                if not entrada:
+                    continue
+                meta, caminho = entrada.split(b"\t", 1)
+                _, tipo, sha = meta.split()
+                if tipo == b"blob":
+                    alterados[os.fsdecode(caminho)] = sha.decode()
+            return alterados
+
+        saida = self.git("diff-tree", "-r", "-z", "--no-renames", desde, ate, check=True).stdout
+        campos = saida.split(b"\0")
+        alterados = {}
+        for meta, caminho in zip(campos[0::2], campos[1::2]):
+            partes = meta.split()
+            if len(partes) < 5:
+                continue
+            sha_novo, status = partes[3].decode(), partes[4]
+            alterados[os.fsdecode(caminho)] = None if status == b"D" else sha_novo
+        return alterados
+
+    # Mede os blobs que ainda não estão no cache com um único "git cat-file --batch"
+    def medir_blobs(self, shas):
+        novos = [sha for sha in set(shas)
+                 if not self.conexao.execute("SELECT 1 FROM blobs WHERE sha = ?", (sha,)).fetchone()]
+        if not novos:
+            return 0
+        processo = subprocess.Popen(["git", "-c", f"safe.directory={self.repositorio}", "-C", self.repositorio,
+                                     "cat-file", "--batch"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        medidos = []
+        try:
+            for sha in novos:
+                processo.stdin.write(f"{sha}\n".encode())
+                processo.stdin.flush()
+                cabecalho = processo.stdout.readline().split()
+                if len(cabecalho) < 3:
+                    continue
+                tamanho = restante = int(cabecalho[2])
+                linhas, ultimo = 0, b"\n"
+                while restante:
+                    bloco = processo.stdout.read(min(restante, 1024 * 1024))
+                    linhas += bloco.count(b"\n")
+                    ultimo = bloco[-1:]
+                    restante -= len(bloco)
+                processo.stdout.read(1)
+                if tamanho and ultimo != b"\n":
+                    linhas += 1
+                medidos.append((sha, tamanho, linhas))
+        finally:
+            processo.stdin.close()
+            processo.wait()
+        with self.conexao:
+            self.conexao.executemany("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)", medidos)
+        return len(medidos)
+
+    # Processa os commits novos e devolve quantos blobs precisaram ser lidos
+    def atualizar(self):
+        resultado = self.git("rev-parse", "--verify", "-q", "HEAD", text=True)
+        cabeca = resultado.stdout.strip()
+        if not cabeca:
+            return 0
+        ultimo = self.estado("ultimo_commit")
+        if ultimo == cabeca:
+            return 0
+        desde = ultimo if self.commit_existe(ultimo) else None
+        alterados = self.alteracoes(desde, cabeca)
+        lidos = self.medir_blobs([sha for sha in alterados.values() if sha])
+        with self.conexao:
+            if desde is None:
+                self.conexao.execute("DELETE FROM arquivos")
+            self.conexao.executemany("DELETE FROM arquivos WHERE caminho = ?",
+                                     ((c,) for c, sha in alterados.items() if sha is None))
+            self.conexao.executemany("INSERT OR REPLACE INTO arquivos VALUES (?, ?)",
+                                     ((c, sha) for c, sha in alterados.items() if sha))
+            # Blobs que nenhum arquivo usa mais saem do cache
+            self.conexao.execute("DELETE FROM blobs WHERE sha NOT IN (SELECT sha FROM arquivos)")
+            self.conexao.execute("INSERT OR REPLACE INTO estado VALUES ('ultimo_commit', ?)", (cabeca,))
+        return lidos
+
+    # {caminho no repositório ("grupo/nodo" ou "nodo"): (tamanho, linhas)}
+    def medidas(self):
+        return {caminho: (tamanho, linhas) for caminho, tamanho, linhas in self.conexao.execute(
+            "SELECT a.caminho, b.tamanho, b.linhas FROM arquivos a JOIN blobs b ON a.sha = b.sha")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tamanho/linhas dos configs a partir dos objetos do git")
+    parser.add_argument("--repo", default=os.path.join(CAMINHO_CONFIG, "configs"))
+    parser.add_argument("--cache", default=os.path.join(CAMINHO_CONFIG, "tamanhos.db"))
+    args = parser.parse_args()
+
+    medidor = Medidor(args.repo, args.cache)
+    lidos = medidor.atualizar()
+    medidas = medidor.medidas()
+    for caminho, (tamanho, linhas) in sorted(medidas.items()):
+        print(f"{caminho}\t{tamanho}\t{linhas}")
+    print(f"{len(medidas)} arquivo(s), {lidos} blob(s) lido(s) nesta execução")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Os *_oxidized.py ficam soltos na raiz do repositório (são copiados assim para /opt/oxidized)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,161 @@
+import argparse
+import asyncio
+import socket
+import time
+
+import pytest
+
+import importacao_oxidized
+import inventario_oxidized
+
+CABECALHO = "# nome:ip:modelo:usuario:senha:porta_ssh:grupo\n"
+
+
+@pytest.fixture
+def ouvinte():
+    servidor = socket.socket()
+    servidor.bind(("127.0.0.1", 0))
+    servidor.listen(64)
+    yield servidor.getsockname()[1]
+    servidor.close()
+
+
+@pytest.fixture
+def porta_fechada():
+    temporario = socket.socket()
+    temporario.bind(("127.0.0.1", 0))
+    porta = temporario.getsockname()[1]
+    temporario.close()
+    return porta
+
+
+# Porta com a fila de aceite cheia: o kernel descarta os SYN seguintes e a conexão só termina por timeout
+@pytest.fixture
+def porta_sem_resposta():
+    servidor = socket.socket()
+    servidor.bind(("127.0.0.1", 0))
+    servidor.listen(0)
+    porta = servidor.getsockname()[1]
+    clientes = []
+    for _ in range(3):
+        cliente = socket.socket()
+        cliente.setblocking(False)
+        try:
+            cliente.connect(("127.0.0.1", porta))
+        except BlockingIOError:
+            pass
+        clientes.append(cliente)
+    time.sleep(0.1)
+    yield porta
+    for cliente in clientes:
+        cliente.close()
+    servidor.close()
+
+
+def registro(nome, porta, ip="127.0.0.1", grupo="default"):
+    return {"nome": nome, "ip": ip, "modelo": "ios", "usuario": "admin", "senha": "x", "porta": porta, "grupo": grupo}
+
+
+def sondar(registros, tempo_limite=0.5, tentativas=1):
+    return asyncio.run(importacao_oxidized.sondar_registros(registros, 100, tempo_limite, tentativas))
+
+
+def argumentos(base, **opcoes):
+    padroes = {"base": str(base), "concorrencia": 100, "tempo_limite": 0.5, "tentativas": 1,
+               "formato": "auto", "usuario": "admin", "senha": "x", "porta": 22, "grupo": "default",
+               "grupo_por": None, "modelo_padrao": "ios", "modelo": [], "substituir": False, "sem_sonda": False,
+               "manter_mortos": False, "simular": False, "aplicar": False, "limite_quarentena": 1.0}
+    padroes.update(opcoes)
+    return argparse.Namespace(**padroes)
+
+
+def nomes_router_db(base):
+    return [r["nome"] for _, r in inventario_oxidized.ler_linhas(str(base / "router.db")) if r]
+
+
+def test_sondagem_porta_aberta(ouvinte):
+    assert sondar([registro("r1", ouvinte)]) == {}
+
+
+def test_sondagem_conexao_recusada(porta_fechada):
+    assert sondar([registro("r1", porta_fechada)]) == {("r1", "127.0.0.1", porta_fechada): "conexão recusada"}
+
+
+def test_sondagem_timeout(porta_sem_resposta):
+    assert sondar([registro("r1", porta_sem_resposta)], tempo_limite=0.3) == \
+        {("r1", "127.0.0.1", porta_sem_resposta): "timeout"}
+
+
+def test_sondagem_endereco_nao_roteavel():
+    motivo = asyncio.run(importacao_oxidized.conectar("10.255.255.1", 22, 0.3))
+    if motivo is None:
+        pytest.skip("a rede deste ambiente responde por 10.255.255.1 (proxy/NAT)")
+    assert sondar([registro("r1", 22, ip="10.255.255.1")], tempo_limite=0.3, tentativas=2) == \
+        {("r1", "10.255.255.1", 22): motivo}
+
+
+def test_sondagem_mistura(ouvinte, porta_fechada):
+    mortos = sondar([registro("vivo", ouvinte), registro("morto", porta_fechada)])
+    assert list(mortos) == [("morto", "127.0.0.1", porta_fechada)]
+
+
+def test_mesclar_linhas_mantem_comentarios_e_ordem(tmp_path):
+    caminho = tmp_path / "router.db"
+    caminho.write_text(CABECALHO + "b:10.0.0.2:ios:admin:x:22:core\n# comentário do operador\n"
+                       "a:10.0.0.1:ios:admin:x:22:core\nc:10.0.0.3:ios:admin:x:22:core\n")
+    linhas = inventario_oxidized.ler_linhas(str(caminho))
+    texto = inventario_oxidized.mesclar_linhas(linhas, [registro("a", 2222, ip="10.0.0.1", grupo="core"),
+                                                        registro("d", 22, ip="10.0.0.4")], {"c"})
+    assert texto == (CABECALHO + "b:10.0.0.2:ios:admin:x:22:core\n# comentário do operador\n"
+                     "a:10.0.0.1:ios:admin:x:2222:core\nd:10.0.0.4:ios:admin:x:22:default\n")
+
+
+def test_mesclar_linhas_sem_router_db():
+    assert inventario_oxidized.mesclar_linhas([], [registro("a", 22)]) == \
+        CABECALHO + "a:127.0.0.1:ios:admin:x:22:default\n"
+
+
+def test_importar_substituir_remove_ausentes(tmp_path):
+    (tmp_path / "router.db").write_text(CABECALHO + "a:10.0.0.1:ios:admin:x:22:core\n# manter\n"
+                                        "b:10.0.0.2:ios:admin:x:22:core\n")
+    entrada = tmp_path / "entrada.csv"
+    entrada.write_text("nome,ip,grupo\na,10.0.0.1,core\nc,10.0.0.3,borda\n")
+
+    assert importacao_oxidized.importar(argumentos(tmp_path, arquivo=str(entrada), sem_sonda=True)) == 0
+    assert nomes_router_db(tmp_path) == ["a", "b", "c"]
+
+    assert importacao_oxidized.importar(argumentos(tmp_path, arquivo=str(entrada), sem_sonda=True,
+                                                   substituir=True)) == 0
+    assert (tmp_path / "router.db").read_text() == (CABECALHO + "a:10.0.0.1:ios:admin:x:22:core\n# manter\n"
+                                                    "c:10.0.0.3:ios:admin:x:22:borda\n")
+
+
+def test_importar_poe_mortos_em_quarentena(tmp_path, ouvinte, porta_fechada):
+    entrada = tmp_path / "entrada.json"
+    entrada.write_text(f'[{{"name": "vivo", "primary_ip4": {{"address": "127.0.0.1/32"}}, "port": {ouvinte}}},'
+                       f' {{"name": "morto", "primary_ip4": {{"address": "127.0.0.1/32"}}, "port": {porta_fechada}}}]')
+
+    assert importacao_oxidized.importar(argumentos(tmp_path, arquivo=str(entrada))) == 0
+    assert nomes_router_db(tmp_path) == ["vivo"]
+    quarentena = importacao_oxidized.ler_quarentena(str(tmp_path))
+    assert list(quarentena) == ["morto"]
+    assert quarentena["morto"][1].startswith("conexão recusada ")
+
+
+def test_sondar_aplicar_readmite_quarentena(tmp_path, ouvinte, porta_fechada):
+    (tmp_path / "router.db").write_text(CABECALHO + f"vivo:127.0.0.1:ios:admin:x:{ouvinte}:core\n# manter\n"
+                                        f"caiu:127.0.0.1:ios:admin:x:{porta_fechada}:core\n")
+    importacao_oxidized.gravar_quarentena(str(tmp_path), {"voltou": (registro("voltou", ouvinte), "timeout 2026-01-01")})
+
+    assert importacao_oxidized.sondar_inventario(argumentos(tmp_path, aplicar=True)) == 0
+    assert (tmp_path / "router.db").read_text() == (CABECALHO + f"vivo:127.0.0.1:ios:admin:x:{ouvinte}:core\n"
+                                                    f"# manter\nvoltou:127.0.0.1:ios:admin:x:{ouvinte}:default\n")
+    assert list(importacao_oxidized.ler_quarentena(str(tmp_path))) == ["caiu"]
+
+
+def test_sondar_respeita_limite_quarentena(tmp_path, porta_fechada):
+    (tmp_path / "router.db").write_text(CABECALHO + f"caiu:127.0.0.1:ios:admin:x:{porta_fechada}:core\n")
+
+    assert importacao_oxidized.sondar_inventario(argumentos(tmp_path, aplicar=True, limite_quarentena=0.2)) == 0
+    assert nomes_router_db(tmp_path) == ["caiu"]
+    assert importacao_oxidized.ler_quarentena(str(tmp_path)) == {}